@@ -0,0 +1,238 @@
+"""
+Admission control in front of the LLM and the database
+Each resource has a concurrency limit and a bounded priority queue. Chat
+requests are served before batch/report callers, and a request whose
+expected queue wait exceeds its budget is rejected at once with a retry
+hint, so overload sheds work instead of slowing every request down
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from db_connector import DB_POOL_MAX
+from metrics import ADMISSION_ACTIVE, ADMISSION_QUEUED, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ADMISSION_LLM_CONCURRENCY = int(os.getenv('ADMISSION_LLM_CONCURRENCY', 4))
+ADMISSION_DB_CONCURRENCY = int(os.getenv('ADMISSION_DB_CONCURRENCY', DB_POOL_MAX))
+ADMISSION_QUEUE_MAX = int(os.getenv('ADMISSION_QUEUE_MAX', 64))
+
+# Priority classes, lower is served first, with the longest queue wait each accepts
+PRIORITIES = {"interactive": 0, "batch": 1}
+WAIT_BUDGETS = {
+    "interactive": float(os.getenv('ADMISSION_WAIT_INTERACTIVE', 2)),
+    "batch": float(os.getenv('ADMISSION_WAIT_BATCH', 10)),
+}
+
+# Initial guess of how long a request holds a slot, until measured
+INITIAL_SERVICE_SECONDS = 0.5
+SERVICE_EWMA_WEIGHT = 0.2
+
+
+class Overloaded(Exception):
+    """A request was not admitted; retry_after is a hint in whole seconds"""
+
+    def __init__(self, resource: str, reason: str, retry_after: int):
+        super().__init__(f"{resource} is overloaded ({reason}), retry in {retry_after}s")
+        self.resource = resource
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """
+    Concurrency limit with a bounded priority queue for one resource
+
+    Waiters are admitted strictly by priority class, then arrival order.
+    A request may take several slots at once (e.g. one per tool it runs in
+    parallel). Batch callers may hold at most limit - 1 slots, so one slot is
+    always left for chat requests, and when the queue is full a chat request
+    takes the place of the newest queued batch request.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int = ADMISSION_QUEUE_MAX):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.batch_limit = max(1, self.limit - 1)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._active_batch = 0
+        self._service_seconds = INITIAL_SERVICE_SECONDS
+
+    def _weight(self, rank: int, weight: int) -> int:
+        """Slots a request takes, capped so that it can always start eventually"""
+        return max(1, min(weight, self.limit if rank == 0 else self.batch_limit))
+
+    def expected_wait(self, priority: str, weight: int = 1) -> float:
+        """Estimated queue wait for a new request of this class (call with the lock held)"""
+        rank = PRIORITIES[priority]
+        weight = self._weight(rank, weight)
+        ahead = sum(entry[3] for entry in self._waiting if entry[0] <= rank)
+        if ahead == 0 and self._can_start(rank, weight):
+            return 0.0
+        return (ahead + weight) * self._service_seconds / self.limit
+
+    def retry_after(self) -> int:
+        """Seconds until a retry is likely to be admitted"""
+        return max(1, math.ceil((len(self._waiting) + 1) * self._service_seconds / self.limit))
+
+    def check(self, priority: str, weight: int = 1):
+        """
+        Reject now if a request of this class would not be admitted in time
+
+        Raises:
+            Overloaded: The queue is full or the expected wait exceeds the budget
+        """
+        with self._cond:
+            self._check(priority, weight)
+
+    def _check(self, priority: str, weight: int = 1):
+        if len(self._waiting) >= self.max_queue and not self._can_shed(PRIORITIES[priority]):
+            self._reject(priority, "queue_full")
+        if self.expected_wait(priority, weight) > WAIT_BUDGETS[priority]:
+            self._reject(priority, "wait_budget")
+
+    def _can_shed(self, rank: int) -> bool:
+        return any(entry[0] > rank for entry in self._waiting)
+
+    def _shed_one(self):
+        """Drop the newest waiter of the lowest class; it is rejected when it wakes"""
+        victim = max(self._waiting)
+        self._waiting.remove(victim)
+        heapq.heapify(self._waiting)
+        victim[2] = True
+        self._cond.notify_all()
+
+    def _can_start(self, rank: int, weight: int = 1) -> bool:
+        if self._active + weight > self.limit:
+            return False
+        return rank == 0 or self._active_batch + weight <= self.batch_limit
+
+    def _reject(self, priority: str, reason: str):
+        ADMISSION_REJECTED.labels(self.name, priority, reason).inc()
+        raise Overloaded(self.name, reason, self.retry_after())
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", weight: int = 1):
+        """
+        Hold slots of the resource for the block
+
+        Args:
+            priority: "interactive" or "batch"
+            weight: Slots to hold, e.g. the number of tools run in parallel
+
+        Raises:
+            Overloaded: Not admitted within the class's wait budget
+        """
+        rank = PRIORITIES[priority]
+        weight = self._weight(rank, weight)
+        start = time.monotonic()
+        deadline = start + WAIT_BUDGETS[priority]
+        with self._cond:
+            self._check(priority, weight)
+            if len(self._waiting) >= self.max_queue:
+                self._shed_one()
+            # [class, arrival, shed, weight]; arrival is unique, so the rest is never compared
+            entry = [rank, next(self._seq), False, weight]
+            heapq.heappush(self._waiting, entry)
+            while not (self._waiting[0] is entry and self._can_start(rank, weight)):
+                if entry[2]:
+                    self._reject(priority, "shed")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    self._reject(priority, "timeout")
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._active += weight
+            if rank:
+                self._active_batch += weight
+            # The next waiter may be able to start as well
+            self._cond.notify_all()
+
+        admitted = time.monotonic()
+        ADMISSION_WAIT_SECONDS.labels(self.name, priority).observe(admitted - start)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= weight
+                if rank:
+                    self._active_batch -= weight
+                self._service_seconds += SERVICE_EWMA_WEIGHT * (
+                    (time.monotonic() - admitted) - self._service_seconds
+                )
+                self._cond.notify_all()
+
+    def state(self) -> Dict:
+        """Current load, for /health"""
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "queued": len(self._waiting),
+                "service_ms": round(self._service_seconds * 1000, 1),
+            }
+
+
+LIMITERS = {
+    "llm": Limiter("llm", ADMISSION_LLM_CONCURRENCY),
+    "db": Limiter("db", ADMISSION_DB_CONCURRENCY),
+}
+
+for _name, _limiter in LIMITERS.items():
+    ADMISSION_ACTIVE.labels(_name).set_function(lambda limiter=_limiter: limiter._active)
+    ADMISSION_QUEUED.labels(_name).set_function(lambda limiter=_limiter: len(limiter._waiting))
+
+
+# ============================================================================
+# REQUEST PRIORITY
+# ============================================================================
+
+_priority: ContextVar[str] = ContextVar('admission_priority', default="interactive")
+
+
+@contextmanager
+def request_priority(priority: str):
+    """
+    Run the block (and worker threads started from it) in a priority class
+
+    Args:
+        priority: "interactive" or "batch"
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def admit(resource: str, weight: int = 1):
+    """Hold weight slots of resource ("llm" or "db") in the current request's priority class"""
+    return LIMITERS[resource].slot(_priority.get(), weight)
+
+
+def check_admission(resource: str, priority: str):
+    """Reject a request up front when resource could not admit it in time"""
+    LIMITERS[resource].check(priority)
+
+
+def admission_state() -> Dict:
+    return {name: limiter.state() for name, limiter in LIMITERS.items()}
@@ -3,23 +3,58 @@ Inventory Management AI Agent - LLM-Based Tool Selection
 Uses LangChain with Google Gemini to understand queries and select appropriate tools
 """
 
-from fastapi import FastAPI, HTTPException
+import time
+_IMPORT_START = time.perf_counter()
+
+import asyncio
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import os
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-import uvicorn
 import logging
 import json
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from metrics import (
+    CONTENT_TYPE,
+    LLM_CALLS,
+    SESSION_EVENTS,
+    STAGE_SECONDS,
+    TOOL_CALLS,
+    TOOL_SECONDS,
+    render_latest,
+    timed,
+)
+from admission import PRIORITIES, Overloaded, admission_state, admit, check_admission, request_priority
+from catalog_replica import CATALOG_REPLICA, start_catalog_replica
+from change_feed import CHANGE_FEED, CHANGE_FEED_HUB, FeedFull, sse_events
+from columnar import COLUMNAR_PATH, start_columnar_refresher
+from db_connector import CancelScope, cancel_scope, current_scope, get_connector
+from llm_guard import LLM_BREAKER, LLM_BUDGET_SECONDS, CircuitOpen, LLMUnavailable, call_llm
+from llm_usage import LLM_USAGE, LLMCall, intent_of
+from local_selector import plan_follow_up, plan_warehouse_follow_up, select_tool_locally
+from profiling import PROFILE_BUFFER_SIZE, PROFILES, profiled
+from snapshot import SNAPSHOT_PATH, start_refresher_if_elected
+from query_log import QUERY_STATS
+from sessions import SESSIONS, Session, attach_entities, remember_results
 from tools import (
-    query_product_stock,
-    query_product_by_warehouse,
-    query_low_stock_products,
-    query_warehouse_summary,
-    query_general_statistics,
-    list_all_products
+    product_stock_data,
+    multi_product_stock_data,
+    product_by_warehouse_data,
+    low_stock_products_data,
+    warehouse_summary_data,
+    single_warehouse_data,
+    general_statistics_data,
+    all_products_data,
+    value_breakdown_data,
+    movement_history_data,
+    stockout_forecast_data,
+    rebalance_transfers_data,
+    render_text,
+    tool_result,
 )
 
 # Configure logging
@@ -31,69 +66,187 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 AI_PORT = int(os.getenv('AI_PORT', 8000))
 
+AI_WARMUP = os.getenv('AI_WARMUP', '0').lower() in ('1', 'true', 'yes')
+TOOL_TIMEOUT_SECONDS = float(os.getenv('TOOL_TIMEOUT_SECONDS', 10))
+TOOL_WORKERS = int(os.getenv('TOOL_WORKERS', 8))
+MAX_TOOL_CALLS = 4
+QUERY_TIMEOUT_SECONDS = float(os.getenv('QUERY_TIMEOUT_SECONDS', 30))
+DISCONNECT_POLL_SECONDS = 0.25
+
 if not GEMINI_API_KEY:
-    logger.error("❌ GEMINI_API_KEY not found in environment variables!")
-    raise ValueError("GEMINI_API_KEY is required")
+    logger.warning("⚠️ GEMINI_API_KEY not set - using keyword-based tool selection")
 
 
 # ============================================================================
-# INITIALIZE LLM
+# INITIALIZE LLM (lazily, on first use)
 # ============================================================================
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    temperature=0,
-    max_tokens=1000,
-    timeout=30,
-    max_retries=2,
-    google_api_key=GEMINI_API_KEY
-)
+_tool_selector = None
+_tool_selector_lock = threading.Lock()
 
-logger.info("✅ LLM initialized: Google Gemini 2.5 Flash")
+
+def get_tool_selector():
+    """
+    Build the prompt | LLM chain once and reuse it for every query
+    LangChain and the Gemini client are only imported here
+    
+    Returns:
+        The tool selector chain, or None if no LLM is configured
+    """
+    global _tool_selector
+    if _tool_selector is None and GEMINI_API_KEY:
+        with _tool_selector_lock:
+            if _tool_selector is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                from langchain_core.prompts import ChatPromptTemplate
+                
+                llm = ChatGoogleGenerativeAI(
+                    model="gemini-2.5-flash",
+                    temperature=0,
+                    max_tokens=1000,
+                    # call_llm enforces the budget and hedges; retries would only add latency
+                    timeout=LLM_BUDGET_SECONDS,
+                    max_retries=0,
+                    google_api_key=GEMINI_API_KEY
+                )
+                prompt = ChatPromptTemplate.from_template(TOOL_SELECTOR_PROMPT)
+                _tool_selector = prompt | llm
+                logger.info("✅ LLM initialized: Google Gemini 2.5 Flash")
+    return _tool_selector
 
 
 # ============================================================================
 # TOOL SELECTION WITH LLM
 # ============================================================================
 
-TOOL_SELECTOR_PROMPT = """You are an inventory management assistant. Analyze the user's query and determine which tool to use.
+# Kept short: it is sent with every call. The query comes last so the
+# instructions are an identical prefix for every request.
+TOOL_SELECTOR_PROMPT = """Pick the inventory tools that answer the query.
+
+Tools:
+list_products - all products
+product_stock(product_name) - stock of a product; for several use "product_names": [...]
+product_location(product_name) - where a product is stored
+low_stock - products to reorder
+warehouse_summary - inventory per warehouse
+general_stats(exact optional) - totals and counts; "exact": true only if exact figures are asked for
+value_breakdown - value by category and warehouse
+movement_history(product_name optional) - recent receipts, deliveries, transfers
+stockout_forecast(product_name optional, days optional) - what will run out soon, e.g. next week = 7 days
+rebalance(product_name optional) - suggest internal transfers between locations
+
+One call per distinct question. Reply with JSON only, no markdown:
+{{"calls": [{{"tool": "...", "product_name": null}}], "reason": "..."}}
 
-Available tools:
-1. "list_products" - Use when user asks for all products, product list, or what products exist
-2. "product_stock" - Use when user asks about stock level of a specific product (e.g., "how much X do we have", "stock of X")
-3. "product_location" - Use when user asks where a product is stored or which warehouse has it
-4. "low_stock" - Use when user asks about low stock items, products that need reordering, or stock below threshold
-5. "warehouse_summary" - Use when user asks for warehouse overview, inventory summary by warehouse, or warehouse statistics
-6. "general_stats" - Use when user asks for general statistics, total inventory, or overall inventory information
+Examples:
+"How much copper do we have and where is it?" -> {{"calls": [{{"tool": "product_stock", "product_name": "copper"}}, {{"tool": "product_location", "product_name": "copper"}}], "reason": "stock and location"}}
+"Stock of aluminium, copper and steel" -> {{"calls": [{{"tool": "product_stock", "product_names": ["aluminium", "copper", "steel"]}}], "reason": "several products"}}
 
-USER QUERY: {query}
+Query: {query}"""
 
-Respond with ONLY a JSON object (no markdown, no code blocks):
-{{
-  "tool": "tool_name_here",
-  "product_name": "product name if needed, otherwise null",
-  "reason": "brief explanation"
-}}
 
-Examples:
-- "What products do we have?" → {{"tool": "list_products", "product_name": null, "reason": "User wants product list"}}
-- "How much aluminum?" → {{"tool": "product_stock", "product_name": "aluminum", "reason": "User asks for specific product stock"}}
-- "Where is copper stored?" → {{"tool": "product_location", "product_name": "copper", "reason": "User asks for product location"}}
-- "Low stock items?" → {{"tool": "low_stock", "product_name": null, "reason": "User asks for low stock products"}}
-- "Warehouse summary" → {{"tool": "warehouse_summary", "product_name": null, "reason": "User asks for warehouse overview"}}
-- "How many products total?" → {{"tool": "general_stats", "product_name": null, "reason": "User asks for statistics"}}
-"""
+def normalize_plan(selection: dict) -> dict:
+    """
+    Turn a tool selection into a plan of at most MAX_TOOL_CALLS distinct calls
+    Accepts both {"calls": [...]} and the single {"tool": ...} form. Stock
+    questions about several products become one multi_product_stock call
+    
+    Args:
+        selection: Parsed selector output
+        
+    Returns:
+        Plan with "calls" (list of {"tool", "product_name"}, plus "days"
+        for forecasts, "exact" for statistics and "warehouse" for a
+        single-warehouse summary) and "reason"
+    """
+    raw_calls = selection.get("calls")
+    if raw_calls is None:
+        raw_calls = [selection]
+    
+    calls = []
+    for call in raw_calls:
+        if not isinstance(call, dict) or not call.get("tool"):
+            continue
+        names = call.get("product_names")
+        if not isinstance(names, list):
+            names = [call.get("product_name")]
+        for name in names:
+            single = {"tool": call["tool"], "product_name": name}
+            if isinstance(call.get("days"), int) and call["days"] > 0:
+                single["days"] = call["days"]
+            if call.get("exact") is True:
+                single["exact"] = True
+            if isinstance(call.get("warehouse"), str) and call["warehouse"]:
+                single["warehouse"] = call["warehouse"]
+            if single not in calls:
+                calls.append(single)
+    
+    if not calls:
+        raise ValueError("Tool selection contains no tool calls")
+    return {"calls": merge_stock_calls(calls)[:MAX_TOOL_CALLS], "reason": selection.get("reason", "")}
 
 
+def merge_stock_calls(calls: list) -> list:
+    """
+    Replace two or more product_stock calls with one multi_product_stock call
+    at the place of the first, so their products are looked up together
+    (the tool reports the names beyond MAX_BATCH_PRODUCTS it skips)
+    """
+    names = [call["product_name"] for call in calls
+             if call["tool"] == "product_stock" and call["product_name"]]
+    if len(names) < 2:
+        return calls
+    
+    merged = []
+    for call in calls:
+        if call["tool"] != "product_stock" or not call["product_name"]:
+            merged.append(call)
+        elif call["product_name"] == names[0]:
+            merged.append({
+                "tool": "multi_product_stock",
+                "product_name": None,
+                "product_names": names,
+            })
+    return merged
+
+
+def select_tool_fallback(user_query: str, reason: str) -> dict:
+    """Plan with keyword rules when the LLM is unavailable or its answer is unusable"""
+    plan = normalize_plan(select_tool_locally(user_query))
+    plan["reason"] = f"{reason}; {plan['reason']}"
+    return plan
+
+
+@timed(STAGE_SECONDS, "select_tool_with_llm")
+@profiled("select_tool_with_llm")
 def select_tool_with_llm(user_query: str) -> dict:
     """
-    Use LLM to analyze query and select appropriate tool
+    Use LLM to analyze query and plan the tool calls that answer it
+    Falls back to keyword rules when no LLM is configured, today's LLM budget
+    is used up, the circuit breaker is open, the call exceeds its latency
+    budget, or the answer can't be parsed
+    
+    Returns:
+        Plan with "calls" and "reason", see normalize_plan
     """
+    chain = get_tool_selector()
+    if chain is None:
+        return normalize_plan(select_tool_locally(user_query))
+    
+    exhausted = LLM_USAGE.exhausted()
+    if exhausted:
+        LLM_CALLS.labels("over_budget").inc()
+        logger.warning(f"💸 {exhausted} - using keyword-based tool selection")
+        return select_tool_fallback(user_query, exhausted)
+    
+    llm_call, start = LLM_USAGE.track(TOOL_SELECTOR_PROMPT + user_query), None
     try:
-        prompt = ChatPromptTemplate.from_template(TOOL_SELECTOR_PROMPT)
-        chain = prompt | llm | StrOutputParser()
+        from langchain_core.output_parsers import StrOutputParser
         
-        response = chain.invoke({"query": user_query})
+        with admit("llm"):
+            start = time.perf_counter()
+            message = call_llm(lambda: chain.invoke({"query": user_query}), on_request=llm_call.sent)
+        response = StrOutputParser().invoke(message)
         
         # Parse JSON response
         # Remove markdown code blocks if present
@@ -104,50 +257,212 @@ def select_tool_with_llm(user_query: str) -> dict:
                 response = response[4:]
         response = response.strip()
         
-        tool_selection = json.loads(response)
-        return tool_selection
+        plan = normalize_plan(json.loads(response))
+        LLM_USAGE.record(llm_call, time.perf_counter() - start, intent_of(plan))
+        return plan
     
-    except json.JSONDecodeError as e:
+    except LLMUnavailable as e:
+        logger.warning(f"⚠️ {e} - using keyword-based tool selection")
+        if not isinstance(e, CircuitOpen):
+            record_failed_call(llm_call, start, "unavailable")
+        return select_tool_fallback(user_query, "LLM unavailable")
+    except Overloaded as e:
+        logger.warning(f"⚠️ {e} - using keyword-based tool selection")
+        return select_tool_fallback(user_query, "LLM busy")
+    except (json.JSONDecodeError, ValueError) as e:
         logger.error(f"Failed to parse LLM response: {e}")
-        return {"tool": "list_products", "product_name": None, "reason": "Error parsing response"}
+        record_failed_call(llm_call, start, "unparsed")
+        return select_tool_fallback(user_query, "Error parsing response")
     except Exception as e:
         logger.error(f"Tool selection error: {e}")
-        return {"tool": "list_products", "product_name": None, "reason": "Error selecting tool"}
+        record_failed_call(llm_call, start, "error")
+        return select_tool_fallback(user_query, "Error selecting tool")
+
+
+def record_failed_call(llm_call: LLMCall, start: float, outcome: str):
+    """Account for an LLM call that produced no plan (not for calls never made)"""
+    if start is not None:
+        LLM_USAGE.record(llm_call, time.perf_counter() - start, f"({outcome})", outcome)
+
+
+def plan_query(user_query: str, session: Session) -> dict:
+    """
+    Plan the tool calls for a query, using what the session already knows
+    A follow-up that names no product ("and where is it stored?") is planned
+    with keyword rules around the session's product, without the LLM; one
+    about "that warehouse" is a summary of the session's warehouse
+    
+    Args:
+        user_query: Natural language question
+        session: Conversation session of the query
+        
+    Returns:
+        Plan with "calls" and "reason"; calls about the session's product carry it
+    """
+    warehouse = session.recall("warehouse")
+    if warehouse is not None:
+        plan = plan_warehouse_follow_up(user_query, warehouse["name"])
+        if plan is not None:
+            SESSION_EVENTS.labels("follow_up").inc()
+            return normalize_plan(plan)
+    product = session.recall("product")
+    if product is not None:
+        plan = plan_follow_up(user_query, product["name"])
+        if plan is not None:
+            SESSION_EVENTS.labels("follow_up").inc()
+            plan = normalize_plan(plan)
+            plan["reason"] = f"Follow-up about {product['name']}; {plan['reason']}"
+            return attach_entities(plan, session)
+    return attach_entities(select_tool_with_llm(user_query), session)
+
+
+TOOL_NAMES = (
+    "list_products",
+    "product_stock",
+    "multi_product_stock",
+    "product_location",
+    "low_stock",
+    "warehouse_summary",
+    "general_stats",
+    "value_breakdown",
+    "movement_history",
+    "stockout_forecast",
+    "rebalance",
+)
 
 
 def execute_tool(tool_name: str, product_name: str = None) -> str:
     """
-    Execute the selected tool
+    Execute the selected tool and render its result as chat text
     """
+    return render_text(execute_tool_structured(tool_name, product_name))
+
+
+@profiled("execute_tool", lambda tool_name, *args, **kwargs: tool_name)
+def execute_tool_structured(tool_name: str, product_name: str = None, product: dict = None,
+                            product_names: list = None, days: int = None, exact: bool = False,
+                            warehouse: str = None) -> dict:
+    """
+    Execute the selected tool and return its structured result
+    """
+    start = time.perf_counter()
     try:
-        if tool_name == "list_products":
-            return list_all_products()
-        
-        elif tool_name == "product_stock":
-            if not product_name:
-                return "❌ Please specify which product you want to check the stock for."
-            return query_product_stock(product_name)
-        
-        elif tool_name == "product_location":
-            if not product_name:
-                return "❌ Please specify which product you want to find."
-            return query_product_by_warehouse(product_name)
-        
-        elif tool_name == "low_stock":
-            return query_low_stock_products()
-        
-        elif tool_name == "warehouse_summary":
-            return query_warehouse_summary()
-        
-        elif tool_name == "general_stats":
-            return query_general_statistics()
-        
-        else:
-            return f"❌ Unknown tool: {tool_name}"
-    
+        result = _run_tool(tool_name, product_name, product, product_names, days, exact, warehouse)
     except Exception as e:
         logger.error(f"Tool execution error: {e}")
-        return f"❌ Error executing tool: {str(e)}"
+        result = tool_result(tool_name, "error", f"❌ Error executing tool: {str(e)}")
+    
+    tool_label = tool_name if tool_name in TOOL_NAMES else "unknown"
+    TOOL_SECONDS.labels(tool_label).observe(time.perf_counter() - start)
+    TOOL_CALLS.labels(tool_label, "error" if result["status"] == "error" else "ok").inc()
+    return result
+
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+def execute_plan(calls: list, timeout: float = None) -> list:
+    """
+    Run the planned tool calls concurrently
+    Each call gets its own timeout; results come back in plan order
+    
+    Args:
+        calls: List of {"tool", "product_name"} from the plan
+        timeout: Seconds each call may take (default TOOL_TIMEOUT_SECONDS)
+        
+    Returns:
+        Structured result for each call
+    """
+    timeout = TOOL_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    # One cancel scope per call, so a call that times out stops its SQL
+    scopes = [CancelScope(current_scope()) for _ in calls]
+    futures = [
+        _tool_executor.submit(
+            contextvars.copy_context().run,
+            _execute_in_scope, scope, call["tool"], call.get("product_name"), call.get("product"),
+            call.get("product_names"), call.get("days"), call.get("exact", False), call.get("warehouse")
+        )
+        for call, scope in zip(calls, scopes)
+    ]
+    
+    results = []
+    for call, scope, future in zip(calls, scopes, futures):
+        try:
+            results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeout:
+            scope.cancel()
+            logger.error(f"⏱️ Tool {call['tool']} timed out after {timeout}s")
+            TOOL_CALLS.labels(call["tool"] if call["tool"] in TOOL_NAMES else "unknown", "timeout").inc()
+            results.append(tool_result(call["tool"], "timeout", f"⏱️ {call['tool']} took too long and was skipped."))
+    return results
+
+
+def _execute_in_scope(scope: CancelScope, tool_name: str, product_name: str = None,
+                      product: dict = None, product_names: list = None, days: int = None,
+                      exact: bool = False, warehouse: str = None) -> dict:
+    with cancel_scope(scope):
+        return execute_tool_structured(tool_name, product_name, product, product_names, days, exact, warehouse)
+
+
+def render_results(results: list) -> str:
+    """Render the results of a plan as one chat response"""
+    return "\n".join(render_text(result) for result in results)
+
+
+def _run_tool(tool_name: str, product_name: str = None, product: dict = None,
+              product_names: list = None, days: int = None, exact: bool = False,
+              warehouse: str = None) -> dict:
+    """
+    Dispatch to the tool function for tool_name
+    product is a product resolved earlier in the session, used instead of searching for product_name
+    days is the forecast horizon, when the query gave one
+    exact asks for full counts instead of estimated statistics
+    warehouse limits the warehouse summary to one warehouse
+    """
+    if tool_name == "list_products":
+        return all_products_data()
+    
+    elif tool_name == "product_stock":
+        if not product_name and not product:
+            return tool_result(tool_name, "invalid", "❌ Please specify which product you want to check the stock for.")
+        return product_stock_data(product_name, product)
+    
+    elif tool_name == "multi_product_stock":
+        if not product_names:
+            return tool_result(tool_name, "invalid", "❌ Please specify which products you want to check the stock for.")
+        return multi_product_stock_data(product_names)
+    
+    elif tool_name == "product_location":
+        if not product_name and not product:
+            return tool_result(tool_name, "invalid", "❌ Please specify which product you want to find.")
+        return product_by_warehouse_data(product_name, product)
+    
+    elif tool_name == "low_stock":
+        return low_stock_products_data()
+    
+    elif tool_name == "warehouse_summary":
+        if warehouse:
+            return single_warehouse_data(warehouse)
+        return warehouse_summary_data()
+    
+    elif tool_name == "general_stats":
+        return general_statistics_data(exact)
+    
+    elif tool_name == "value_breakdown":
+        return value_breakdown_data()
+    
+    elif tool_name == "movement_history":
+        return movement_history_data(product_name, product=product)
+    
+    elif tool_name == "stockout_forecast":
+        return stockout_forecast_data(product_name, days, product)
+    
+    elif tool_name == "rebalance":
+        return rebalance_transfers_data(product_name, product)
+    
+    else:
+        return tool_result(tool_name, "invalid", f"❌ Unknown tool: {tool_name}")
 
 
 # ============================================================================
@@ -172,6 +487,59 @@ app.add_middleware(
 )
 
 
+# ============================================================================
+# STARTUP
+# ============================================================================
+
+# Optional warm-up steps, run in order when AI_WARMUP is enabled
+WARMUP_STEPS = [
+    ("db_pool", lambda: get_connector().warm_up()),
+    ("llm_chain", get_tool_selector),
+]
+
+STARTUP_REPORT = {
+    "import_ms": round((time.perf_counter() - _IMPORT_START) * 1000, 1),
+    "warmup_ms": {},
+    "llm_configured": bool(GEMINI_API_KEY),
+}
+
+
+def warm_up() -> dict:
+    """
+    Run the warm-up steps and record how long each took
+    
+    Returns:
+        Step name to duration in milliseconds
+    """
+    timings = {}
+    for name, step in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"❌ Warm-up step {name} failed: {e}")
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+@app.on_event("startup")
+async def startup():
+    """Warm up (if enabled) and log the startup-time report"""
+    if AI_WARMUP:
+        STARTUP_REPORT["warmup_ms"] = warm_up()
+    # Loads in the background; /health reports when it is ready
+    STARTUP_REPORT["catalog_replica"] = CATALOG_REPLICA and start_catalog_replica(get_connector()) is not None
+    if COLUMNAR_PATH:
+        STARTUP_REPORT["columnar_refresher"] = start_columnar_refresher(get_connector())
+    if SNAPSHOT_PATH:
+        STARTUP_REPORT["snapshot_refresher"] = start_refresher_if_elected(get_connector())
+    STARTUP_REPORT["ready_ms"] = round((time.perf_counter() - _IMPORT_START) * 1000, 1)
+    logger.info(
+        f"⏱️ Ready in {STARTUP_REPORT['ready_ms']} ms "
+        f"(import {STARTUP_REPORT['import_ms']} ms, warm-up {STARTUP_REPORT['warmup_ms']})"
+    )
+
+
 # ============================================================================
 # ENDPOINTS
 # ============================================================================
@@ -193,16 +561,142 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "Inventory AI Agent",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "startup": STARTUP_REPORT,
+        "llm_circuit": LLM_BREAKER.state,
+        "admission": admission_state(),
+        "change_feed": CHANGE_FEED_HUB.state(),
+        "catalog_replica_ready": bool(get_connector().catalog and get_connector().catalog.ready)
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency, tool calls, tokens, pool usage"""
+    return Response(content=render_latest(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/llm")
+async def debug_llm(limit: int = 10):
+    """Today's LLM calls and tokens against the budgets, intents by LLM time, recent calls"""
+    return LLM_USAGE.report(limit)
+
+
+@app.get("/debug/queries")
+async def debug_queries(limit: int = 10, order_by: str = "total_ms"):
+    """Top SQL statements by total time, plus recently captured slow-query plans"""
+    return {
+        "top": QUERY_STATS.top(limit, order_by),
+        "explains": QUERY_STATS.explains(limit),
+    }
+
+
+@app.get("/debug/profiles")
+async def debug_profiles(limit: int = 10):
+    """Recent request profiles and the allocation sites that grew most across them"""
+    return PROFILES.report(limit)
+
+
+@app.get("/debug/profiles/{profile_id}")
+async def debug_profile(profile_id: str):
+    """One request profile: stages with their allocations, and CPU hot spots per stage"""
+    profile = PROFILES.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No profile {profile_id} (only the last {PROFILE_BUFFER_SIZE} are kept)")
+    return profile
+
+
+@app.get("/changes")
+async def stock_changes(request: Request):
+    """
+    Server-Sent Events stream of stock level changes and recorded moves
+    Clients apply the deltas instead of polling; on a "resync" event they re-fetch
+    """
+    if not CHANGE_FEED:
+        raise HTTPException(status_code=404, detail="Change feed is disabled (CHANGE_FEED=0)")
+    try:
+        subscription = CHANGE_FEED_HUB.subscribe()
+    except FeedFull as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)}, headers={"Retry-After": "30"})
+    return StreamingResponse(
+        sse_events(subscription, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def overloaded_response(error: Overloaded) -> JSONResponse:
+    """429 with a Retry-After hint for a request refused by admission control"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(error), "resource": error.resource, "retry_after": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def answer_query(query: str, format: str = "text", session_id: str = None,
+                 profile_trigger: str = None) -> dict:
+    """
+    Plan and run the tools for a query (blocking, runs in a worker thread)
+    
+    Args:
+        query: Natural language question about inventory
+        format: "text" for the chat response, "json" for the structured rows
+        session_id: Session of earlier questions in the conversation, if any
+        profile_trigger: "requested" or "sampled" to profile the query
+            (see profiling.py), None otherwise
+        
+    Returns:
+        Response payload for /query, with "profile_id" when it was profiled
+    """
+    with PROFILES.capture(query, profile_trigger) as profile:
+        payload = _answer_query(query, format, session_id)
+    if profile is not None:
+        payload["profile_id"] = profile.profile_id
+    return payload
+
+
+def _answer_query(query: str, format: str, session_id: str) -> dict:
+    logger.info(f"📝 Processing query: {query}")
+    session = SESSIONS.get_or_create(session_id)
+    
+    # Step 1: Plan the tool calls (LLM, or the session for follow-ups)
+    logger.info("🧠 Analyzing query...")
+    plan = plan_query(query, session)
+    tools_used = [call['tool'] for call in plan['calls']]
+    logger.info(f"🔧 Selected tools: {', '.join(tools_used)} | Reason: {plan['reason']}")
+    
+    # Step 2: Execute the planned tools concurrently, one db slot per tool
+    with admit("db", len(plan['calls'])):
+        results = execute_plan(plan['calls'])
+    remember_results(session, plan['calls'], results)
+    
+    payload = {
+        "query": query,
+        "tool_used": ", ".join(tools_used),
+        "tools_used": tools_used,
+        "session_id": session.session_id,
+        "success": True
+    }
+    if format == "json":
+        payload["results"] = results
+        payload["session"] = session.summary()
+    else:
+        payload["response"] = render_results(results)
+    return payload
+
+
 @app.post("/query")
-async def query_inventory(query: str):
+async def query_inventory(request: Request, query: str, format: str = "text", session_id: str = None,
+                          priority: str = "interactive", profile: str = None):
     """
     Query the inventory system with natural language.
     The LLM analyzes the query and automatically selects the right tool.
     
+    The work runs off the event loop. If the client disconnects or the query
+    takes longer than QUERY_TIMEOUT_SECONDS, its running SQL is cancelled.
+    Under overload the query is refused with 429 and a Retry-After header.
+    
     Query Examples:
     - "What products do we have?"
     - "How much aluminum do we have?"
@@ -213,40 +707,79 @@ async def query_inventory(query: str):
     
     Args:
         query: Natural language question about inventory
+        format: "text" for the chat response, "json" for the structured rows
+        session_id: session_id from an earlier response, so follow-ups
+            ("and where is it stored?") reuse the product it resolved
+        priority: "interactive" for chat, "batch" for reports and scripts
+            (queued behind chat requests)
+        profile: "1" (or PROFILE_TOKEN, when set) to profile memory and CPU
+            of this query, like the X-Profile header; see /debug/profiles
         
     Returns:
         Response from inventory system
     """
+    if format not in ("text", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'text' or 'json'")
+    if not query or len(query.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    
+    # Refuse at once when the database could not take the query within its budget
     try:
-        if not query or len(query.strip()) == 0:
-            raise HTTPException(status_code=400, detail="Query cannot be empty")
-        
-        logger.info(f"📝 Processing query: {query}")
-        
-        # Step 1: Use LLM to select tool
-        logger.info("🧠 Analyzing query with LLM...")
-        tool_selection = select_tool_with_llm(query)
-        logger.info(f"🔧 Selected tool: {tool_selection['tool']} | Reason: {tool_selection['reason']}")
-        
-        # Step 2: Execute the selected tool
-        response = execute_tool(tool_selection['tool'], tool_selection.get('product_name'))
-        
-        return {
-            "query": query,
-            "response": response,
-            "tool_used": tool_selection['tool'],
-            "success": True
-        }
+        check_admission("db", priority)
+    except Overloaded as e:
+        logger.warning(f"🚦 Rejected {priority} query: {e}")
+        return overloaded_response(e)
+    
+    profile_trigger = PROFILES.trigger(request.headers.get("x-profile") or profile)
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + QUERY_TIMEOUT_SECONDS
+    with cancel_scope() as scope, request_priority(priority):
+        # The task copies the context, so the worker thread runs in this scope
+        task = asyncio.ensure_future(asyncio.to_thread(answer_query, query, format, session_id, profile_trigger))
+    
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if task.done():
+                break
+            if await request.is_disconnected():
+                scope.cancel()
+                logger.warning(f"🛑 Client disconnected, cancelled query: {query}")
+                return Response(status_code=499)
+            if loop.time() >= deadline:
+                scope.cancel()
+                logger.error(f"⏱️ Query timed out after {QUERY_TIMEOUT_SECONDS}s: {query}")
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"Query took longer than {QUERY_TIMEOUT_SECONDS:.0f}s"
+                )
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
     
+    try:
+        payload = task.result()
+    except Overloaded as e:
+        logger.warning(f"🚦 Rejected {priority} query: {e}")
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"❌ Error processing query: {e}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Error processing query: {str(e)}"
         )
+    
+    if format == "json":
+        return JSONResponse(payload)
+    return payload
 
 
 if __name__ == "__main__":
+    import uvicorn
+    
     logger.info(f"🚀 Starting Inventory AI Agent on port {AI_PORT}")
     logger.info(f"📚 API docs: http://localhost:{AI_PORT}/docs")
     logger.info(f"⏹️  Press Ctrl+C to stop")
@@ -0,0 +1,256 @@
+"""
+In-process read replica of the product catalog
+Keeps products and product_categories in memory, synced by polling
+updated_at, so product-name lookups need no database round trip
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from db_connector import raising_errors
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CATALOG_REPLICA = os.getenv('CATALOG_REPLICA', '1').lower() in ('1', 'true', 'yes')
+CATALOG_SYNC_SECONDS = float(os.getenv('CATALOG_SYNC_SECONDS', 5))
+CATALOG_FULL_SYNC_SECONDS = float(os.getenv('CATALOG_FULL_SYNC_SECONDS', 300))
+# updated_at is the writing transaction's start time, so a row can commit with a
+# timestamp older than the watermark. Re-reading this window catches those rows.
+CATALOG_SYNC_OVERLAP_SECONDS = float(os.getenv('CATALOG_SYNC_OVERLAP_SECONDS', 60))
+
+PRODUCTS_QUERY = """
+    SELECT
+        product_id,
+        name,
+        sku_code,
+        unit_of_measure,
+        per_unit_cost,
+        category_id,
+        updated_at
+    FROM products
+"""
+
+CATEGORIES_QUERY = """
+    SELECT
+        category_id,
+        name,
+        updated_at
+    FROM product_categories
+"""
+
+# Fields returned by search_products / get_product_by_fuzzy_name, as in SQL
+PRODUCT_FIELDS = ('product_id', 'name', 'sku_code', 'unit_of_measure', 'per_unit_cost')
+
+
+class CatalogReplica:
+    """
+    Products and categories held in memory
+
+    sync_full() loads both tables and drops rows deleted upstream.
+    sync_delta() only reads rows changed since the last sync. Reads answer
+    like the matching InventoryDBConnector methods.
+    """
+
+    def __init__(self, connector):
+        self.connector = connector
+        self._products: Dict[int, Dict] = {}
+        self._categories: Dict[int, str] = {}
+        self._by_name: List[Dict] = []
+        self._watermark: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self.ready = False
+        self.last_sync = 0.0
+        self.last_full_sync = 0.0
+
+    # ------------------------------------------------------------------------
+    # Syncing
+    # ------------------------------------------------------------------------
+
+    def sync_full(self) -> Dict:
+        """
+        Reload the whole catalog
+
+        Returns:
+            Product and category counts
+        """
+        # A failed read raises and keeps the replica as it was; an empty
+        # products table is a valid (empty) catalog
+        with raising_errors():
+            products = self.connector.execute_query(PRODUCTS_QUERY)
+            categories = self.connector.execute_query(CATEGORIES_QUERY)
+
+        product_map = {row['product_id']: self._product_row(row) for row in products}
+        category_map = {row['category_id']: row['name'] for row in categories}
+        with self._lock:
+            self._products = product_map
+            self._categories = category_map
+            self._watermark = _max_updated_at(products + categories, None)
+            self._reindex()
+            self.ready = True
+            self.last_sync = self.last_full_sync = time.time()
+        return {'products': len(product_map), 'categories': len(category_map)}
+
+    def sync_delta(self) -> int:
+        """
+        Apply rows changed since the last sync (inserts and updates, not deletes)
+
+        Returns:
+            Number of changed rows applied
+        """
+        if self._watermark is None:
+            return sum(self.sync_full().values())
+
+        since = self._watermark - timedelta(seconds=CATALOG_SYNC_OVERLAP_SECONDS)
+        products = self.connector.execute_query(
+            PRODUCTS_QUERY + " WHERE updated_at >= %s", (since,)
+        )
+        categories = self.connector.execute_query(
+            CATEGORIES_QUERY + " WHERE updated_at >= %s", (since,)
+        )
+
+        changed = 0
+        with self._lock:
+            for row in products:
+                new = self._product_row(row)
+                if self._products.get(row['product_id']) != new:
+                    self._products[row['product_id']] = new
+                    changed += 1
+            for row in categories:
+                if self._categories.get(row['category_id']) != row['name']:
+                    self._categories[row['category_id']] = row['name']
+                    changed += 1
+            self._watermark = _max_updated_at(products + categories, self._watermark)
+            if changed:
+                self._reindex()
+            self.last_sync = time.time()
+        return changed
+
+    def sync(self):
+        """Delta sync, or full reconciliation when it is due"""
+        if time.time() - self.last_full_sync >= CATALOG_FULL_SYNC_SECONDS:
+            counts = self.sync_full()
+            logger.info(f"📇 Catalog replica reloaded: {counts}")
+        else:
+            changed = self.sync_delta()
+            if changed:
+                logger.info(f"📇 Catalog replica applied {changed} changes")
+
+    def _product_row(self, row: Dict) -> Dict:
+        product = {field: row[field] for field in PRODUCT_FIELDS}
+        product['category_id'] = row['category_id']
+        product['_name'] = (row['name'] or '').lower()
+        product['_sku'] = (row['sku_code'] or '').lower()
+        return product
+
+    def _reindex(self):
+        # Case-insensitive order, close to the database's collation
+        self._by_name = sorted(
+            self._products.values(),
+            key=lambda p: (p['name'].casefold(), p['name'], p['product_id'])
+        )
+
+    # ------------------------------------------------------------------------
+    # Reads (same results as the InventoryDBConnector methods)
+    # ------------------------------------------------------------------------
+
+    def count_products(self) -> int:
+        return len(self._products)
+
+    def get_all_products(self) -> List[Dict]:
+        """All products with their category name, ordered by name"""
+        products, categories = self._by_name, self._categories
+        return [
+            {
+                **_public(product),
+                'category_name': categories.get(product['category_id']),
+            }
+            for product in products
+        ]
+
+    def search_products(self, search_term: str, limit: int = 10) -> List[Dict]:
+        """Products whose name or SKU contains the term, ordered by name"""
+        term = search_term.lower()
+        results = []
+        for product in self._by_name:
+            if term in product['_name'] or term in product['_sku']:
+                results.append(_public(product))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def get_product_by_fuzzy_name(self, product_name: str) -> Optional[Dict]:
+        """Exact case-insensitive name match, else the first name containing it"""
+        name = product_name.lower()
+        products = self._by_name
+        for product in products:
+            if product['_name'] == name:
+                return _public(product)
+        for product in products:
+            if name in product['_name']:
+                return _public(product)
+        return None
+
+
+def _public(product: Dict) -> Dict:
+    return {field: product[field] for field in PRODUCT_FIELDS}
+
+
+def _max_updated_at(rows: List[Dict], current: Optional[datetime]) -> Optional[datetime]:
+    stamps = [row['updated_at'] for row in rows if row.get('updated_at') is not None]
+    if current is not None:
+        stamps.append(current)
+    return max(stamps) if stamps else current
+
+
+def sync_loop(replica: CatalogReplica, interval: float, stop: threading.Event = None):
+    """
+    Keep the replica in sync until stopped
+
+    Args:
+        replica: Replica to sync
+        interval: Seconds between delta syncs
+        stop: Event that ends the loop when set
+    """
+    stop = stop or threading.Event()
+    while True:
+        try:
+            replica.sync()
+        except Exception as e:
+            logger.error(f"❌ Catalog sync failed: {e}")
+        if stop.wait(interval):
+            return
+
+
+def start_catalog_replica(connector) -> Optional[CatalogReplica]:
+    """
+    Load the catalog in the background and serve the connector's product
+    lookups from it once loaded (SQL until then)
+
+    Args:
+        connector: InventoryDBConnector to sync from and attach the replica to
+
+    Returns:
+        The replica, or None if disabled (CATALOG_REPLICA=0)
+    """
+    if not CATALOG_REPLICA:
+        return None
+
+    # The sync thread does the initial load (and retries it), so startup
+    # neither waits for the database nor fails without it
+    replica = CatalogReplica(connector)
+    connector.catalog = replica
+    threading.Thread(
+        target=sync_loop,
+        args=(replica, CATALOG_SYNC_SECONDS),
+        name="catalog-sync",
+        daemon=True,
+    ).start()
+    return replica
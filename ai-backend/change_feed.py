@@ -0,0 +1,297 @@
+"""
+Push-based stock change feed
+One thread per worker LISTENs on the stock_changes channel (filled by the
+triggers in backend/migrations/stock_change_notify.sql) and fans the changes
+out to subscribers, e.g. the /changes Server-Sent Events endpoint.
+
+Every subscriber has its own bounded buffer that coalesces changes while it
+is not reading: a stock row keeps only its latest quantity and operation
+("I", "U" or "D"; a deleted row has no quantity) and moves are summed per
+product and type. A subscriber that falls too far behind is not
+allowed to hold up the others or grow without bound; its buffer is dropped
+and it is told to resync (re-fetch) instead.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import psycopg2
+from dotenv import load_dotenv
+
+from db_connector import get_connector
+from metrics import CHANGE_FEED_CLIENTS, CHANGE_FEED_EVENTS, CHANGE_FEED_RESYNCS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+CHANGE_FEED = os.getenv('CHANGE_FEED', '1') == '1'
+CHANGE_FEED_MAX_CLIENTS = int(os.getenv('CHANGE_FEED_MAX_CLIENTS', 100))
+# Distinct stock rows and move groups buffered per client before it must resync
+CHANGE_FEED_MAX_PENDING = int(os.getenv('CHANGE_FEED_MAX_PENDING', 1000))
+# Changes arriving within this window are sent as one event
+CHANGE_FEED_FLUSH_SECONDS = float(os.getenv('CHANGE_FEED_FLUSH_SECONDS', 0.25))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv('CHANGE_FEED_HEARTBEAT_SECONDS', 15))
+
+RECONNECT_SECONDS = (1, 2, 5, 10, 30)
+
+# Hardcoded in the pg_notify calls of stock_change_notify.sql; change both together
+CHANGE_FEED_CHANNEL = 'stock_changes'
+
+
+class FeedFull(Exception):
+    """The worker already serves CHANGE_FEED_MAX_CLIENTS subscribers"""
+
+
+class Subscription:
+    """
+    Coalescing, bounded buffer of changes for one subscriber
+    """
+
+    def __init__(self, max_pending: int = CHANGE_FEED_MAX_PENDING):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._stock: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._moves: Dict[tuple, Dict] = {}
+        self._resync: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Wake waiters on this event loop when changes arrive"""
+        self._loop = loop
+        self._ready = asyncio.Event()
+        with self._lock:
+            if self._stock or self._moves or self._resync is not None:
+                self._ready.set()
+
+    def offer(self, change: Dict):
+        """Add one change (called from the listener thread, never blocks)"""
+        with self._lock:
+            if self._resync is not None:
+                return
+            if change['table'] == 'stock_levels':
+                key = (change['product_id'], change['location_id'])
+                self._stock.pop(key, None)
+                self._stock[key] = {
+                    'product_id': change['product_id'],
+                    'location_id': change['location_id'],
+                    'op': change.get('op'),
+                    'quantity': change.get('quantity'),
+                }
+            else:
+                key = (change['product_id'], change['type'])
+                moves = self._moves.setdefault(key, {
+                    'product_id': change['product_id'], 'type': change['type'],
+                    'count': 0, 'quantity': 0.0,
+                })
+                moves['count'] += 1
+                moves['quantity'] += change['quantity']
+                moves['last_move_id'] = change['move_id']
+            if len(self._stock) + len(self._moves) > self.max_pending:
+                self._drop("overflow")
+        self._wake()
+
+    def resync(self, reason: str):
+        """Drop what is buffered and tell the subscriber to re-fetch"""
+        with self._lock:
+            self._drop(reason)
+        self._wake()
+
+    def _drop(self, reason: str):
+        self._stock.clear()
+        self._moves.clear()
+        self._resync = reason
+        CHANGE_FEED_RESYNCS.labels(reason).inc()
+
+    def _wake(self):
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                pass  # the loop is closed; the subscriber is gone
+
+    async def wait(self):
+        await self._ready.wait()
+
+    def drain(self) -> Optional[Dict]:
+        """
+        Take everything buffered since the last drain
+
+        Returns:
+            {"resync": reason}, {"stock": [...], "moves": [...]}, or None if nothing changed
+        """
+        with self._lock:
+            if self._ready is not None:
+                self._ready.clear()
+            if self._resync is not None:
+                batch, self._resync = {'resync': self._resync}, None
+                return batch
+            if not self._stock and not self._moves:
+                return None
+            batch = {'stock': list(self._stock.values()), 'moves': list(self._moves.values())}
+            self._stock.clear()
+            self._moves.clear()
+            return batch
+
+
+class ChangeFeed:
+    """
+    LISTEN connection for one worker and its subscribers
+
+    The listener thread starts with the first subscriber and reconnects with
+    backoff. Changes may be missed while disconnected, so every subscriber
+    is told to resync after a reconnect.
+    """
+
+    def __init__(self, channel: str = CHANGE_FEED_CHANNEL, max_clients: int = CHANGE_FEED_MAX_CLIENTS):
+        self.channel = channel
+        self.max_clients = max_clients
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.connected = False
+        self._listened = False
+        self.last_event_at: Optional[float] = None
+
+    def subscribe(self, max_pending: int = CHANGE_FEED_MAX_PENDING) -> Subscription:
+        """
+        Register a subscriber
+
+        Raises:
+            FeedFull: Too many subscribers on this worker
+        """
+        subscription = Subscription(max_pending)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise FeedFull(f"{len(self._subscribers)} change feed clients already connected")
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                attempt = 0
+            except (psycopg2.Error, OSError) as e:
+                self.connected = False
+                delay = RECONNECT_SECONDS[min(attempt, len(RECONNECT_SECONDS) - 1)]
+                attempt += 1
+                logger.error(f"❌ Change feed connection lost ({e}), reconnecting in {delay}s")
+                self._stop.wait(delay)
+
+    def _listen(self):
+        conn = psycopg2.connect(**get_connector().db_config)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            if self._listened:
+                # Reconnected: whatever changed in between was not seen
+                self._broadcast_resync("reconnect")
+            self._listened = True
+            self.connected = True
+            logger.info(f"📡 Change feed listening on {self.channel}")
+            while not self._stop.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._dispatch(conn.notifies.pop(0).payload)
+        finally:
+            self.connected = False
+            conn.close()
+
+    def _dispatch(self, payload: str):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            logger.warning(f"⚠️ Ignoring malformed change notification: {payload[:200]}")
+            return
+        self.last_event_at = time.time()
+        CHANGE_FEED_EVENTS.labels(change.get('table', 'unknown')).inc()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(change)
+
+    def _broadcast_resync(self, reason: str):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.resync(reason)
+
+    def state(self) -> Dict:
+        """Connection and subscribers, for /health"""
+        with self._lock:
+            clients = len(self._subscribers)
+        return {
+            "enabled": CHANGE_FEED,
+            "connected": self.connected,
+            "clients": clients,
+            "last_event_at": self.last_event_at,
+        }
+
+
+CHANGE_FEED_HUB = ChangeFeed()
+CHANGE_FEED_CLIENTS.set_function(lambda: len(CHANGE_FEED_HUB._subscribers))
+
+
+# ============================================================================
+# SERVER-SENT EVENTS
+# ============================================================================
+
+def _sse(event: str, data: Dict, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def sse_events(subscription: Subscription,
+                     is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+    """
+    Stream a subscription as Server-Sent Events until the client goes away
+
+    Events are "changes" ({"stock": [...], "moves": [...]}) and "resync"
+    ({"resync": reason}: re-fetch the current state). A comment line is sent
+    every CHANGE_FEED_HEARTBEAT_SECONDS to keep idle connections open.
+
+    Args:
+        subscription: Subscription from CHANGE_FEED_HUB.subscribe()
+        is_disconnected: Request.is_disconnected of the client's request
+    """
+    subscription.bind(asyncio.get_running_loop())
+    event_id = 0
+    try:
+        yield f"retry: 3000\n: listening on {CHANGE_FEED_HUB.channel}\n\n"
+        while not await is_disconnected():
+            try:
+                await asyncio.wait_for(subscription.wait(), CHANGE_FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            # Let a burst of changes collect into one event
+            await asyncio.sleep(CHANGE_FEED_FLUSH_SECONDS)
+            batch = subscription.drain()
+            if batch is None:
+                continue
+            event_id += 1
+            yield _sse("resync" if "resync" in batch else "changes", batch, event_id)
+    finally:
+        CHANGE_FEED_HUB.unsubscribe(subscription)
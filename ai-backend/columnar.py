@@ -0,0 +1,646 @@
+"""
+Embedded columnar copy of the inventory for analytical questions
+Each column is a numpy array in its own file, memory-mapped read-only by
+the workers and refreshed incrementally from Postgres, so analytics run
+vectorized on local data instead of on the transactional database
+
+Layout of COLUMNAR_PATH:
+    manifest.json            row counts, refresh watermarks, generation
+    names.<gen>.json         product / category / warehouse names
+    <table>.<column>.<gen>.bin  raw column values of a rewritten table
+    moves.<column>.bin       raw column values of move_history (append-only)
+
+stock, products and locations are small and are rewritten on refresh into
+files of the new generation; the manifest names the generation each table
+is in, so a reader always maps a consistent set. move_history columns are
+append-only: rows past the manifest's row count (left by an interrupted
+append) are ignored and truncated on the next refresh.
+
+Run as a script to refresh outside the API workers:
+    python columnar.py --once
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from db_connector import raising_errors
+from metrics import DB_QUERY_SECONDS, record_cache, timed
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+COLUMNAR_PATH = os.getenv(
+    'COLUMNAR_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'columnar_data')
+)
+COLUMNAR_REFRESH_SECONDS = float(os.getenv('COLUMNAR_REFRESH_SECONDS', 60))
+COLUMNAR_FULL_REFRESH_SECONDS = float(os.getenv('COLUMNAR_FULL_REFRESH_SECONDS', 3600))
+COLUMNAR_CHECK_SECONDS = float(os.getenv('COLUMNAR_CHECK_SECONDS', 1))
+# move_id is assigned at insert but rows become visible at commit, so a lower id
+# can appear after a higher one. Each refresh re-reads this many ids back.
+MOVE_ID_OVERLAP = 1000
+MOVE_BATCH_SIZE = 50000
+# stock_levels rows changed within this window before the watermark are re-read
+STOCK_OVERLAP_SECONDS = 60
+REFRESH_TIMEOUT_MS = 60000
+
+SCHEMA = {
+    'stock': {
+        'product_id': np.int32,
+        'location_id': np.int32,
+        'quantity': np.float64,
+    },
+    'products': {
+        'product_id': np.int32,
+        'category_id': np.int32,
+        'unit_cost': np.float64,
+    },
+    'locations': {
+        'location_id': np.int32,
+        'warehouse_id': np.int32,
+    },
+    'moves': {
+        'move_id': np.int64,
+        'product_id': np.int32,
+        'from_location_id': np.int32,
+        'to_location_id': np.int32,
+        'quantity_change': np.float64,
+        'move_ts': np.int64,
+        'type_code': np.int8,
+    },
+}
+
+MOVE_TYPES = ('receipt', 'delivery', 'transfer', 'adjustment')
+NO_LOCATION = -1
+
+
+# Tables rewritten on every refresh (the others are appended to)
+REWRITTEN_TABLES = ('stock', 'products', 'locations')
+
+
+def _column_path(path: str, table: str, column: str, generation: int = None) -> str:
+    if generation is None:
+        return os.path.join(path, f"{table}.{column}.bin")
+    return os.path.join(path, f"{table}.{column}.{generation}.bin")
+
+
+def _write_atomic(target: str, data: bytes):
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+
+
+def _read_manifest(path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# ============================================================================
+# REFRESHING
+# ============================================================================
+
+class ColumnarWriter:
+    """
+    Copies inventory tables from Postgres into the column files
+    """
+
+    def __init__(self, connector, path: str):
+        self.connector = connector
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = _read_manifest(path) or {
+            'generation': 0,
+            'rows': {table: 0 for table in SCHEMA},
+            'files': {},
+            'last_move_id': 0,
+            'stock_watermark': None,
+            'last_full_refresh': 0,
+        }
+
+    def refresh(self, full: bool = False) -> Dict:
+        """
+        Bring the column files up to date
+
+        Args:
+            full: Reload stock_levels completely instead of by last_updated_at
+
+        Returns:
+            Row counts per table after the refresh
+        """
+        full = full or self.manifest['stock_watermark'] is None or (
+            time.time() - self.manifest['last_full_refresh'] >= COLUMNAR_FULL_REFRESH_SECONDS
+        )
+        previous_files = dict(self.manifest['files'])
+        # A failed refresh leaves the last written manifest (and watermarks) in force
+        committed = copy.deepcopy(self.manifest)
+        self.generation = self.manifest['generation'] + 1
+        try:
+            self._refresh_dimensions()
+            self._refresh_stock(full, previous_files.get('stock'))
+            self._refresh_moves()
+        except Exception:
+            self.manifest = committed
+            raise
+
+        self.manifest['generation'] = self.generation
+        self.manifest['built_at'] = time.time()
+        if full:
+            self.manifest['last_full_refresh'] = time.time()
+        _write_atomic(
+            os.path.join(self.path, "manifest.json"),
+            json.dumps(self.manifest).encode()
+        )
+        self._remove_old_files()
+        return dict(self.manifest['rows'])
+
+    def _remove_old_files(self):
+        """Delete rewritten-table files of earlier generations (mapped readers keep theirs)"""
+        current = {
+            os.path.basename(_column_path(self.path, table, column, self.manifest['files'][table]))
+            for table in REWRITTEN_TABLES
+            for column in SCHEMA[table]
+        }
+        current.add(f"names.{self.manifest['files']['names']}.json")
+        for name in os.listdir(self.path):
+            stem = name.split(".")[0]
+            if (stem in REWRITTEN_TABLES or stem == "names") and name not in current \
+                    and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def _query(self, query: str, params: tuple = ()) -> List[Dict]:
+        # A failed read must fail the refresh, not load as an empty table
+        with raising_errors():
+            return self.connector.execute_query(query, params, timeout_ms=REFRESH_TIMEOUT_MS)
+
+    def _write_table(self, table: str, columns: Dict[str, np.ndarray]):
+        for column, dtype in SCHEMA[table].items():
+            values = np.ascontiguousarray(columns[column], dtype=dtype)
+            _write_atomic(_column_path(self.path, table, column, self.generation), values.tobytes())
+        self.manifest['rows'][table] = len(columns[next(iter(SCHEMA[table]))])
+        self.manifest['files'][table] = self.generation
+
+    def _refresh_dimensions(self):
+        """Products, locations and names: small, reloaded every time"""
+        products = self._query("""
+            SELECT product_id, name, sku_code, unit_of_measure,
+                   category_id, per_unit_cost
+            FROM products
+            ORDER BY product_id
+        """)
+        if not products:
+            raise RuntimeError("No products loaded, not refreshing columnar store")
+        locations = self._query("""
+            SELECT location_id, warehouse_id
+            FROM locations
+            ORDER BY location_id
+        """)
+        if not locations:
+            raise RuntimeError("No locations loaded, not refreshing columnar store")
+        categories = self._query("SELECT category_id, name FROM product_categories")
+        warehouses = self._query("SELECT warehouse_id, name FROM warehouses")
+
+        self._write_table('products', {
+            'product_id': [p['product_id'] for p in products],
+            'category_id': [p['category_id'] for p in products],
+            'unit_cost': [p['per_unit_cost'] or 0 for p in products],
+        })
+        self._write_table('locations', {
+            'location_id': [l['location_id'] for l in locations],
+            'warehouse_id': [l['warehouse_id'] for l in locations],
+        })
+        names = {
+            'products': {
+                str(p['product_id']): [p['name'], p['sku_code'], p['unit_of_measure']]
+                for p in products
+            },
+            'categories': {str(c['category_id']): c['name'] for c in categories},
+            'warehouses': {str(w['warehouse_id']): w['name'] for w in warehouses},
+        }
+        _write_atomic(
+            os.path.join(self.path, f"names.{self.generation}.json"),
+            json.dumps(names).encode()
+        )
+        self.manifest['files']['names'] = self.generation
+
+    def _refresh_stock(self, full: bool, current_generation: int = None):
+        """stock_levels: full reload, or merge rows changed since the watermark"""
+        query = """
+            SELECT product_id, location_id, quantity_on_hand, last_updated_at
+            FROM stock_levels
+        """
+        if full:
+            rows = self._query(query + " ORDER BY product_id, location_id")
+            keys = np.array([_stock_key(r) for r in rows], dtype=np.int64)
+            quantity = np.array([r['quantity_on_hand'] or 0 for r in rows], dtype=np.float64)
+        else:
+            since = datetime.fromisoformat(self.manifest['stock_watermark'])
+            rows = self._query(
+                query + " WHERE last_updated_at >= %s",
+                (since - timedelta(seconds=STOCK_OVERLAP_SECONDS),)
+            )
+            current = ColumnarStore.load_table(
+                self.path, 'stock', self.manifest['rows']['stock'], current_generation
+            )
+            keys = np.concatenate([
+                (current['product_id'].astype(np.int64) << 32) | current['location_id'],
+                np.array([_stock_key(r) for r in rows], dtype=np.int64),
+            ])
+            quantity = np.concatenate([
+                current['quantity'],
+                np.array([r['quantity_on_hand'] or 0 for r in rows], dtype=np.float64),
+            ])
+            # Keep the last value per (product, location): the delta wins
+            reverse_keys = keys[::-1]
+            keys, first = np.unique(reverse_keys, return_index=True)
+            quantity = quantity[::-1][first]
+
+        stamps = [r['last_updated_at'] for r in rows if r['last_updated_at'] is not None]
+        if stamps:
+            watermark = max(stamps)
+            if self.manifest['stock_watermark'] and not full:
+                watermark = max(watermark, datetime.fromisoformat(self.manifest['stock_watermark']))
+            self.manifest['stock_watermark'] = watermark.isoformat()
+        elif full and rows:
+            self.manifest['stock_watermark'] = datetime.now().isoformat()
+        # An empty full load keeps the old watermark, or none: the next refresh is full again
+
+        self._write_table('stock', {
+            'product_id': keys >> 32,
+            'location_id': keys & 0xFFFFFFFF,
+            'quantity': quantity,
+        })
+
+    def _refresh_moves(self):
+        """move_history: append moves with ids past the last one copied"""
+        rows_before = self.manifest['rows']['moves']
+        # Drop anything an interrupted refresh appended past the manifest
+        for column, dtype in SCHEMA['moves'].items():
+            file_path = _column_path(self.path, 'moves', column)
+            with open(file_path, "ab") as f:
+                f.truncate(rows_before * np.dtype(dtype).itemsize)
+
+        existing = ColumnarStore.load_table(self.path, 'moves', rows_before)['move_id']
+        after = max(0, self.manifest['last_move_id'] - MOVE_ID_OVERLAP)
+        recent_ids = existing[existing > after]
+
+        appended = 0
+        while True:
+            rows = self._query("""
+                SELECT move_id, product_id, from_location_id, to_location_id,
+                       quantity_change, move_timestamp, transaction_type
+                FROM move_history
+                WHERE move_id > %s
+                ORDER BY move_id
+                LIMIT %s
+            """, (after, MOVE_BATCH_SIZE))
+            if not rows:
+                break
+            batch = {
+                'move_id': np.array([r['move_id'] for r in rows], dtype=np.int64),
+                'product_id': np.array([r['product_id'] for r in rows], dtype=np.int32),
+                'from_location_id': np.array(
+                    [r['from_location_id'] or NO_LOCATION for r in rows], dtype=np.int32),
+                'to_location_id': np.array(
+                    [r['to_location_id'] or NO_LOCATION for r in rows], dtype=np.int32),
+                'quantity_change': np.array(
+                    [r['quantity_change'] for r in rows], dtype=np.float64),
+                'move_ts': np.array(
+                    [int(r['move_timestamp'].timestamp()) if r['move_timestamp'] else 0
+                     for r in rows], dtype=np.int64),
+                'type_code': np.array(
+                    [_move_type_code(r['transaction_type']) for r in rows], dtype=np.int8),
+            }
+            after = int(batch['move_id'][-1])
+            new = ~np.isin(batch['move_id'], recent_ids)
+            if new.any():
+                for column, dtype in SCHEMA['moves'].items():
+                    with open(_column_path(self.path, 'moves', column), "ab") as f:
+                        f.write(np.ascontiguousarray(batch[column][new], dtype=dtype).tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                appended += int(new.sum())
+                self.manifest['last_move_id'] = max(self.manifest['last_move_id'], after)
+            if len(rows) < MOVE_BATCH_SIZE:
+                break
+
+        self.manifest['rows']['moves'] = rows_before + appended
+
+
+def _stock_key(row: Dict) -> int:
+    return (int(row['product_id']) << 32) | int(row['location_id'])
+
+
+def _move_type_code(transaction_type: str) -> int:
+    try:
+        return MOVE_TYPES.index(transaction_type)
+    except ValueError:
+        return -1
+
+
+# ============================================================================
+# READING
+# ============================================================================
+
+class ColumnarStore:
+    """
+    Read-only, memory-mapped view of one generation of the column files
+    """
+
+    def __init__(self, path: str):
+        manifest = _read_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No columnar manifest in {path}")
+        self.path = path
+        self.generation = manifest['generation']
+        self.built_at = manifest.get('built_at', 0)
+        files = manifest['files']
+        self.tables = {
+            table: self.load_table(path, table, manifest['rows'][table], files.get(table))
+            for table in SCHEMA
+        }
+        with open(os.path.join(path, f"names.{files['names']}.json")) as f:
+            names = json.load(f)
+        self.product_names = {int(k): v for k, v in names['products'].items()}
+        self.category_names = {int(k): v for k, v in names['categories'].items()}
+        self.warehouse_names = {int(k): v for k, v in names['warehouses'].items()}
+
+    @staticmethod
+    def load_table(path: str, table: str, rows: int,
+                   generation: int = None) -> Dict[str, np.ndarray]:
+        """Memory-map the first rows values of each column of a table"""
+        columns = {}
+        for column, dtype in SCHEMA[table].items():
+            if rows == 0:
+                columns[column] = np.empty(0, dtype=dtype)
+            else:
+                columns[column] = np.memmap(
+                    _column_path(path, table, column, generation),
+                    dtype=dtype, mode='r', shape=(rows,)
+                )
+        return columns
+
+    @staticmethod
+    def _lookup(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Position of each id in a sorted id column, -1 where it is missing"""
+        if len(sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        index = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[index] == ids, index, -1)
+
+    @timed(DB_QUERY_SECONDS, "columnar.value_by_category_warehouse")
+    def value_by_category_warehouse(self) -> List[Dict]:
+        """
+        Units and value on hand per product category and warehouse
+
+        Returns:
+            One row per (category, warehouse) with stock, largest value first
+        """
+        stock = self.tables['stock']
+        products = self.tables['products']
+        locations = self.tables['locations']
+
+        product_row = self._lookup(products['product_id'], stock['product_id'])
+        location_row = self._lookup(locations['location_id'], stock['location_id'])
+        valid = (product_row >= 0) & (location_row >= 0)
+        if not valid.any():
+            return []
+
+        category_ids = products['category_id'][product_row[valid]]
+        warehouse_ids = locations['warehouse_id'][location_row[valid]]
+        quantity = stock['quantity'][valid]
+        value = quantity * products['unit_cost'][product_row[valid]]
+
+        categories, category_code = np.unique(category_ids, return_inverse=True)
+        warehouses, warehouse_code = np.unique(warehouse_ids, return_inverse=True)
+        group = category_code * len(warehouses) + warehouse_code
+        size = len(categories) * len(warehouses)
+        units = np.bincount(group, weights=quantity, minlength=size)
+        values = np.bincount(group, weights=value, minlength=size)
+        counts = np.bincount(group, minlength=size)
+
+        rows = []
+        for g in np.flatnonzero(counts):
+            category_id = int(categories[g // len(warehouses)])
+            warehouse_id = int(warehouses[g % len(warehouses)])
+            rows.append({
+                'category_name': self.category_names.get(category_id, f"#{category_id}"),
+                'warehouse_name': self.warehouse_names.get(warehouse_id, f"#{warehouse_id}"),
+                'total_units': float(units[g]),
+                'total_value': float(values[g]),
+            })
+        rows.sort(key=lambda r: r['total_value'], reverse=True)
+        return rows
+
+    @timed(DB_QUERY_SECONDS, "columnar.movement_summary")
+    def movement_summary(self, days: int = 30, product_id: int = None,
+                         top: int = 5, exclude: List[Tuple[int, int]] = ()) -> Dict:
+        """
+        Stock movements over the last days
+
+        Args:
+            days: Length of the window
+            product_id: Only this product's moves
+            top: Number of most-moved products to list
+            exclude: [start, end) epoch-second ranges to leave out, e.g.
+                archived months
+
+        Returns:
+            Totals per move type and the products with the most moves
+        """
+        moves = self.tables['moves']
+        mask = moves['move_ts'] >= int(time.time() - days * 86400)
+        if product_id is not None:
+            mask &= moves['product_id'] == product_id
+        for start, end in exclude:
+            mask &= (moves['move_ts'] < start) | (moves['move_ts'] >= end)
+
+        type_code = moves['type_code'][mask]
+        change = moves['quantity_change'][mask]
+        product_ids = moves['product_id'][mask]
+
+        valid_type = type_code >= 0
+        type_counts = np.bincount(type_code[valid_type], minlength=len(MOVE_TYPES))
+        type_units = np.bincount(
+            type_code[valid_type], weights=np.abs(change[valid_type]), minlength=len(MOVE_TYPES)
+        )
+        by_type = [
+            {'type': name, 'moves': int(type_counts[i]), 'units': float(type_units[i])}
+            for i, name in enumerate(MOVE_TYPES) if type_counts[i]
+        ]
+
+        top_products = []
+        if len(product_ids):
+            ids, inverse = np.unique(product_ids, return_inverse=True)
+            move_counts = np.bincount(inverse)
+            net_change = np.bincount(inverse, weights=change)
+            for i in np.argsort(-move_counts, kind='stable')[:top]:
+                name, sku, unit = self.product_names.get(int(ids[i]), [f"#{ids[i]}", "", ""])
+                top_products.append({
+                    'name': name,
+                    'sku_code': sku,
+                    'unit_of_measure': unit,
+                    'moves': int(move_counts[i]),
+                    'net_change': float(net_change[i]),
+                })
+
+        return {
+            'days': days,
+            'total_moves': int(mask.sum()),
+            'by_type': by_type,
+            'top_products': top_products,
+        }
+
+
+_store: Optional[ColumnarStore] = None
+_store_manifest_mtime = None
+_last_check = 0.0
+_store_lock = threading.Lock()
+
+
+def get_columnar() -> Optional[ColumnarStore]:
+    """
+    Current columnar store, remapped when a refresh has written a new manifest
+
+    Returns:
+        The store, or None if disabled or not built yet
+    """
+    global _store, _store_manifest_mtime, _last_check
+    if not COLUMNAR_PATH:
+        return None
+
+    now = time.monotonic()
+    if now - _last_check >= COLUMNAR_CHECK_SECONDS:
+        with _store_lock:
+            if now - _last_check >= COLUMNAR_CHECK_SECONDS:
+                _last_check = now
+                try:
+                    mtime = os.stat(os.path.join(COLUMNAR_PATH, "manifest.json")).st_mtime_ns
+                    if mtime != _store_manifest_mtime:
+                        _store = ColumnarStore(COLUMNAR_PATH)
+                        _store_manifest_mtime = mtime
+                except (OSError, ValueError, KeyError) as e:
+                    if _store is None:
+                        logger.debug(f"Columnar store not available: {e}")
+
+    record_cache("columnar", _store is not None)
+    return _store
+
+
+def refresh_loop(connector, path: str, interval: float, stop: threading.Event = None):
+    """
+    Refresh the column files every interval seconds until stopped
+
+    Args:
+        connector: InventoryDBConnector to read from
+        path: Columnar store directory
+        interval: Seconds between refreshes
+        stop: Event that ends the loop when set
+    """
+    stop = stop or threading.Event()
+    writer = ColumnarWriter(connector, path)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            rows = writer.refresh()
+            logger.info(
+                f"🧮 Columnar store generation {writer.manifest['generation']} refreshed in "
+                f"{(time.perf_counter() - start) * 1000:.0f} ms: {rows}"
+            )
+        except Exception as e:
+            logger.error(f"❌ Columnar refresh failed: {e}")
+            # Reload the last committed manifest before retrying
+            writer = ColumnarWriter(connector, path)
+        stop.wait(interval)
+
+
+_refresher_lock_file = None
+
+
+def acquire_refresher_lock(path: str) -> bool:
+    """
+    Take the exclusive refresher lock for the store directory
+    Held for the life of the process, so one process writes the column files
+
+    Returns:
+        True if this process now holds the lock
+    """
+    global _refresher_lock_file
+    if _refresher_lock_file is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        logger.warning("⚠️ No fcntl on this platform, run 'python columnar.py' as the refresher")
+        return False
+
+    os.makedirs(path, exist_ok=True)
+    lock_file = open(os.path.join(path, ".lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _refresher_lock_file = lock_file
+    return True
+
+
+def start_columnar_refresher(connector) -> bool:
+    """
+    Start the refresher thread if this process wins the store's lock
+
+    Args:
+        connector: InventoryDBConnector to read from
+
+    Returns:
+        True if this process became the refresher
+    """
+    if not COLUMNAR_PATH or not acquire_refresher_lock(COLUMNAR_PATH):
+        return False
+
+    threading.Thread(
+        target=refresh_loop,
+        args=(connector, COLUMNAR_PATH, COLUMNAR_REFRESH_SECONDS),
+        name="columnar-refresher",
+        daemon=True,
+    ).start()
+    logger.info(f"🧮 This worker (pid {os.getpid()}) refreshes the columnar store")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_connector import get_connector
+
+    parser = argparse.ArgumentParser(description="Refresh the embedded columnar store")
+    parser.add_argument("--interval", type=float, default=COLUMNAR_REFRESH_SECONDS)
+    parser.add_argument("--once", action="store_true", help="refresh once and exit")
+    parser.add_argument("--full", action="store_true", help="reload stock_levels completely")
+    args = parser.parse_args()
+    if not COLUMNAR_PATH:
+        parser.error("set COLUMNAR_PATH")
+    if not acquire_refresher_lock(COLUMNAR_PATH):
+        parser.exit(1, "Another process already refreshes this store\n")
+
+    if args.once:
+        print(ColumnarWriter(get_connector(), COLUMNAR_PATH).refresh(full=args.full))
+    else:
+        refresh_loop(get_connector(), COLUMNAR_PATH, args.interval)
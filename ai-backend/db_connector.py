@@ -4,13 +4,33 @@ Handles PostgreSQL connections and inventory queries
 """
 
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import errors, sql
+from psycopg2.extensions import parse_dsn
+from psycopg2.pool import ThreadedConnectionPool
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
+from datetime import datetime, timedelta
 import logging
 from decimal import Decimal
 import json
+import time
+from contextvars import ContextVar
+from metrics import (
+    DB_CANCELLED,
+    DB_ERRORS,
+    DB_POOL_CONNECTIONS,
+    DB_QUERY_SECONDS,
+    DB_REPLICA_LAG,
+    DB_ROUTED,
+    record_cache,
+    timed,
+)
+from profiling import profiled
+from query_log import QUERY_STATS, SLOW_QUERY_MS, fingerprint, is_explainable, log_slow_query
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +38,60 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 5))
+# Seconds to wait for a new connection before giving up (0 waits forever)
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 10))
+# Longest wait for a free pooled connection before the statement fails
+DB_POOL_WAIT_SECONDS = float(os.getenv('DB_POOL_WAIT_SECONDS', 5))
+# How often a waiter for a pooled connection checks whether it was cancelled
+POOL_POLL_SECONDS = 0.1
+# How long "no move_history archive yet" is trusted before asking again
+MOVE_ARCHIVE_RECHECK_SECONDS = 60
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 5000))
+
+# Primary DSN (overrides DB_HOST/DB_PORT/...) and comma-separated read replica DSNs
+DB_PRIMARY_DSN = os.getenv('DB_PRIMARY_DSN')
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(',') if dsn.strip()]
+DB_REPLICA_POOL_MAX = int(os.getenv('DB_REPLICA_POOL_MAX', DB_POOL_MAX))
+DB_REPLICA_MAX_STALENESS = float(os.getenv('DB_REPLICA_MAX_STALENESS', 5))
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', 2))
+
+# get_statistics estimates tables larger than STATS_SAMPLE_PAGES pages (8 kB
+# each) from catalog statistics and a page sample of that size; STATS_EXACT=1
+# makes exact counts the default again
+STATS_EXACT = os.getenv('STATS_EXACT', '0') == '1'
+STATS_SAMPLE_PAGES = int(os.getenv('STATS_SAMPLE_PAGES', 100))
+# Error bounds are 95% confidence intervals
+STATS_Z = 1.96
+
+
+def _statement_timeout(method: str, default_ms: int) -> int:
+    """Server-side time limit for a connector method, overridable as DB_TIMEOUT_<METHOD>_MS"""
+    return int(os.getenv(f'DB_TIMEOUT_{method.upper()}_MS', default_ms))
+
+
+# Per-method statement_timeout in milliseconds. Point lookups fail fast;
+# aggregations over stock_levels get more room.
+STATEMENT_TIMEOUTS = {
+    'get_all_products': _statement_timeout('get_all_products', 5000),
+    'get_product_by_fuzzy_name': _statement_timeout('get_product_by_fuzzy_name', 2000),
+    'search_products': _statement_timeout('search_products', 2000),
+    'search_products_many': _statement_timeout('search_products_many', 2000),
+    'get_product_stock_level': _statement_timeout('get_product_stock_level', 2000),
+    'get_product_stock_levels': _statement_timeout('get_product_stock_levels', 2000),
+    'get_product_stock_by_warehouse': _statement_timeout('get_product_stock_by_warehouse', 2000),
+    'get_low_stock_products': _statement_timeout('get_low_stock_products', 10000),
+    'get_warehouse_inventory_summary': _statement_timeout('get_warehouse_inventory_summary', 10000),
+    'get_statistics': _statement_timeout('get_statistics', 5000),
+    'get_movement_summary': _statement_timeout('get_movement_summary', 10000),
+    'get_archived_ranges': _statement_timeout('get_archived_ranges', 2000),
+    'get_daily_outflows': _statement_timeout('get_daily_outflows', 10000),
+    'get_stock_totals': _statement_timeout('get_stock_totals', 5000),
+    'get_rebalance_matrix': _statement_timeout('get_rebalance_matrix', 10000),
+    'get_location_names': _statement_timeout('get_location_names', 2000),
+}
+
 def convert_decimals(obj):
     """Convert Decimal objects to float for JSON serialization"""
     if isinstance(obj, dict):
@@ -28,14 +102,287 @@ def convert_decimals(obj):
         return float(obj)
     return obj
 
+class QueryCancelled(RuntimeError):
+    """A statement was cancelled by its timeout or by the caller"""
+
+
+class PoolTimeout(QueryCancelled):
+    """No pooled connection became free within DB_POOL_WAIT_SECONDS"""
+
+
+class CancelScope:
+    """
+    Cancellation handle for the queries run on behalf of one request
+    
+    execute_query registers the connection it is using with the current
+    scope (see cancel_scope); cancel() sends a cancel request to Postgres for
+    every statement still running and makes later queries fail immediately.
+    Cancelling a scope also cancels its child scopes.
+    """
+    
+    def __init__(self, parent: 'CancelScope' = None):
+        self.cancelled = False
+        self._connections = set()
+        self._children = []
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent._add_child(self)
+    
+    def _add_child(self, child: 'CancelScope'):
+        with self._lock:
+            self._children.append(child)
+            cancelled = self.cancelled
+        if cancelled:
+            child.cancel()
+    
+    def register(self, conn) -> bool:
+        """Track a connection while it runs a statement; False if already cancelled"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._connections.add(conn)
+            return True
+    
+    def unregister(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+    
+    def cancel(self):
+        """Cancel running statements in this scope and its children"""
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            for conn in self._connections:
+                try:
+                    conn.cancel()
+                except psycopg2.Error as e:
+                    logger.error(f"Query cancel failed: {e}")
+            children = list(self._children)
+        for child in children:
+            child.cancel()
+
+
+_current_scope: ContextVar[Optional[CancelScope]] = ContextVar('cancel_scope', default=None)
+
+
+def current_scope() -> Optional[CancelScope]:
+    """Cancel scope the calling code runs in, if any"""
+    return _current_scope.get()
+
+
+@contextmanager
+def cancel_scope(scope: CancelScope = None):
+    """
+    Run the block in a cancel scope
+    Threads started with contextvars.copy_context() share the scope
+    
+    Args:
+        scope: Scope to enter (default: a new child of the current scope)
+        
+    Yields:
+        The CancelScope to cancel from another thread or task
+    """
+    if scope is None:
+        scope = CancelScope(_current_scope.get())
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+class ConnectionPool:
+    """
+    Blocking wrapper around psycopg2's ThreadedConnectionPool
+    Callers wait for a free connection instead of getting a PoolError
+    """
+    
+    def __init__(self, minconn: int, maxconn: int, **db_config):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **db_config)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.maxconn = maxconn
+        self._in_use = 0
+    
+    @contextmanager
+    def connection(self, scope: 'CancelScope' = None, timeout: float = DB_POOL_WAIT_SECONDS):
+        """
+        Borrow a connection for the duration of the block
+        
+        Args:
+            scope: Stop waiting when this scope is cancelled
+            timeout: Longest wait for a free connection in seconds
+        
+        Raises:
+            QueryCancelled: The scope was cancelled while waiting
+            PoolTimeout: No connection became free in time
+        """
+        deadline = time.monotonic() + timeout
+        while not self._slots.acquire(timeout=min(POOL_POLL_SECONDS, max(0.0, deadline - time.monotonic()))):
+            if scope is not None and scope.cancelled:
+                raise QueryCancelled("Request was cancelled")
+            if time.monotonic() >= deadline:
+                raise PoolTimeout(f"No database connection free within {timeout:g}s")
+        try:
+            conn = self._pool.getconn()
+            conn.autocommit = True
+            self._in_use += 1
+            try:
+                yield conn
+            finally:
+                self._in_use -= 1
+                self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+    
+    def counts(self) -> Dict[str, int]:
+        """Open and busy connection counts"""
+        open_count = len(self._pool._pool) + len(self._pool._used)
+        return {'open': open_count, 'in_use': self._in_use, 'max': self.maxconn}
+    
+    def close(self):
+        self._pool.closeall()
+
+
+# ============================================================================
+# READ REPLICAS
+# ============================================================================
+
+# Seconds since the last replayed transaction, or 0 when the replica has
+# replayed everything it received (an idle primary is not lag)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag_seconds
+"""
+
+_max_staleness: ContextVar[Optional[float]] = ContextVar('max_staleness', default=None)
+
+
+@contextmanager
+def freshness(max_staleness: float):
+    """
+    Require reads in the block to be at most max_staleness seconds behind the primary
+    freshness(0) sends every read to the primary
+    
+    Args:
+        max_staleness: Accepted replication lag in seconds
+    """
+    token = _max_staleness.set(max_staleness)
+    try:
+        yield
+    finally:
+        _max_staleness.reset(token)
+
+
+_raise_errors: ContextVar[bool] = ContextVar('raise_errors', default=False)
+
+
+@contextmanager
+def raising_errors():
+    """
+    Raise failed statements in the block instead of returning no rows
+    For writers that must not mistake a failed read for an empty table
+    """
+    token = _raise_errors.set(True)
+    try:
+        yield
+    finally:
+        _raise_errors.reset(token)
+
+
+class Replica:
+    """
+    A read replica: its pool and last measured replication lag
+    """
+    
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.name = _dsn_name(dsn)
+        self.pool = None
+        self.lag = None
+        self.checked_at = 0.0
+        self.healthy = False
+        DB_REPLICA_LAG.labels(self.name).set_function(
+            lambda: self.lag if self.lag is not None else -1
+        )
+    
+    def check(self):
+        """Measure replication lag, opening the pool on first use"""
+        try:
+            if self.pool is None:
+                self.pool = ConnectionPool(
+                    0, DB_REPLICA_POOL_MAX, dsn=self.dsn, connect_timeout=DB_CONNECT_TIMEOUT
+                )
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET statement_timeout = 1000; " + REPLICA_LAG_QUERY)
+                    self.lag = float(cursor.fetchone()[0])
+            if not self.healthy:
+                logger.info(f"✅ Replica {self.name} available (lag {self.lag:.1f}s)")
+            self.healthy = True
+        except psycopg2.Error as e:
+            self.mark_unhealthy(e)
+        self.checked_at = time.monotonic()
+    
+    def mark_unhealthy(self, error):
+        if self.healthy:
+            logger.error(f"❌ Replica {self.name} unavailable: {error}")
+        self.healthy = False
+    
+    def usable(self, max_staleness: float) -> bool:
+        """Healthy, recently measured, within the staleness bound and not saturated"""
+        if not self.healthy or self.lag is None or self.lag > max_staleness:
+            return False
+        if time.monotonic() - self.checked_at > 3 * DB_REPLICA_LAG_CHECK_SECONDS:
+            return False
+        return self.pool.counts()['in_use'] < self.pool.maxconn
+    
+    def load(self) -> float:
+        """Share of the replica's pool in use"""
+        return self.pool.counts()['in_use'] / self.pool.maxconn
+    
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+
+
+def _dsn_name(dsn: str) -> str:
+    """host:port label for a DSN, without credentials"""
+    try:
+        parts = parse_dsn(dsn)
+    except psycopg2.ProgrammingError:
+        return "replica"
+    return f"{parts.get('host', 'localhost')}:{parts.get('port', 5432)}"
+
+
+# Plans of slow statements are captured off the request path, one at a time
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+_explain_slot = threading.Semaphore(1)
+
+
 class InventoryDBConnector:
     """
     Database connector for inventory management system
     Handles all database operations for inventory queries
     """
     
-    def __init__(self):
-        """Initialize database connection parameters from environment"""
+    def __init__(self, dsn: str = None, pool_max: int = DB_POOL_MAX, raise_errors: bool = False,
+                 **connect_args):
+        """
+        Initialize database connection parameters from environment
+        
+        Args:
+            dsn: Connect to this database instead (another site, see sites.py);
+                no read replicas are used for it
+            pool_max: Maximum pooled connections
+            raise_errors: Raise failed statements instead of returning no rows,
+                so callers can tell a failed site from an empty one
+            connect_args: Extra psycopg2.connect arguments, e.g. connect_timeout
+        """
         self.db_config = {
             'host': os.getenv('DB_HOST', 'localhost'),
             'port': int(os.getenv('DB_PORT', 5432)),
@@ -43,70 +390,259 @@ class InventoryDBConnector:
             'user': os.getenv('DB_USER', 'postgres'),
             'password': os.getenv('DB_PASSWORD', ''),
         }
-        self.connection = None
+        if dsn or DB_PRIMARY_DSN:
+            self.db_config = {'dsn': dsn or DB_PRIMARY_DSN}
+        self.db_config['connect_timeout'] = DB_CONNECT_TIMEOUT
+        self.db_config.update(connect_args)
+        self.pool_max = pool_max
+        self.raise_errors = raise_errors
+        self.pool = None
+        # Concurrent first queries must not each open a pool and a lag monitor
+        self._connect_lock = threading.Lock()
+        self.replicas = [] if dsn else [Replica(replica_dsn) for replica_dsn in DB_REPLICA_DSNS]
+        self._replica_monitor_stop = threading.Event()
+        # In-memory catalog replica (catalog_replica.py), attached once loaded
+        self.catalog = None
+        # Set once the move_history archive index is known to exist;
+        # until then the last negative check is reused for a short while
+        self._move_archive_present = False
+        self._move_archive_checked_at = None
+    
+    def connection_counts(self) -> Dict[str, int]:
+        """Report open and busy connections for pool metrics"""
+        if self.pool is None:
+            return {'open': 0, 'in_use': 0, 'max': self.pool_max}
+        return self.pool.counts()
     
     def connect(self):
-        """Establish database connection"""
-        try:
-            self.connection = psycopg2.connect(**self.db_config)
-            logger.info("✅ Database connection established")
-            return True
-        except psycopg2.Error as e:
-            logger.error(f"❌ Database connection failed: {e}")
-            return False
+        """Open the connection pool (DB_POOL_MIN connections up front), once"""
+        with self._connect_lock:
+            if self.pool is not None:
+                return True
+            try:
+                pool_min = min(DB_POOL_MIN, self.pool_max)
+                self.pool = ConnectionPool(pool_min, self.pool_max, **self.db_config)
+                logger.info(f"✅ Database connection pool established ({pool_min}-{self.pool_max} connections)")
+                if self.replicas:
+                    self._start_replica_monitor()
+                return True
+            except psycopg2.Error as e:
+                logger.error(f"❌ Database connection failed: {e}")
+                return False
+    
+    def warm_up(self):
+        """Open every pooled connection now rather than on first use"""
+        if self.pool is None and not self.connect():
+            return
+        with ExitStack() as stack:
+            for _ in range(self.pool.maxconn):
+                conn = stack.enter_context(self.pool.connection())
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+    
+    def _catalog(self):
+        """The catalog replica if it is loaded, for product lookups"""
+        catalog = self.catalog
+        ready = catalog is not None and catalog.ready
+        if catalog is not None:
+            record_cache("catalog_replica", ready)
+        return catalog if ready else None
+    
+    def _start_replica_monitor(self):
+        """
+        Measure replica lag in the background, at once and then every
+        DB_REPLICA_LAG_CHECK_SECONDS; reads use the primary until a replica
+        has been measured
+        """
+        def monitor():
+            while True:
+                for replica in self.replicas:
+                    replica.check()
+                if self._replica_monitor_stop.wait(DB_REPLICA_LAG_CHECK_SECONDS):
+                    break
+        
+        threading.Thread(target=monitor, name="replica-lag", daemon=True).start()
+    
+    def _pick_replica(self, query: str, max_staleness: float) -> Optional[Replica]:
+        """
+        Choose the least loaded replica that is fresh enough for a read
+        
+        Returns:
+            The replica, or None to use the primary (writes, freshness(0),
+            or no replica within the staleness bound)
+        """
+        if not self.replicas or max_staleness <= 0 or not is_explainable(query):
+            return None
+        candidates = [r for r in self.replicas if r.usable(max_staleness)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda r: (r.load(), r.lag))
     
     def close(self):
-        """Close database connection"""
-        if self.connection:
-            self.connection.close()
+        """Close database connections"""
+        self._replica_monitor_stop.set()
+        for replica in self.replicas:
+            replica.close()
+        if self.pool:
+            self.pool.close()
+            self.pool = None
             logger.info("Database connection closed")
     
-    def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
+    @profiled("execute_query", lambda self, query, *args, **kwargs: fingerprint(query))
+    def execute_query(self, query: str, params: tuple = (),
+                      timeout_ms: int = None, max_staleness: float = None) -> List[Dict]:
         """
         Execute a SQL query and return results
+        Reads go to the least loaded replica within max_staleness, if any
         
         Args:
             query: SQL query string
             params: Query parameters
+            timeout_ms: Server-side statement_timeout (default DB_STATEMENT_TIMEOUT_MS)
+            max_staleness: Accepted replication lag in seconds (default from
+                freshness(), else DB_REPLICA_MAX_STALENESS); 0 reads from the primary
             
         Returns:
             List of dictionaries containing query results
+            
+        Raises:
+            QueryCancelled: The statement hit its timeout or the request was cancelled
         """
+        timeout_ms = DB_STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+        if max_staleness is None:
+            max_staleness = _max_staleness.get()
+        if max_staleness is None:
+            max_staleness = DB_REPLICA_MAX_STALENESS
+        scope = _current_scope.get()
+        start = time.perf_counter()
         try:
-            if not self.connection:
-                self.connect()
-            
-            cursor = self.connection.cursor()
-            cursor.execute(query, params)
+            if scope is not None and scope.cancelled:
+                raise QueryCancelled("Request was cancelled")
             
-            # Get column names
-            columns = [desc[0] for desc in cursor.description]
+            replica = self._pick_replica(query, max_staleness)
+            if replica is not None:
+                try:
+                    results = self._run(replica.pool, query, params, timeout_ms, scope, start)
+                    DB_ROUTED.labels(replica.name).inc()
+                    return results
+                except psycopg2.OperationalError as e:
+                    if isinstance(e, errors.QueryCanceled):
+                        raise
+                    # Connection-level failure: retry once on the primary
+                    replica.mark_unhealthy(e)
             
-            # Fetch all results and convert to list of dicts
-            results = []
-            for row in cursor.fetchall():
-                result_dict = dict(zip(columns, row))
-                # Convert Decimals to floats
-                result_dict = convert_decimals(result_dict)
-                results.append(result_dict)
-            
-            cursor.close()
+            if self.pool is None and not self.connect():
+                raise RuntimeError("Database is not available")
+            results = self._run(self.pool, query, params, timeout_ms, scope, start)
+            DB_ROUTED.labels('primary').inc()
             return results
         
+        except PoolTimeout as e:
+            QUERY_STATS.record(query, time.perf_counter() - start, error=True)
+            DB_CANCELLED.labels('pool_timeout').inc()
+            logger.error(f"⏳ {e} [{fingerprint(query)}]")
+            raise
+        except (errors.QueryCanceled, QueryCancelled) as e:
+            QUERY_STATS.record(query, time.perf_counter() - start, error=True)
+            if scope is not None and scope.cancelled:
+                DB_CANCELLED.labels('cancelled').inc()
+                logger.warning(f"🛑 Query cancelled [{fingerprint(query)}]")
+                raise QueryCancelled("Request was cancelled") from e
+            DB_CANCELLED.labels('timeout').inc()
+            logger.error(f"⏱️ Query timed out after {timeout_ms} ms [{fingerprint(query)}]")
+            raise QueryCancelled(f"Query timed out after {timeout_ms} ms") from e
         except psycopg2.Error as e:
-            # Rollback transaction on error
-            if self.connection:
-                self.connection.rollback()
-            logger.error(f"Query execution error: {e}")
+            DB_ERRORS.inc()
+            QUERY_STATS.record(query, time.perf_counter() - start, error=True)
+            logger.error(f"Query execution error [{fingerprint(query)}]: {e}")
+            if self.raise_errors or _raise_errors.get():
+                raise
             return []
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            DB_ERRORS.inc()
+            QUERY_STATS.record(query, time.perf_counter() - start, error=True)
+            logger.error(f"Unexpected error [{fingerprint(query)}]: {e}")
+            if self.raise_errors or _raise_errors.get():
+                raise
             return []
+    
+    def _run(self, pool: ConnectionPool, query: str, params: tuple,
+             timeout_ms: int, scope: Optional[CancelScope], start: float) -> List[Dict]:
+        """Run one statement on a connection from pool and record its stats"""
+        with pool.connection(scope) as conn:
+            if scope is not None and not scope.register(conn):
+                raise QueryCancelled("Request was cancelled")
+            try:
+                cursor = conn.cursor()
+                # Sent with the statement, so the limit costs no extra round trip
+                cursor.execute(f"SET statement_timeout = {int(timeout_ms)}; {query}", params)
+                
+                # Get column names
+                columns = [desc[0] for desc in cursor.description]
+                
+                # Fetch all results and convert to list of dicts
+                results = []
+                for row in cursor.fetchall():
+                    result_dict = dict(zip(columns, row))
+                    # Convert Decimals to floats
+                    result_dict = convert_decimals(result_dict)
+                    results.append(result_dict)
+                
+                cursor.close()
+            finally:
+                if scope is not None:
+                    scope.unregister(conn)
+            
+            duration = time.perf_counter() - start
+            QUERY_STATS.record(query, duration, rows=len(results))
+        if duration * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(query, duration, len(results))
+            if QUERY_STATS.should_explain(query):
+                self._queue_explain(pool, query, params, timeout_ms, duration)
+        return results
+    
+    def _queue_explain(self, pool: ConnectionPool, query: str, params: tuple,
+                       timeout_ms: int, duration: float):
+        """Capture the plan of a slow statement in the background, one at a time"""
+        if not _explain_slot.acquire(blocking=False):
+            return  # a capture is still running
+        try:
+            _explain_executor.submit(self._capture_explain, pool, query, params, timeout_ms, duration)
+        except RuntimeError:
+            _explain_slot.release()  # shutting down
+    
+    def _capture_explain(self, pool: ConnectionPool, query: str, params: tuple,
+                         timeout_ms: int, duration: float):
+        """
+        Re-run a slow statement under EXPLAIN (ANALYZE, BUFFERS) and keep the plan
+        Runs on the explain thread, never in a request. Skipped when the pool
+        has no idle connection, so requests are not kept waiting for one.
         
-        except psycopg2.Error as e:
-            logger.error(f"Query execution error: {e}")
-            return []
+        Args:
+            pool: Pool of the database the statement ran on
+            query: SQL query string
+            params: Query parameters
+            timeout_ms: The statement's own statement_timeout
+            duration: Observed execution time in seconds
+        """
+        try:
+            counts = pool.counts()
+            if counts['in_use'] >= counts['max']:
+                logger.info(f"📝 Skipped plan capture for {fingerprint(query)}: pool busy")
+                return
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SET statement_timeout = {int(timeout_ms)}; EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                cursor.close()
+            QUERY_STATS.add_explain(query, duration, plan)
+            logger.info(f"📝 Captured plan for slow query {fingerprint(query)}")
+        except Exception as e:
+            logger.error(f"EXPLAIN capture failed [{fingerprint(query)}]: {e}")
+        finally:
+            _explain_slot.release()
     
+    @timed(DB_QUERY_SECONDS, "get_all_products")
     def get_all_products(self) -> List[Dict]:
         """
         Get all products from the database
@@ -114,6 +650,10 @@ class InventoryDBConnector:
         Returns:
             List of products with their details
         """
+        catalog = self._catalog()
+        if catalog is not None:
+            return catalog.get_all_products()
+        
         query = """
             SELECT 
                 p.product_id,
@@ -126,8 +666,9 @@ class InventoryDBConnector:
             LEFT JOIN product_categories pc ON p.category_id = pc.category_id
             ORDER BY p.name
         """
-        return self.execute_query(query)
+        return self.execute_query(query, timeout_ms=STATEMENT_TIMEOUTS['get_all_products'])
     
+    @timed(DB_QUERY_SECONDS, "get_product_by_fuzzy_name")
     def get_product_by_fuzzy_name(self, product_name: str) -> Optional[Dict]:
         """
         Find a product by fuzzy matching on name
@@ -139,6 +680,10 @@ class InventoryDBConnector:
         Returns:
             Product details or None if not found
         """
+        catalog = self._catalog()
+        if catalog is not None:
+            return catalog.get_product_by_fuzzy_name(product_name)
+        
         # First try exact match (case-insensitive)
         query_exact = """
             SELECT 
@@ -152,7 +697,10 @@ class InventoryDBConnector:
             LIMIT 1
         """
         
-        results = self.execute_query(query_exact, (product_name,))
+        results = self.execute_query(
+            query_exact, (product_name,),
+            timeout_ms=STATEMENT_TIMEOUTS['get_product_by_fuzzy_name']
+        )
         if results:
             return results[0]
         
@@ -173,10 +721,14 @@ class InventoryDBConnector:
         
         # Build LIKE pattern
         like_pattern = f"%{product_name}%"
-        results = self.execute_query(query_fuzzy, (like_pattern,))
+        results = self.execute_query(
+            query_fuzzy, (like_pattern,),
+            timeout_ms=STATEMENT_TIMEOUTS['get_product_by_fuzzy_name']
+        )
         
         return results[0] if results else None
     
+    @timed(DB_QUERY_SECONDS, "search_products")
     def search_products(self, search_term: str) -> List[Dict]:
         """
         Search for products by name or SKU code
@@ -187,6 +739,10 @@ class InventoryDBConnector:
         Returns:
             List of matching products
         """
+        catalog = self._catalog()
+        if catalog is not None:
+            return catalog.search_products(search_term)
+        
         query = """
             SELECT 
                 product_id,
@@ -202,8 +758,60 @@ class InventoryDBConnector:
         """
         
         like_pattern = f"%{search_term}%"
-        return self.execute_query(query, (like_pattern, like_pattern))
+        return self.execute_query(
+            query, (like_pattern, like_pattern),
+            timeout_ms=STATEMENT_TIMEOUTS['search_products']
+        )
     
+    @timed(DB_QUERY_SECONDS, "search_products_many")
+    def search_products_many(self, search_terms: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Search for several products at once, in one statement
+        Same matches as search_products for each term
+        
+        Args:
+            search_terms: Product names or SKUs to search for
+            
+        Returns:
+            Matching products for each term (terms without matches map to [])
+        """
+        results = {term: [] for term in search_terms}
+        if not search_terms:
+            return results
+        
+        catalog = self._catalog()
+        if catalog is not None:
+            return {term: catalog.search_products(term) for term in results}
+        
+        query = """
+            SELECT 
+                t.term,
+                p.product_id,
+                p.name,
+                p.sku_code,
+                p.unit_of_measure,
+                p.per_unit_cost
+            FROM unnest(%s::text[]) AS t(term)
+            CROSS JOIN LATERAL (
+                SELECT product_id, name, sku_code, unit_of_measure, per_unit_cost
+                FROM products
+                WHERE LOWER(name) LIKE '%%' || LOWER(t.term) || '%%'
+                   OR LOWER(sku_code) LIKE '%%' || LOWER(t.term) || '%%'
+                ORDER BY name
+                LIMIT 10
+            ) p
+            ORDER BY t.term, p.name
+        """
+        
+        rows = self.execute_query(
+            query, (list(results),),
+            timeout_ms=STATEMENT_TIMEOUTS['search_products_many']
+        )
+        for row in rows:
+            results[row.pop('term')].append(row)
+        return results
+    
+    @timed(DB_QUERY_SECONDS, "get_product_stock_level")
     def get_product_stock_level(self, product_id: int) -> Optional[Dict]:
         """
         Get current stock levels for a product across all warehouses
@@ -228,9 +836,47 @@ class InventoryDBConnector:
             GROUP BY p.product_id, p.name, p.sku_code, p.unit_of_measure
         """
         
-        results = self.execute_query(query, (product_id,))
+        results = self.execute_query(
+            query, (product_id,),
+            timeout_ms=STATEMENT_TIMEOUTS['get_product_stock_level']
+        )
         return results[0] if results else None
     
+    @timed(DB_QUERY_SECONDS, "get_product_stock_levels")
+    def get_product_stock_levels(self, product_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Get current stock levels for several products, in one statement
+        
+        Args:
+            product_ids: Product IDs
+            
+        Returns:
+            Product stock information by product_id (unknown IDs are left out)
+        """
+        if not product_ids:
+            return {}
+        
+        query = """
+            SELECT 
+                p.product_id,
+                p.name,
+                p.sku_code,
+                p.unit_of_measure,
+                COALESCE(SUM(sl.quantity_on_hand), 0) as total_stock,
+                COALESCE(SUM(sl.quantity_on_hand * p.per_unit_cost), 0) as total_value
+            FROM products p
+            LEFT JOIN stock_levels sl ON p.product_id = sl.product_id
+            WHERE p.product_id = ANY(%s)
+            GROUP BY p.product_id, p.name, p.sku_code, p.unit_of_measure
+        """
+        
+        results = self.execute_query(
+            query, (list(product_ids),),
+            timeout_ms=STATEMENT_TIMEOUTS['get_product_stock_levels']
+        )
+        return {row['product_id']: row for row in results}
+    
+    @timed(DB_QUERY_SECONDS, "get_product_stock_by_warehouse")
     def get_product_stock_by_warehouse(self, product_id: int) -> List[Dict]:
         """
         Get stock levels for a product by warehouse
@@ -255,8 +901,12 @@ class InventoryDBConnector:
             ORDER BY w.name, l.name
         """
         
-        return self.execute_query(query, (product_id,))
+        return self.execute_query(
+            query, (product_id,),
+            timeout_ms=STATEMENT_TIMEOUTS['get_product_stock_by_warehouse']
+        )
     
+    @timed(DB_QUERY_SECONDS, "get_low_stock_products")
     def get_low_stock_products(self, threshold: int = 50) -> List[Dict]:
         """
         Get products with stock below threshold
@@ -281,8 +931,12 @@ class InventoryDBConnector:
             ORDER BY current_stock ASC
         """
         
-        return self.execute_query(query, (threshold, threshold))
+        return self.execute_query(
+            query, (threshold, threshold),
+            timeout_ms=STATEMENT_TIMEOUTS['get_low_stock_products']
+        )
     
+    @timed(DB_QUERY_SECONDS, "get_warehouse_inventory_summary")
     def get_warehouse_inventory_summary(self) -> List[Dict]:
         """
         Get inventory summary by warehouse
@@ -304,8 +958,11 @@ class InventoryDBConnector:
             ORDER BY w.name
         """
         
-        return self.execute_query(query)
+        return self.execute_query(
+            query, timeout_ms=STATEMENT_TIMEOUTS['get_warehouse_inventory_summary']
+        )
     
+    @timed(DB_QUERY_SECONDS, "get_product_details")
     def get_product_details(self, product_name: str) -> Optional[Dict]:
         """
         Get complete product details including stock information
@@ -331,45 +988,364 @@ class InventoryDBConnector:
             'warehouse_stock': warehouse_stock
         }
     
-    def get_statistics(self) -> Dict:
+    @timed(DB_QUERY_SECONDS, "get_statistics")
+    def get_statistics(self, exact: bool = STATS_EXACT) -> Dict:
         """
         Get general inventory statistics
         
+        Small tables are always counted exactly. Larger ones are estimated
+        unless exact is set: row counts from pg_class.reltuples, give or take
+        the rows changed since the last ANALYZE, and total stock as the mean
+        quantity per row in a TABLESAMPLE of about STATS_SAMPLE_PAGES pages
+        times the estimated rows, with a 95% interval. The cost is the same
+        whatever the table size. A table the catalog has no usable row for is
+        counted exactly.
+        
+        Args:
+            exact: Count and sum over the full tables instead
+        
         Returns:
-            Inventory statistics
+            Inventory statistics, "approximate" and the +/- "margins" of
+            estimated figures
+        """
+        if exact:
+            return {**self._exact_statistics(), 'approximate': False, 'margins': {}}
+        
+        timeout_ms = STATEMENT_TIMEOUTS['get_statistics']
+        query = """
+            SELECT 
+                c.relname,
+                c.reltuples,
+                pg_relation_size(c.oid) / current_setting('block_size')::int as pages,
+                COALESCE(s.n_mod_since_analyze, 0) as modified
+            FROM pg_class c
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.oid IN ('products'::regclass, 'warehouses'::regclass, 'stock_levels'::regclass)
         """
+        tables = {row['relname']: row for row in self.execute_query(query, timeout_ms=timeout_ms)}
+        
+        def small(info) -> bool:
+            # Missing from the catalog query (it failed), never analyzed, or cheap to scan
+            return info is None or info['reltuples'] < 0 or info['pages'] <= STATS_SAMPLE_PAGES
+        
+        stats, margins = {}, {}
+        catalog = self._catalog()
+        for field, table in (('total_products', 'products'), ('total_warehouses', 'warehouses')):
+            info = tables.get(table)
+            if table == 'products' and catalog is not None:
+                stats[field] = catalog.count_products()
+            elif small(info):
+                result = self.execute_query(f"SELECT COUNT(*) as count FROM {table}", timeout_ms=timeout_ms)
+                stats[field] = result[0]['count'] if result else 0
+            else:
+                stats[field] = int(info['reltuples'])
+                margins[field] = int(info['modified'])
+        
+        info = tables.get('stock_levels')
+        sample = [] if small(info) else self.execute_query("""
+            SELECT SUM(quantity_on_hand) as total, COUNT(*) as rows
+            FROM stock_levels TABLESAMPLE SYSTEM (%s)
+            GROUP BY (ctid::text::point)[0]
+        """, (100.0 * STATS_SAMPLE_PAGES / info['pages'],), timeout_ms=timeout_ms)
+        if not sample:
+            query = "SELECT COALESCE(SUM(quantity_on_hand), 0) as total FROM stock_levels"
+            result = self.execute_query(query, timeout_ms=timeout_ms)
+            stats['total_stock_units'] = result[0]['total'] if result else 0
+        else:
+            # Ratio estimate: mean quantity per sampled row times the estimated
+            # rows, so empty or bloated pages (never in the sample) add nothing.
+            # Sampled pages are the clusters of the standard error.
+            totals = [float(page['total'] or 0) for page in sample]
+            counts = [page['rows'] for page in sample]
+            n = len(sample)
+            ratio = sum(totals) / sum(counts)
+            rows = float(info['reltuples'])
+            residual = sum((t - ratio * c) ** 2 for t, c in zip(totals, counts)) / max(n - 1, 1)
+            mean_rows = sum(counts) / n
+            sampling = STATS_Z * rows * (residual * max(0.0, 1 - n / info['pages']) / n) ** 0.5 / mean_rows
+            stats['total_stock_units'] = round(ratio * rows)
+            # Plus the rows changed since reltuples was measured
+            margins['total_stock_units'] = round(sampling + abs(ratio) * int(info['modified']))
+        
+        return {**stats, 'approximate': bool(margins), 'margins': margins}
+    
+    def _exact_statistics(self) -> Dict:
+        """Full COUNT(*) and SUM over products, stock_levels and warehouses"""
         stats = {}
+        timeout_ms = STATEMENT_TIMEOUTS['get_statistics']
         
         # Total products
         query = "SELECT COUNT(*) as count FROM products"
-        result = self.execute_query(query)
+        result = self.execute_query(query, timeout_ms=timeout_ms)
         stats['total_products'] = result[0]['count'] if result else 0
         
         # Total stock
         query = "SELECT COALESCE(SUM(quantity_on_hand), 0) as total FROM stock_levels"
-        result = self.execute_query(query)
+        result = self.execute_query(query, timeout_ms=timeout_ms)
         stats['total_stock_units'] = result[0]['total'] if result else 0
         
         # Total warehouses
         query = "SELECT COUNT(*) as count FROM warehouses"
-        result = self.execute_query(query)
+        result = self.execute_query(query, timeout_ms=timeout_ms)
         stats['total_warehouses'] = result[0]['count'] if result else 0
         
         return stats
+    
+    # ------------------------------------------------------------------------
+    # Move history
+    # move_history is partitioned by month on move_timestamp. Every query
+    # below is bounded by move_timestamp >= start AND < end, so Postgres only
+    # scans the partitions of those months.
+    # ------------------------------------------------------------------------
+    
+    @timed(DB_QUERY_SECONDS, "get_movement_summary")
+    def get_movement_summary(self, start: datetime, end: datetime,
+                             product_id: int = None, top: int = 5) -> Dict:
+        """
+        Get move totals per type and the most moved products in a time range
+        
+        Args:
+            start: Inclusive lower bound on move_timestamp
+            end: Exclusive upper bound on move_timestamp
+            product_id: Only this product's moves
+            top: Number of most-moved products to list
+            
+        Returns:
+            Totals per move type, the top products, and the archived months
+            the range reaches into (their moves are not counted)
+        """
+        timeout_ms = STATEMENT_TIMEOUTS['get_movement_summary']
+        window = "mh.move_timestamp >= %s AND mh.move_timestamp < %s AND (%s::int IS NULL OR mh.product_id = %s::int)"
+        params = (start, end, product_id, product_id)
+        
+        by_type = self.execute_query(f"""
+            SELECT 
+                mh.transaction_type as type,
+                COUNT(*) as moves,
+                COALESCE(SUM(ABS(mh.quantity_change)), 0) as units
+            FROM move_history mh
+            WHERE {window}
+            GROUP BY mh.transaction_type
+            ORDER BY mh.transaction_type
+        """, params, timeout_ms=timeout_ms)
+        
+        top_products = self.execute_query(f"""
+            SELECT 
+                p.name,
+                p.sku_code,
+                p.unit_of_measure,
+                COUNT(*) as moves,
+                SUM(mh.quantity_change) as net_change
+            FROM move_history mh
+            JOIN products p ON mh.product_id = p.product_id
+            WHERE {window}
+            GROUP BY p.product_id, p.name, p.sku_code, p.unit_of_measure
+            ORDER BY moves DESC, p.name
+            LIMIT %s
+        """, params + (top,), timeout_ms=timeout_ms)
+        
+        return {
+            'total_moves': sum(row['moves'] for row in by_type),
+            'by_type': by_type,
+            'top_products': top_products,
+            'archived': self.get_archived_ranges(start, end),
+        }
+    
+    @timed(DB_QUERY_SECONDS, "get_archived_ranges")
+    def get_archived_ranges(self, start: datetime, end: datetime) -> List[Dict]:
+        """
+        Get the archived move_history months overlapping a time range
+        
+        Args:
+            start: Inclusive start of the range
+            end: Exclusive end of the range
+            
+        Returns:
+            Archive index rows (range, row count, file), oldest first
+        """
+        if not self._has_move_archive():
+            return []
+        
+        query = """
+            SELECT 
+                partition_name,
+                range_start,
+                range_end,
+                row_count,
+                file_path
+            FROM move_history_archive
+            WHERE range_start < %s AND range_end > %s
+            ORDER BY range_start
+        """
+        
+        return self.execute_query(
+            query, (end, start),
+            timeout_ms=STATEMENT_TIMEOUTS['get_archived_ranges']
+        )
+    
+    @timed(DB_QUERY_SECONDS, "get_daily_outflows")
+    def get_daily_outflows(self, days: int) -> List[Dict]:
+        """
+        Units delivered per product and day over the last days, for forecasting
+        Days are 24-hour windows counted back from now
+        
+        Args:
+            days: Length of the history
+            
+        Returns:
+            Rows of product_id, days_ago (0 = the last 24 hours) and quantity
+        """
+        now = datetime.now()
+        query = """
+            SELECT 
+                product_id,
+                FLOOR(EXTRACT(EPOCH FROM (%s - move_timestamp)) / 86400)::int as days_ago,
+                SUM(-quantity_change) as quantity
+            FROM move_history
+            WHERE transaction_type = 'delivery'
+              AND move_timestamp > %s
+              AND move_timestamp <= %s
+            GROUP BY 1, 2
+        """
+        return self.execute_query(
+            query, (now, now - timedelta(days=days), now),
+            timeout_ms=STATEMENT_TIMEOUTS['get_daily_outflows']
+        )
+    
+    @timed(DB_QUERY_SECONDS, "get_stock_totals")
+    def get_stock_totals(self) -> Dict[int, float]:
+        """
+        Units on hand per product, summed over all locations
+        
+        Returns:
+            Total quantity by product_id (products without stock rows are left out)
+        """
+        query = """
+            SELECT product_id, SUM(quantity_on_hand) as total_stock
+            FROM stock_levels
+            GROUP BY product_id
+        """
+        results = self.execute_query(query, timeout_ms=STATEMENT_TIMEOUTS['get_stock_totals'])
+        return {row['product_id']: row['total_stock'] for row in results}
+    
+    @timed(DB_QUERY_SECONDS, "get_rebalance_matrix")
+    def get_rebalance_matrix(self, product_id: int = None) -> List[Dict]:
+        """
+        Stock per product and location with its min/max levels, for rebalancing
+        Only products short of their minimum somewhere are returned. Draft and
+        confirmed internal transfers count as already moved.
+        
+        Args:
+            product_id: Limit to one product, or None for all products
+            
+        Returns:
+            Rows of product_id, location_id, warehouse_id, quantity,
+            min_level and max_level (None when unset)
+        """
+        query = """
+            WITH pending AS (
+                SELECT product_id, location_id, SUM(quantity) as quantity
+                FROM (
+                    SELECT product_id, to_location_id as location_id, quantity
+                    FROM internal_transfers WHERE status IN ('draft', 'confirmed')
+                    UNION ALL
+                    SELECT product_id, from_location_id, -quantity
+                    FROM internal_transfers WHERE status IN ('draft', 'confirmed')
+                ) t
+                GROUP BY product_id, location_id
+            )
+            SELECT 
+                sl.product_id,
+                sl.location_id,
+                l.warehouse_id,
+                sl.quantity_on_hand + COALESCE(pd.quantity, 0) as quantity,
+                COALESCE(sl.min_stock_level, 0) as min_level,
+                sl.max_stock_level as max_level
+            FROM stock_levels sl
+            JOIN locations l ON sl.location_id = l.location_id
+            LEFT JOIN pending pd ON pd.product_id = sl.product_id AND pd.location_id = sl.location_id
+            WHERE sl.product_id IN (
+                SELECT product_id FROM stock_levels
+                WHERE quantity_on_hand < min_stock_level
+                  AND (%s::int IS NULL OR product_id = %s::int)
+            )
+        """
+        
+        return self.execute_query(
+            query, (product_id, product_id),
+            timeout_ms=STATEMENT_TIMEOUTS['get_rebalance_matrix']
+        )
+    
+    @timed(DB_QUERY_SECONDS, "get_location_names")
+    def get_location_names(self, location_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Names of several locations and their warehouses in one statement
+        
+        Args:
+            location_ids: Location IDs
+            
+        Returns:
+            location_name, short_code and warehouse_name by location_id
+        """
+        if not location_ids:
+            return {}
+        query = """
+            SELECT 
+                l.location_id,
+                l.name as location_name,
+                l.short_code,
+                w.name as warehouse_name
+            FROM locations l
+            JOIN warehouses w ON l.warehouse_id = w.warehouse_id
+            WHERE l.location_id = ANY(%s)
+        """
+        results = self.execute_query(
+            query, (list(location_ids),),
+            timeout_ms=STATEMENT_TIMEOUTS['get_location_names']
+        )
+        return {row['location_id']: row for row in results}
+    
+    def _has_move_archive(self) -> bool:
+        # The archive index exists once partition_move_history.sql has run
+        if self._move_archive_present:
+            return True
+        checked_at = self._move_archive_checked_at
+        if checked_at is not None and time.monotonic() - checked_at < MOVE_ARCHIVE_RECHECK_SECONDS:
+            return False
+        result = self.execute_query(
+            "SELECT to_regclass('move_history_archive') IS NOT NULL as present"
+        )
+        self._move_archive_present = bool(result and result[0]['present'])
+        self._move_archive_checked_at = time.monotonic()
+        return self._move_archive_present
 
 
 # Global connector instance
 _connector = None
 
 def get_connector() -> InventoryDBConnector:
-    """Get or create global database connector instance"""
+    """
+    Get or create global database connector instance
+    Does not connect: the pool is opened by the first query (or warm-up),
+    so callers on the event loop never wait for the database
+    """
     global _connector
     if _connector is None:
         _connector = InventoryDBConnector()
-        _connector.connect()
     return _connector
 
 
+def _connection_count(state: str) -> int:
+    """Connection count of the global connector, for the pool gauge"""
+    connector = _connector
+    return connector.connection_counts()[state] if connector else 0
+
+
+DB_POOL_CONNECTIONS.labels('open').set_function(lambda: _connection_count('open'))
+DB_POOL_CONNECTIONS.labels('in_use').set_function(lambda: _connection_count('in_use'))
+DB_POOL_CONNECTIONS.labels('max').set_function(lambda: DB_POOL_MAX)
+
+
 def close_connector():
     """Close global connector"""
     global _connector
@@ -1,5 +1,6 @@
 """
 Quick debug script to test database connection and queries
+For query plans and index proposals, run index_advisor.py
 """
 import sys
 sys.path.insert(0, '.')
@@ -0,0 +1,327 @@
+"""
+Demand forecasts and projected stock-outs for every product
+Daily delivery outflows are laid out as one dense product x day array and
+all products are fitted at once with NumPy: simple exponential smoothing at
+a few smoothing factors and moving averages over two windows. Each product
+keeps the model with the lowest one-step-ahead error over its history, and
+stock on hand divided by the forecast daily demand gives the stock-out date.
+
+Outflows come from the columnar store when it is built, else from one
+aggregated query on move_history. Forecasts are cached for
+FORECAST_CACHE_SECONDS.
+
+Run as a script to time a refresh on synthetic data:
+    python forecasting.py --benchmark 100000
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from columnar import MOVE_TYPES, get_columnar
+from db_connector import get_connector
+from metrics import STAGE_SECONDS, record_cache, timed
+
+logger = logging.getLogger(__name__)
+
+# The first days of the history only warm the models up and are not scored
+WARMUP_DAYS = 7
+
+load_dotenv()
+FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', 56))
+FORECAST_CACHE_SECONDS = float(os.getenv('FORECAST_CACHE_SECONDS', 300))
+FORECAST_HORIZON_DAYS = int(os.getenv('FORECAST_HORIZON_DAYS', 7))
+
+# Models are scored on the days after the warm-up, so at least one must remain
+if FORECAST_HISTORY_DAYS <= WARMUP_DAYS:
+    logger.warning(f"⚠️ FORECAST_HISTORY_DAYS={FORECAST_HISTORY_DAYS} leaves no days after the "
+                   f"{WARMUP_DAYS}-day warm-up, using {WARMUP_DAYS + 1}")
+    FORECAST_HISTORY_DAYS = WARMUP_DAYS + 1
+
+SMOOTHING_ALPHAS = (0.1, 0.3, 0.5)
+MOVING_AVERAGE_WINDOWS = (7, 28)
+DAY_SECONDS = 86400
+DELIVERY = MOVE_TYPES.index('delivery')
+
+
+# ============================================================================
+# MODELS (one row per product, one column per day, oldest first)
+# ============================================================================
+
+def outflow_matrix(product_ids: np.ndarray, move_product_ids: np.ndarray,
+                   move_days: np.ndarray, quantities: np.ndarray, days: int) -> np.ndarray:
+    """
+    Sum outflows into a dense products x days array
+
+    Args:
+        product_ids: Sorted product ids, one per row
+        move_product_ids: Product of each outflow
+        move_days: Day index of each outflow (0 = oldest day)
+        quantities: Units of each outflow
+        days: Number of days (columns)
+
+    Returns:
+        float64 array of shape (len(product_ids), days)
+    """
+    n = len(product_ids)
+    if n == 0:
+        return np.zeros((0, days))
+    index = np.minimum(np.searchsorted(product_ids, move_product_ids), n - 1)
+    valid = (product_ids[index] == move_product_ids) & (move_days >= 0) & (move_days < days)
+    cells = index[valid].astype(np.int64) * days + move_days[valid]
+    return np.bincount(cells, weights=quantities[valid], minlength=n * days).reshape(n, days)
+
+
+def sum_by_product(product_ids: np.ndarray, ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Sum values per product, aligned with the sorted product_ids"""
+    return outflow_matrix(product_ids, ids, np.zeros(len(ids), dtype=np.int64), values, 1)[:, 0]
+
+
+def exponential_smoothing(demand: np.ndarray, alpha: float):
+    """
+    Simple exponential smoothing of every row
+
+    Returns:
+        (forecast for the next day, sum of absolute one-step-ahead errors) per row
+    """
+    level = demand[:, :WARMUP_DAYS].mean(axis=1)
+    error = np.zeros(len(demand))
+    for t in range(WARMUP_DAYS, demand.shape[1]):
+        actual = demand[:, t]
+        error += np.abs(actual - level)
+        level += alpha * (actual - level)
+    return level, error
+
+
+def moving_average(demand: np.ndarray, window: int):
+    """
+    Moving average of the last window days of every row
+
+    Returns:
+        (forecast for the next day, sum of absolute one-step-ahead errors) per row
+    """
+    days = demand.shape[1]
+    total = np.zeros((len(demand), days + 1))
+    np.cumsum(demand, axis=1, out=total[:, 1:])
+    t = np.arange(WARMUP_DAYS, days)
+    start = np.maximum(0, t - window)
+    fitted = (total[:, t] - total[:, start]) / (t - start)
+    error = np.abs(demand[:, WARMUP_DAYS:] - fitted).sum(axis=1)
+    window = min(window, days)
+    return (total[:, days] - total[:, days - window]) / window, error
+
+
+MODELS = (
+    [(f"ses_{alpha}", lambda demand, alpha=alpha: exponential_smoothing(demand, alpha))
+     for alpha in SMOOTHING_ALPHAS]
+    + [(f"ma_{window}", lambda demand, window=window: moving_average(demand, window))
+       for window in MOVING_AVERAGE_WINDOWS]
+)
+
+
+def fit(demand: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Fit every model to every row and keep each row's best model
+
+    Args:
+        demand: products x days outflows, at least WARMUP_DAYS + 1 days
+
+    Returns:
+        Daily demand forecast, mean absolute error and model index per row
+    """
+    forecasts, errors = zip(*(model(demand) for _, model in MODELS))
+    forecasts, errors = np.vstack(forecasts), np.vstack(errors)
+    best = errors.argmin(axis=0)
+    rows = np.arange(len(demand))
+    return {
+        'rate': np.maximum(forecasts[best, rows], 0.0),
+        'mae': errors[best, rows] / (demand.shape[1] - WARMUP_DAYS),
+        'model': best,
+    }
+
+
+# ============================================================================
+# FORECASTS
+# ============================================================================
+
+class Forecast:
+    """
+    Demand forecast and projected stock-out for every product
+    """
+
+    def __init__(self, product_ids: np.ndarray, stock: np.ndarray, demand: np.ndarray,
+                 products: Dict[int, tuple], source: str):
+        self.product_ids = product_ids
+        self.stock = stock
+        self.products = products
+        self.source = source
+        self.built_at = datetime.now()
+        fitted = fit(demand)
+        self.rate = fitted['rate']
+        self.mae = fitted['mae']
+        self.model = fitted['model']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.days_left = np.where(
+                self.rate > 0, np.maximum(self.stock, 0.0) / self.rate, np.inf
+            )
+
+    def _row(self, i: int) -> Dict:
+        product_id = int(self.product_ids[i])
+        name, sku, unit = self.products.get(product_id, (f"#{product_id}", "", ""))
+        days_left = float(self.days_left[i])
+        return {
+            'product_id': product_id,
+            'name': name,
+            'sku_code': sku,
+            'unit_of_measure': unit,
+            'stock': float(self.stock[i]),
+            'daily_demand': round(float(self.rate[i]), 3),
+            'error': round(float(self.mae[i]), 3),
+            'model': MODELS[self.model[i]][0],
+            'days_left': round(days_left, 1) if np.isfinite(days_left) else None,
+            'stockout_date': (
+                (self.built_at + timedelta(days=days_left)).date().isoformat()
+                if np.isfinite(days_left) else None
+            ),
+        }
+
+    def stockouts(self, horizon_days: int, limit: int = 20) -> List[Dict]:
+        """Products projected to run out within horizon_days, soonest first"""
+        due = np.flatnonzero(self.days_left <= horizon_days)
+        due = due[np.argsort(self.days_left[due], kind='stable')][:limit]
+        return [self._row(i) for i in due]
+
+    def for_product(self, product_id: int) -> Optional[Dict]:
+        i = np.searchsorted(self.product_ids, product_id)
+        if i < len(self.product_ids) and self.product_ids[i] == product_id:
+            return self._row(int(i))
+        return None
+
+
+def _from_columnar(store, days: int) -> Forecast:
+    """Outflows and stock from the columnar store, without touching Postgres"""
+    products = store.tables['products']
+    product_ids = np.asarray(products['product_id'], dtype=np.int64)
+
+    moves = store.tables['moves']
+    now = time.time()
+    mask = (moves['type_code'] == DELIVERY) & (moves['move_ts'] >= int(now - days * DAY_SECONDS))
+    move_days = days - 1 - (now - moves['move_ts'][mask]) // DAY_SECONDS
+    demand = outflow_matrix(
+        product_ids, moves['product_id'][mask].astype(np.int64),
+        move_days.astype(np.int64), -moves['quantity_change'][mask], days
+    )
+
+    stock_table = store.tables['stock']
+    stock = sum_by_product(
+        product_ids, stock_table['product_id'].astype(np.int64), stock_table['quantity']
+    )
+
+    names = {product_id: tuple(entry) for product_id, entry in store.product_names.items()}
+    return Forecast(product_ids, stock, demand, names, "columnar")
+
+
+def _from_database(connector, days: int) -> Forecast:
+    """Outflows aggregated per product and day by Postgres, then laid out densely"""
+    catalog = connector.get_all_products()
+    product_ids = np.array(sorted(p['product_id'] for p in catalog), dtype=np.int64)
+    names = {p['product_id']: (p['name'], p['sku_code'], p['unit_of_measure']) for p in catalog}
+
+    rows = connector.get_daily_outflows(days)
+    demand = outflow_matrix(
+        product_ids,
+        np.array([r['product_id'] for r in rows], dtype=np.int64),
+        np.array([days - 1 - r['days_ago'] for r in rows], dtype=np.int64),
+        np.array([r['quantity'] for r in rows], dtype=np.float64),
+        days,
+    )
+
+    totals = connector.get_stock_totals()
+    stock = sum_by_product(
+        product_ids,
+        np.array(list(totals), dtype=np.int64),
+        np.array(list(totals.values()), dtype=np.float64),
+    )
+    return Forecast(product_ids, stock, demand, names, "database")
+
+
+_forecast: Optional[Forecast] = None
+_forecast_at = 0.0
+_forecast_lock = threading.Lock()
+
+
+@timed(STAGE_SECONDS, "forecast")
+def build_forecast(days: int = FORECAST_HISTORY_DAYS) -> Forecast:
+    """Fit forecasts for all products from the freshest available data"""
+    store = get_columnar()
+    if store is not None:
+        return _from_columnar(store, days)
+    return _from_database(get_connector(), days)
+
+
+def get_forecast() -> Forecast:
+    """
+    Current forecasts, rebuilt when older than FORECAST_CACHE_SECONDS
+    Concurrent callers wait for one rebuild instead of each running it
+    """
+    global _forecast, _forecast_at
+    fresh = _forecast is not None and time.monotonic() - _forecast_at < FORECAST_CACHE_SECONDS
+    record_cache("forecast", fresh)
+    if fresh:
+        return _forecast
+    with _forecast_lock:
+        if _forecast is None or time.monotonic() - _forecast_at >= FORECAST_CACHE_SECONDS:
+            start = time.perf_counter()
+            _forecast = build_forecast()
+            _forecast_at = time.monotonic()
+            logger.info(
+                f"📈 Forecast {len(_forecast.product_ids)} products from {_forecast.source} "
+                f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+        return _forecast
+
+
+def benchmark(products: int, days: int = FORECAST_HISTORY_DAYS, seed: int = 0) -> Dict:
+    """Time a full fit on synthetic Poisson demand"""
+    rng = np.random.default_rng(seed)
+    rates = rng.gamma(1.0, 3.0, size=(products, 1))
+    demand = rng.poisson(rates, size=(products, days)).astype(np.float64)
+    product_ids = np.arange(1, products + 1)
+    stock = rng.uniform(0, 200, size=products)
+
+    start = time.perf_counter()
+    forecast = Forecast(product_ids, stock, demand, {}, "synthetic")
+    elapsed = time.perf_counter() - start
+    return {
+        'products': products,
+        'days': days,
+        'seconds': round(elapsed, 3),
+        'stockouts_7d': int((forecast.days_left <= 7).sum()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Demand forecasts and projected stock-outs")
+    parser.add_argument("--benchmark", type=int, metavar="PRODUCTS",
+                        help="Time a fit on synthetic data for this many products")
+    parser.add_argument("--days", type=int, default=FORECAST_HORIZON_DAYS,
+                        help="List products running out within this many days")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(benchmark(args.benchmark))
+        return
+    for row in build_forecast().stockouts(args.days):
+        print(f"{row['stockout_date']}  {row['name']}: {row['stock']} {row['unit_of_measure']} "
+              f"at {row['daily_demand']}/day ({row['model']})")
+
+
+if __name__ == "__main__":
+    main()
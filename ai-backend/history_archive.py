@@ -0,0 +1,292 @@
+"""
+Retention job for the partitioned move_history table
+Copies monthly partitions older than the retention window to gzip-compressed
+CSV files, records them in the move_history_archive index and drops them,
+so the live table only holds recent months
+
+Needs backend/migrations/partition_move_history.sql. Run it from cron:
+    python history_archive.py                 # archive partitions past retention
+    python history_archive.py --dry-run       # only list what would be archived
+    python history_archive.py --restore move_history_y2024m01
+"""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List
+
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+from db_connector import InventoryDBConnector
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+HISTORY_RETENTION_MONTHS = int(os.getenv('HISTORY_RETENTION_MONTHS', 12))
+HISTORY_ARCHIVE_DIR = os.getenv(
+    'HISTORY_ARCHIVE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "history_archive")
+)
+HISTORY_PARTITIONS_AHEAD = int(os.getenv('HISTORY_PARTITIONS_AHEAD', 3))
+
+PARTITIONS_QUERY = """
+    SELECT
+        c.relname as partition_name,
+        pg_get_expr(c.relpartbound, c.oid) as bound
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'move_history'::regclass
+    ORDER BY c.relname
+"""
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def connect():
+    """Connection to the primary with the API's settings (not autocommit)"""
+    return psycopg2.connect(**InventoryDBConnector().db_config)
+
+
+def list_partitions(conn) -> List[Dict]:
+    """
+    Monthly partitions of move_history with their ranges
+
+    Returns:
+        Partitions ordered oldest first; the default partition is left out
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(PARTITIONS_QUERY)
+        rows = cursor.fetchall()
+    conn.rollback()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound)
+        if not match:
+            continue
+        partitions.append({
+            'partition_name': name,
+            'range_start': datetime.fromisoformat(match.group(1)),
+            'range_end': datetime.fromisoformat(match.group(2)),
+        })
+    return sorted(partitions, key=lambda p: p['range_start'])
+
+
+def retention_cutoff(months: int, today: date = None) -> datetime:
+    """Start of the oldest month kept: partitions ending on or before it are archived"""
+    today = today or date.today()
+    month_index = today.year * 12 + today.month - 1 - months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def archive_partition(conn, partition: Dict, directory: str) -> Dict:
+    """
+    Move one partition out of the database
+
+    The rows are first copied from a consistent snapshot into
+    <partition>.csv.gz. Then a short transaction locks the partition, checks
+    its row count still matches the file, detaches and drops it and writes the
+    archive index row. If anything fails the partition stays attached.
+
+    Args:
+        conn: Connection to the primary
+        partition: Entry from list_partitions()
+        directory: Where archive files are written
+
+    Returns:
+        The archive index row
+    """
+    name = partition['partition_name']
+    table = sql.Identifier(name)
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, f"{name}.csv.gz")
+    tmp_path = file_path + ".tmp"
+
+    conn.set_session(isolation_level='REPEATABLE READ')
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(table))
+            row_count = cursor.fetchone()[0]
+            with open(tmp_path, "wb") as raw:
+                with gzip.open(raw, "wt", encoding="utf-8", newline="") as f:
+                    cursor.copy_expert(
+                        sql.SQL("COPY (SELECT * FROM {} ORDER BY move_id) TO STDOUT WITH (FORMAT csv, HEADER)")
+                        .format(table).as_string(conn),
+                        f
+                    )
+                raw.flush()
+                os.fsync(raw.fileno())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _remove(tmp_path)
+        raise
+    finally:
+        conn.set_session(isolation_level='DEFAULT')
+
+    checksum = _sha256(tmp_path)
+    os.replace(tmp_path, file_path)
+
+    entry = {
+        'partition_name': name,
+        'range_start': partition['range_start'],
+        'range_end': partition['range_end'],
+        'row_count': row_count,
+        'file_path': file_path,
+        'checksum': checksum,
+    }
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(table))
+            cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(table))
+            current = cursor.fetchone()[0]
+            if current != row_count:
+                raise RuntimeError(
+                    f"{name} changed while it was copied ({row_count} -> {current} rows)"
+                )
+            cursor.execute(sql.SQL("ALTER TABLE move_history DETACH PARTITION {}").format(table))
+            cursor.execute("""
+                INSERT INTO move_history_archive
+                    (partition_name, range_start, range_end, row_count, file_path, checksum)
+                VALUES (%(partition_name)s, %(range_start)s, %(range_end)s,
+                        %(row_count)s, %(file_path)s, %(checksum)s)
+            """, entry)
+            cursor.execute(sql.SQL("DROP TABLE {}").format(table))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _remove(file_path)
+        raise
+
+    logger.info(f"🗄️ Archived {name}: {row_count} moves -> {file_path}")
+    return entry
+
+
+def restore_partition(conn, partition_name: str) -> int:
+    """
+    Load an archived partition back into move_history
+
+    Args:
+        conn: Connection to the primary
+        partition_name: Name recorded in move_history_archive
+
+    Returns:
+        Number of moves restored
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT range_start, row_count, file_path, checksum
+            FROM move_history_archive
+            WHERE partition_name = %s
+            FOR UPDATE
+        """, (partition_name,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"{partition_name} is not in the archive index")
+        range_start, row_count, file_path, checksum = row
+
+        if _sha256(file_path) != checksum:
+            raise RuntimeError(f"Checksum mismatch for {file_path}")
+
+        cursor.execute("SELECT create_move_history_partition(%s)", (range_start.date(),))
+        with gzip.open(file_path, "rt", encoding="utf-8", newline="") as f:
+            cursor.copy_expert(
+                sql.SQL("COPY {} FROM STDIN WITH (FORMAT csv, HEADER)")
+                .format(sql.Identifier(partition_name)).as_string(conn),
+                f
+            )
+        cursor.execute("DELETE FROM move_history_archive WHERE partition_name = %s", (partition_name,))
+    conn.commit()
+    logger.info(f"📦 Restored {partition_name}: {row_count} moves")
+    return row_count
+
+
+def run_retention(conn, months: int = HISTORY_RETENTION_MONTHS,
+                  directory: str = HISTORY_ARCHIVE_DIR, dry_run: bool = False) -> List[Dict]:
+    """
+    Create upcoming partitions and archive the ones past retention
+
+    Args:
+        conn: Connection to the primary
+        months: Full months of history kept besides the current one
+        directory: Where archive files are written
+        dry_run: Only report which partitions would be archived
+
+    Returns:
+        Partitions archived (or due, on a dry run)
+    """
+    if not dry_run:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT ensure_move_history_partitions(%s)", (HISTORY_PARTITIONS_AHEAD,))
+            created = cursor.fetchone()[0]
+        conn.commit()
+        if created:
+            logger.info(f"🧱 Created {created} move_history partitions")
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM move_history_default")
+        stray = cursor.fetchone()[0]
+    conn.rollback()
+    if stray:
+        logger.warning(f"⚠️ {stray} moves are in move_history_default (no monthly partition)")
+
+    cutoff = retention_cutoff(months)
+    due = [p for p in list_partitions(conn) if p['range_end'] <= cutoff]
+    if dry_run:
+        for partition in due:
+            logger.info(f"🗄️ Would archive {partition['partition_name']}")
+        return due
+
+    archived = []
+    for partition in due:
+        try:
+            archived.append(archive_partition(conn, partition, directory))
+        except Exception as e:
+            logger.error(f"❌ Archiving {partition['partition_name']} failed: {e}")
+    return archived
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old move_history partitions")
+    parser.add_argument("--months", type=int, default=HISTORY_RETENTION_MONTHS,
+                        help="Full months kept in the database besides the current one")
+    parser.add_argument("--dir", default=HISTORY_ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument("--dry-run", action="store_true", help="Only list partitions due")
+    parser.add_argument("--restore", metavar="PARTITION", help="Load an archived partition back")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.restore:
+            restore_partition(conn, args.restore)
+        else:
+            result = run_retention(conn, args.months, args.dir, args.dry_run)
+            print(f"{'Due' if args.dry_run else 'Archived'}: {len(result)} partitions")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,875 @@
+"""
+Index advisor driven by the connector's own statements
+Replays the SQL that InventoryDBConnector runs against a scaled-up copy of
+the data, reads the plans, and proposes expression, trigram, covering and
+partial indexes. Each proposal is measured by building it and re-running
+the statements it affects.
+
+The live database is only read: its rows are copied into a scratch
+database (--dsn, never the live one) with the same schema, and scaling,
+candidate indexes and measurements all happen there, in one transaction that
+is rolled back. Only --apply creates the proposals on the live database:
+    createdb stockmaster_advisor
+    pg_dump --schema-only stockmaster | psql stockmaster_advisor
+    python index_advisor.py --dsn postgresql://postgres@localhost/stockmaster_advisor
+    python index_advisor.py --dsn ... --scale 1000
+    python index_advisor.py --dsn ... --apply    # create the proposals, re-measure on real data
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from db_connector import InventoryDBConnector, convert_decimals
+from query_log import fingerprint, is_explainable
+
+DEFAULT_SCALE = 200
+# Rows copied from the live database are buffered in memory up to this size, then on disk
+COPY_BUFFER_BYTES = 64 * 1024 * 1024
+# EXPLAIN ANALYZE runs per statement; the fastest is kept
+REPEATS = 3
+# A proposal must save at least this share of its statements' time
+MIN_GAIN_PERCENT = 10.0
+
+WORKLOAD_TABLES = (
+    'products', 'product_categories', 'stock_levels', 'locations', 'warehouses', 'move_history',
+)
+
+_LOWER_COLUMN = re.compile(r"lower\(\((?:\w+\.)?(\w+)\)::text\) (=|~~) ")
+_COLUMN_COMPARE = re.compile(r"\((?:(\w+)\.)?(\w+) (=|>=|<=|>|<) ")
+_JOIN_COND = re.compile(r"\((\w+)\.(\w+) = (\w+)\.(\w+)\)")
+_LITERAL_PREDICATE = re.compile(
+    r"\b(?:\w+\.)?(\w+)\s*(=|<>|>=|<=|>|<)\s*('[^']*'|\d+(?:\.\d+)?|TRUE|FALSE)\b"
+    r"|\b(?:\w+\.)?(\w+)\s+IS\s+(NOT\s+)?NULL\b",
+    re.IGNORECASE
+)
+
+
+# ============================================================================
+# WORKLOAD CAPTURE
+# ============================================================================
+
+class WorkloadRecorder(InventoryDBConnector):
+    """
+    Connector that runs every statement on one connection and records it
+
+    The public query methods are inherited unchanged, so the recorded SQL is
+    exactly what the API sends (the catalog replica and read replicas are not
+    attached). Statements are stored with their parameters inlined.
+    """
+
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+        self.method = None
+        self.statements: Dict[str, Dict] = {}
+
+    def execute_query(self, query: str, params: tuple = (),
+                      timeout_ms: int = None, max_staleness: float = None) -> List[Dict]:
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            statement = cursor.mogrify(query, params).decode()
+            if is_explainable(statement) and _tables_in(query):
+                self.statements.setdefault(fingerprint(query), {
+                    'method': self.method,
+                    'template': query,
+                    'sql': statement,
+                })
+            cursor.execute(statement)
+            return convert_decimals([dict(row) for row in cursor.fetchall()])
+
+    def replay(self, calls: List[tuple]) -> List[Dict]:
+        """Run each (method, args) call and return the distinct statements seen"""
+        for method, args in calls:
+            self.method = method
+            getattr(self, method)(*args)
+        return list(self.statements.values())
+
+
+def _tables_in(query: str) -> List[str]:
+    return [table for table in WORKLOAD_TABLES if re.search(rf"\b{table}\b", query)]
+
+
+def sample_arguments(cursor) -> Dict:
+    """A real product to drive the lookups with"""
+    cursor.execute("""
+        SELECT p.product_id, p.name, p.sku_code
+        FROM products p
+        JOIN stock_levels sl ON sl.product_id = p.product_id
+        GROUP BY p.product_id
+        ORDER BY COUNT(*) DESC, p.product_id
+        LIMIT 1
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError("No products with stock to replay the workload with")
+    product_id, name, sku_code = row
+    return {
+        'product_id': product_id,
+        'name': name,
+        'fragment': name.split()[0].lower(),
+        'sku': sku_code.split('-')[0].lower(),
+    }
+
+
+def connector_workload(sample: Dict, scale: int) -> List[tuple]:
+    """The connector calls behind the chat tools, with realistic arguments"""
+    end = datetime.now()
+    start = end - timedelta(days=30)
+    # A copy from the middle of the scaled table, not the first row a scan finds
+    exact_name = f"{sample['name']} {scale // 2}" if scale > 1 else sample['name']
+    return [
+        ('get_all_products', ()),
+        ('get_product_by_fuzzy_name', (exact_name,)),
+        ('get_product_by_fuzzy_name', (sample['fragment'] + 'x',)),
+        ('search_products', (sample['sku'],)),
+        ('search_products_many', ([sample['fragment'], sample['sku']],)),
+        ('get_product_stock_level', (sample['product_id'],)),
+        ('get_product_stock_levels', ([sample['product_id'], sample['product_id'] + 1],)),
+        ('get_product_stock_by_warehouse', (sample['product_id'],)),
+        ('get_low_stock_products', (50,)),
+        ('get_warehouse_inventory_summary', ()),
+        ('get_statistics', ()),
+        ('get_movement_summary', (start, end)),
+        ('get_movement_summary', (start, end, sample['product_id'])),
+        ('get_rebalance_matrix', ()),
+    ]
+
+
+# ============================================================================
+# SCRATCH COPY
+# ============================================================================
+
+def same_database(live, scratch) -> bool:
+    """Whether two connections reach the same database of the same server"""
+    query = "SELECT current_database(), pg_postmaster_start_time(), inet_server_port()"
+    with live.cursor() as a, scratch.cursor() as b:
+        a.execute(query)
+        b.execute(query)
+        same = a.fetchone() == b.fetchone()
+    live.rollback()
+    scratch.rollback()
+    return same
+
+
+def copy_order(cursor) -> List[str]:
+    """
+    Base and partitioned tables of the public schema, each after the tables
+    its foreign keys point to
+    """
+    cursor.execute("""
+        SELECT c.relname,
+               ARRAY(
+                   SELECT DISTINCT r.relname
+                   FROM pg_constraint fk
+                   JOIN pg_class r ON r.oid = fk.confrelid
+                   WHERE fk.conrelid = c.oid AND fk.contype = 'f' AND fk.confrelid <> c.oid
+               )
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+        ORDER BY c.relname
+    """)
+    pending = dict(cursor.fetchall())
+    ordered = []
+    while pending:
+        ready = [t for t, refs in pending.items() if not set(refs) & set(pending)] or [next(iter(pending))]
+        for table in ready:
+            ordered.append(table)
+            del pending[table]
+    return ordered
+
+
+def copy_live_data(live, cursor):
+    """
+    Replace the scratch tables' rows with a consistent snapshot of the live
+    database, and move the scratch sequences past the copied ids
+
+    Args:
+        live: Connection to the live database (only read, in one
+            read-only transaction)
+        cursor: Cursor in the scratch transaction
+    """
+    tables = copy_order(cursor)
+    cursor.execute(sql.SQL("TRUNCATE {} CASCADE").format(
+        sql.SQL(", ").join(sql.Identifier(table) for table in tables)
+    ))
+    try:
+        with live.cursor() as source:
+            source.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            for table in tables:
+                # Generated columns are computed again on the scratch side
+                cursor.execute("""
+                    SELECT attname FROM pg_attribute
+                    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+                    ORDER BY attnum
+                """, (table,))
+                columns = sql.SQL(", ").join(sql.Identifier(row[0]) for row in cursor.fetchall())
+                with tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_BYTES) as buffer:
+                    source.copy_expert(sql.SQL("COPY (SELECT {} FROM {}) TO STDOUT").format(
+                        columns, sql.Identifier(table)
+                    ).as_string(source), buffer)
+                    buffer.seek(0)
+                    cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(
+                        sql.Identifier(table), columns
+                    ).as_string(cursor), buffer)
+    finally:
+        live.rollback()
+
+    cursor.execute("""
+        SELECT table_name, column_name, pg_get_serial_sequence(quote_ident(table_name), column_name)
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND column_default LIKE 'nextval(%%'
+    """)
+    for table, column, sequence in cursor.fetchall():
+        if sequence and table in tables:
+            cursor.execute(sql.SQL("SELECT setval(%s, COALESCE(MAX({}), 0) + 1, false) FROM {}").format(
+                sql.Identifier(column), sql.Identifier(table)
+            ), (sequence,))
+    for table in tables:
+        cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+
+
+# ============================================================================
+# SCALED DATASET
+# ============================================================================
+
+def scale_dataset(cursor, factor: int):
+    """
+    Multiply products, their stock and their moves by factor
+
+    Copies keep the source row's category, cost and locations (spread over
+    copies of the locations) with random quantities and move times in the
+    last year, so the planner sees realistic table sizes and distributions.
+    """
+    copies = factor - 1
+    if copies < 1:
+        return
+    location_copies = max(0, factor // 20)
+
+    cursor.execute("""
+        CREATE TEMP TABLE advisor_products ON COMMIT DROP AS
+        SELECT product_id AS source_id, copy
+        FROM products, generate_series(1, %s) AS copy
+    """, (copies,))
+    cursor.execute("""
+        INSERT INTO products (name, sku_code, category_id, unit_of_measure, per_unit_cost, initial_stock)
+        SELECT p.name || ' ' || c.copy, p.sku_code || '~' || c.copy, p.category_id,
+               p.unit_of_measure, p.per_unit_cost, p.initial_stock
+        FROM advisor_products c
+        JOIN products p ON p.product_id = c.source_id
+    """)
+    cursor.execute("""
+        ALTER TABLE advisor_products ADD COLUMN product_id INTEGER;
+        UPDATE advisor_products c
+        SET product_id = np.product_id
+        FROM products op, products np
+        WHERE op.product_id = c.source_id AND np.sku_code = op.sku_code || '~' || c.copy
+    """)
+
+    cursor.execute("""
+        CREATE TEMP TABLE advisor_locations ON COMMIT DROP AS
+        SELECT location_id AS source_id, 0 AS copy, location_id
+        FROM locations
+    """)
+    if location_copies:
+        cursor.execute("""
+            INSERT INTO locations (name, short_code, warehouse_id, description)
+            SELECT l.name || ' ' || g.n, l.short_code || '~' || g.n, l.warehouse_id, l.description
+            FROM advisor_locations a
+            JOIN locations l ON l.location_id = a.source_id
+            CROSS JOIN generate_series(1, %s) AS g(n)
+        """, (location_copies,))
+        cursor.execute("""
+            INSERT INTO advisor_locations (source_id, copy, location_id)
+            SELECT s.location_id, g.n, l.location_id
+            FROM advisor_locations a
+            JOIN locations s ON s.location_id = a.source_id
+            CROSS JOIN generate_series(1, %s) AS g(n)
+            JOIN locations l ON l.warehouse_id = s.warehouse_id
+                AND l.short_code = s.short_code || '~' || g.n
+            WHERE a.copy = 0
+        """, (location_copies,))
+
+    cursor.execute("""
+        INSERT INTO stock_levels (product_id, location_id, quantity_on_hand, quantity_free_to_use,
+                                  per_unit_cost, min_stock_level, max_stock_level)
+        SELECT c.product_id, al.location_id, q.quantity, q.quantity,
+               sl.per_unit_cost, sl.min_stock_level, sl.max_stock_level
+        FROM advisor_products c
+        JOIN stock_levels sl ON sl.product_id = c.source_id
+        JOIN advisor_locations al ON al.source_id = sl.location_id AND al.copy = c.copy %% %s
+        CROSS JOIN LATERAL (SELECT round((random() * 200)::numeric, 4) AS quantity) q
+        ON CONFLICT DO NOTHING
+    """, (location_copies + 1,))
+
+    cursor.execute("""
+        INSERT INTO move_history (transaction_ref, transaction_type, product_id, from_location_id,
+                                  to_location_id, quantity_change, unit_of_measure, move_timestamp,
+                                  responsible_user_id, description)
+        SELECT mh.transaction_ref || '~' || c.copy, mh.transaction_type, c.product_id,
+               mh.from_location_id, mh.to_location_id, mh.quantity_change, mh.unit_of_measure,
+               LOCALTIMESTAMP - random() * INTERVAL '365 days', mh.responsible_user_id, mh.description
+        FROM advisor_products c
+        JOIN move_history mh ON mh.product_id = c.source_id
+    """)
+
+    for table in WORKLOAD_TABLES:
+        cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+
+
+# ============================================================================
+# PLANS
+# ============================================================================
+
+def explain(cursor, statement: str) -> Dict:
+    """
+    Run a statement under EXPLAIN ANALYZE and keep the fastest of REPEATS runs
+
+    Returns:
+        Execution time (ms), planner cost, shared buffers touched and the plan
+    """
+    best = None
+    for _ in range(REPEATS):
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) " + statement)
+        result = cursor.fetchone()[0][0]
+        if best is None or result['Execution Time'] < best['Execution Time']:
+            best = result
+    plan = best['Plan']
+    return {
+        'ms': best['Execution Time'],
+        'cost': plan['Total Cost'],
+        'buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+        'plan': plan,
+    }
+
+
+def _nodes(plan: Dict, parent: Dict = None):
+    yield plan, parent
+    for child in plan.get('Plans', []):
+        yield from _nodes(child, plan)
+
+
+def partition_parents(cursor) -> Dict[str, str]:
+    """Partition name -> partitioned table name"""
+    cursor.execute("""
+        SELECT c.relname, p.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+    """)
+    return dict(cursor.fetchall())
+
+
+def plan_tables(plan: Dict, parents: Dict[str, str]) -> set:
+    return {
+        parents.get(node['Relation Name'], node['Relation Name'])
+        for node, _ in _nodes(plan) if 'Relation Name' in node
+    }
+
+
+# ============================================================================
+# CANDIDATES
+# ============================================================================
+
+def _candidate(kind: str, table: str, columns: List[str], include: List[str] = None,
+               method: str = 'btree', where: str = None, reason: str = '') -> Dict:
+    slug = "_".join(re.sub(r"\W+", "_", column).strip("_") for column in columns)
+    suffix = {'covering': '_cov', 'partial': '_part', 'trigram': '_trgm'}.get(kind, '')
+    return {
+        'name': f"idx_{table}_{slug}{suffix}".lower()[:63],
+        'kind': kind,
+        'table': table,
+        'columns': columns,
+        'include': include or [],
+        'method': method,
+        'where': where,
+        'reason': reason,
+    }
+
+
+def index_ddl(candidate: Dict, concurrently: bool = False) -> str:
+    """CREATE INDEX statement for a candidate"""
+    ddl = (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {candidate['name']} "
+        f"ON {candidate['table']} USING {candidate['method']} ({', '.join(candidate['columns'])})"
+    )
+    if candidate['include']:
+        ddl += f" INCLUDE ({', '.join(candidate['include'])})"
+    if candidate['where']:
+        ddl += f" WHERE {candidate['where']}"
+    return ddl
+
+
+def propose_indexes(statement: Dict, plan: Dict, parents: Dict[str, str],
+                    trigram: bool) -> List[Dict]:
+    """
+    Read one plan and propose indexes for what it does the hard way
+
+    - Filters on LOWER(column) = ... become expression indexes, and
+      LOWER(column) LIKE ... becomes a trigram index (needs pg_trgm)
+    - Other filters and join keys on sequentially scanned tables become
+      B-tree indexes, equality columns first
+    - Index scans that still visit the heap for a few columns become
+      covering indexes with those columns INCLUDEd
+    - Constant predicates written into the SQL itself become the WHERE
+      clause of a partial index
+    - A sort under a LIMIT over a scanned table becomes an index on the sort key
+    """
+    aliases = {
+        node['Alias']: parents.get(node['Relation Name'], node['Relation Name'])
+        for node, _ in _nodes(plan) if 'Relation Name' in node
+    }
+    literal_predicates = _literal_predicates(statement['template'])
+    candidates = []
+
+    for node, parent in _nodes(plan):
+        table = aliases.get(node.get('Alias'))
+        node_type = node['Node Type']
+
+        if node_type == 'Seq Scan' and table and node.get('Filter'):
+            condition = node['Filter']
+            for column, operator in _LOWER_COLUMN.findall(condition):
+                if operator == '=':
+                    candidates.append(_candidate(
+                        'expression', table, [f"LOWER({column})"],
+                        reason=f"{table} scanned for LOWER({column}) = ..."
+                    ))
+                elif trigram:
+                    candidates.append(_candidate(
+                        'trigram', table, [f"LOWER({column}) gin_trgm_ops"], method='gin',
+                        reason=f"{table} scanned for LOWER({column}) LIKE '%...%'"
+                    ))
+
+            equality, ranges = [], []
+            for alias, column, operator in _COLUMN_COMPARE.findall(condition):
+                target = equality if operator == '=' else ranges
+                if column not in equality + ranges:
+                    target.append(column)
+            columns = equality + ranges[:1]
+            constant = [(c, p) for c, p in literal_predicates if c in columns]
+            keys = [c for c in columns if c not in {c for c, _ in constant}]
+            if constant and keys:
+                where = " AND ".join(p for _, p in constant)
+                candidates.append(_candidate(
+                    'partial', table, keys, where=where,
+                    reason=f"{table} scanned for {', '.join(keys)} where {where}"
+                ))
+            elif columns:
+                candidates.append(_candidate(
+                    'btree', table, columns, reason=f"{table} scanned to filter on {', '.join(columns)}"
+                ))
+
+        if node_type in ('Hash Join', 'Merge Join', 'Nested Loop'):
+            condition = node.get('Hash Cond') or node.get('Merge Cond') or node.get('Join Filter') or ''
+            for left_alias, left_column, right_alias, right_column in _JOIN_COND.findall(condition):
+                for alias, column in ((left_alias, left_column), (right_alias, right_column)):
+                    if alias in aliases and _seq_scanned(node, alias):
+                        candidates.append(_candidate(
+                            'btree', aliases[alias], [column],
+                            reason=f"{aliases[alias]} scanned to join on {column}"
+                        ))
+
+        if node_type in ('Index Scan', 'Bitmap Heap Scan') and table:
+            keys = [column for _, column, operator in _COLUMN_COMPARE.findall(
+                node.get('Index Cond') or node.get('Recheck Cond') or '') if operator == '=']
+            needed = _columns_of(node.get('Alias'), node.get('Output', []) + [node.get('Filter') or ''])
+            extra = sorted(set(needed) - set(keys))
+            if keys and 0 < len(extra) <= 3:
+                candidates.append(_candidate(
+                    'covering', table, keys, include=extra,
+                    reason=f"{table} heap visited for {', '.join(extra)}"
+                ))
+
+        if node_type == 'Sort' and parent and parent['Node Type'] == 'Limit':
+            sort_keys = node.get('Sort Key', [])
+            scans = [n for n, _ in _nodes(node) if 'Relation Name' in n]
+            if len(sort_keys) == 1 and len(scans) == 1:
+                alias_column = sort_keys[0].split('.')
+                if len(alias_column) == 2 and alias_column[0] in aliases:
+                    candidates.append(_candidate(
+                        'btree', aliases[alias_column[0]], [alias_column[1]],
+                        reason=f"{aliases[alias_column[0]]} sorted on {alias_column[1]} for a LIMIT"
+                    ))
+
+    # Catalog reads (get_statistics) show up in the plans too
+    return [c for c in candidates if c['table'] in WORKLOAD_TABLES]
+
+
+def _seq_scanned(join: Dict, alias: str) -> bool:
+    return any(
+        node['Node Type'] == 'Seq Scan' and node.get('Alias') == alias
+        for node, _ in _nodes(join)
+    )
+
+
+def _columns_of(alias: Optional[str], expressions: List[str]) -> List[str]:
+    if not alias:
+        return []
+    found = []
+    for expression in expressions:
+        for column in re.findall(rf"\b{re.escape(alias)}\.(\w+)", expression):
+            if column not in found:
+                found.append(column)
+    return found
+
+
+def _literal_predicates(template: str) -> List[tuple]:
+    """(column, predicate) pairs for conditions with constants in the SQL text"""
+    where = template.upper().find("WHERE")
+    if where < 0:
+        return []
+    predicates = []
+    for match in _LITERAL_PREDICATE.finditer(template[where:]):
+        if match.group(1):
+            predicates.append((match.group(1), f"{match.group(1)} {match.group(2)} {match.group(3)}"))
+        else:
+            predicates.append((match.group(4), f"{match.group(4)} IS {match.group(5) or ''}NULL"))
+    return predicates
+
+
+# ============================================================================
+# EVALUATION
+# ============================================================================
+
+def _index_signature(cursor, index_name: str) -> str:
+    cursor.execute("SELECT pg_get_indexdef(%s::regclass)", (index_name,))
+    return cursor.fetchone()[0].split(" USING ", 1)[1]
+
+
+def existing_signatures(cursor, table: str, exclude: str = None) -> Dict[str, str]:
+    cursor.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+    """, (table,))
+    return {
+        name: definition.split(" USING ", 1)[1]
+        for name, definition in cursor.fetchall() if name != exclude
+    }
+
+
+def _redundant_with(signature: str, others: Dict[str, str]) -> Optional[str]:
+    """Existing index that already serves everything this one would"""
+    for name, other in others.items():
+        if other == signature:
+            return name
+        plain = re.fullmatch(r"btree \(([\w, ]+)\)", signature)
+        other_keys = re.match(r"btree \(([\w, ]+)\)", other)
+        if plain and other_keys and " WHERE " not in other and \
+                (other_keys.group(1) + ",").startswith(plain.group(1) + ","):
+            return name
+    return None
+
+
+def evaluate_candidate(cursor, candidate: Dict, statements: List[Dict],
+                       baseline: Dict[str, Dict]) -> Dict:
+    """
+    Build one candidate inside a savepoint and re-measure what it affects
+
+    Returns:
+        The candidate with its size, the statements that used it and the gain
+    """
+    affected = [s for s in statements if candidate['table'] in s['tables']]
+    cursor.execute("SAVEPOINT advisor_candidate")
+    try:
+        cursor.execute(index_ddl(candidate))
+        signature = _index_signature(cursor, candidate['name'])
+        duplicate = _redundant_with(
+            signature, existing_signatures(cursor, candidate['table'], exclude=candidate['name'])
+        )
+        if duplicate:
+            return {**candidate, 'redundant_with': duplicate, 'used_by': [], 'gain_ms': 0.0}
+
+        cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(candidate['table'])))
+        # On a partitioned table each partition gets its own index
+        cursor.execute("""
+            SELECT c.relname, pg_relation_size(c.oid)
+            FROM pg_class c
+            WHERE c.oid = %s::regclass
+               OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+        """, (candidate['name'], candidate['name']))
+        rows = cursor.fetchall()
+        names = {name for name, _ in rows}
+        size = sum(size for _, size in rows)
+
+        used_by, before_ms, after_ms = [], 0.0, 0.0
+        for statement in affected:
+            after = explain(cursor, statement['sql'])
+            used = {node.get('Index Name') for node, _ in _nodes(after['plan'])}
+            if used & names:
+                used_by.append(statement['method'])
+                before_ms += baseline[statement['fingerprint']]['ms']
+                after_ms += after['ms']
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT advisor_candidate")
+
+    gain_ms = before_ms - after_ms
+    return {
+        **candidate,
+        'size_bytes': size,
+        'used_by': used_by,
+        'before_ms': before_ms,
+        'after_ms': after_ms,
+        'gain_ms': gain_ms,
+        'gain_percent': 100.0 * gain_ms / before_ms if before_ms else 0.0,
+    }
+
+
+def redundant_indexes(cursor) -> List[tuple]:
+    """Existing non-unique indexes that another index on the table already serves"""
+    found = []
+    for table in WORKLOAD_TABLES:
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = %s::regclass AND NOT i.indisunique
+        """, (table,))
+        for (name,) in cursor.fetchall():
+            signature = _index_signature(cursor, name)
+            other = _redundant_with(signature, existing_signatures(cursor, table, exclude=name))
+            if other:
+                found.append((table, name, other))
+    return found
+
+
+def trigram_available(cursor) -> bool:
+    """Install pg_trgm for the advisor's transaction if the server has it"""
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    if cursor.fetchone() is None:
+        return False
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    return True
+
+
+# ============================================================================
+# ADVISOR
+# ============================================================================
+
+def advise(conn, live, scale: int = DEFAULT_SCALE) -> Dict:
+    """
+    Copy the live data into the scratch database, scale it, replay the
+    workload, propose and measure indexes, roll back
+
+    Args:
+        conn: Connection to the scratch database
+        live: Connection to the live database, only read from
+        scale: Multiply products, stock and moves by this factor
+
+    Returns:
+        Statements with baseline and combined timings, accepted proposals,
+        rejected candidates and redundant existing indexes
+    """
+    try:
+        with conn.cursor() as cursor:
+            copy_live_data(live, cursor)
+            sample = sample_arguments(cursor)
+            parents = partition_parents(cursor)
+            trigram = trigram_available(cursor)
+            scale_dataset(cursor, scale)
+
+            statements = WorkloadRecorder(conn).replay(connector_workload(sample, scale))
+            baseline = {}
+            for statement in statements:
+                statement['fingerprint'] = fingerprint(statement['template'])
+                baseline[statement['fingerprint']] = explain(cursor, statement['sql'])
+                statement['tables'] = plan_tables(baseline[statement['fingerprint']]['plan'], parents)
+
+            candidates = {}
+            for statement in statements:
+                plan = baseline[statement['fingerprint']]['plan']
+                for candidate in propose_indexes(statement, plan, parents, trigram):
+                    candidates.setdefault(candidate['name'], candidate)
+
+            evaluated = [
+                evaluate_candidate(cursor, candidate, statements, baseline)
+                for candidate in candidates.values()
+            ]
+            accepted = sorted(
+                (c for c in evaluated
+                 if c['used_by'] and c['gain_ms'] > 0 and c['gain_percent'] >= MIN_GAIN_PERCENT),
+                key=lambda c: -c['gain_ms']
+            )
+
+            combined = {}
+            if accepted:
+                for candidate in accepted:
+                    cursor.execute(index_ddl(candidate))
+                for table in {c['table'] for c in accepted}:
+                    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+                combined = {s['fingerprint']: explain(cursor, s['sql']) for s in statements}
+
+            redundant = redundant_indexes(cursor)
+    finally:
+        conn.rollback()
+        vacuum_workload_tables(conn)
+
+    return {
+        'scale': scale,
+        'trigram': trigram,
+        'statements': [
+            {
+                'method': s['method'],
+                'fingerprint': s['fingerprint'],
+                'sql': s['sql'],
+                'before_ms': baseline[s['fingerprint']]['ms'],
+                'after_ms': combined[s['fingerprint']]['ms'] if combined else None,
+            }
+            for s in statements
+        ],
+        'proposals': accepted,
+        'rejected': [c for c in evaluated if c not in accepted],
+        'redundant': redundant,
+    }
+
+
+def vacuum_workload_tables(conn):
+    """Clear the dead rows the rolled-back copy leaves in the scratch tables"""
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for table in WORKLOAD_TABLES:
+                cursor.execute(sql.SQL("VACUUM {}").format(sql.Identifier(table)))
+    finally:
+        conn.autocommit = False
+
+
+def apply_proposals(conn, report: Dict) -> List[Dict]:
+    """
+    Create the proposed indexes on the real tables and re-measure
+
+    Indexes are built CONCURRENTLY so writers are not blocked, except on
+    partitioned tables where Postgres does not support it.
+
+    Returns:
+        Per statement timings on the real data before and after
+    """
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        before = {s['fingerprint']: explain(cursor, s['sql']) for s in report['statements']}
+        cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'p'")
+        partitioned = {row[0] for row in cursor.fetchall()}
+
+        for candidate in report['proposals']:
+            if candidate['method'] == 'gin' and 'gin_trgm_ops' in " ".join(candidate['columns']):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            ddl = index_ddl(candidate, concurrently=candidate['table'] not in partitioned)
+            print(f"🔨 {ddl}")
+            cursor.execute(ddl)
+        for table in {c['table'] for c in report['proposals']}:
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+
+        after = {s['fingerprint']: explain(cursor, s['sql']) for s in report['statements']}
+
+    return [
+        {
+            'method': s['method'],
+            'before_ms': before[s['fingerprint']]['ms'],
+            'after_ms': after[s['fingerprint']]['ms'],
+        }
+        for s in report['statements']
+    ]
+
+
+# ============================================================================
+# REPORT
+# ============================================================================
+
+def print_report(report: Dict):
+    print("=" * 60)
+    print(f"🔍 Index Advisor - data scaled {report['scale']}x")
+    print("=" * 60)
+
+    print("\n📋 Statements (ms, fastest of {} runs)".format(REPEATS))
+    for statement in sorted(report['statements'], key=lambda s: -s['before_ms']):
+        after = statement['after_ms']
+        change = f" -> {after:8.2f}" if after is not None else ""
+        print(f"   {statement['before_ms']:8.2f}{change}  {statement['method']} [{statement['fingerprint']}]")
+
+    print("\n✅ Proposed indexes")
+    if not report['proposals']:
+        print("   None: no candidate saved enough time")
+    for candidate in report['proposals']:
+        print(f"   {index_ddl(candidate)};")
+        print(
+            f"      {candidate['kind']}, {candidate['size_bytes'] // 1024} kB, "
+            f"-{candidate['gain_ms']:.2f} ms ({candidate['gain_percent']:.0f}%) "
+            f"for {', '.join(sorted(set(candidate['used_by'])))}"
+        )
+        print(f"      why: {candidate['reason']}")
+
+    if report['rejected']:
+        print("\n➖ Rejected candidates")
+        for candidate in report['rejected']:
+            if candidate.get('redundant_with'):
+                verdict = f"already served by {candidate['redundant_with']}"
+            elif not candidate['used_by']:
+                verdict = "not used by the planner"
+            elif candidate['gain_ms'] <= 0:
+                verdict = "no faster"
+            else:
+                verdict = f"saves only {candidate['gain_percent']:.0f}%"
+            print(f"   {candidate['name']}: {verdict}")
+
+    if not report['trigram']:
+        print("\nℹ️ pg_trgm is not available on this server; LIKE '%...%' lookups get no index")
+
+    if report['redundant']:
+        print("\n🗑️ Redundant existing indexes")
+        for table, name, other in report['redundant']:
+            print(f"   {table}.{name} is covered by {other}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose indexes for the connector's queries")
+    parser.add_argument("--dsn", default=os.getenv('INDEX_ADVISOR_DSN'),
+                        help="Scratch database with the live schema, where the data is "
+                             "copied, scaled and indexed (default INDEX_ADVISOR_DSN)")
+    parser.add_argument("--scale", type=int, default=DEFAULT_SCALE,
+                        help="Multiply products, stock and moves by this factor")
+    parser.add_argument("--apply", action="store_true",
+                        help="Create the proposed indexes and re-measure on the real data")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn (or INDEX_ADVISOR_DSN) is required: a scratch database, not the live one")
+
+    live = psycopg2.connect(**InventoryDBConnector().db_config)
+    conn = None
+    try:
+        conn = psycopg2.connect(args.dsn)
+        if same_database(live, conn):
+            raise RuntimeError("--dsn points at the live database; give a scratch database")
+        report = advise(conn, live, args.scale)
+        if args.json:
+            print(json.dumps(report, indent=2, default=str))
+        else:
+            print_report(report)
+
+        if args.apply and report['proposals']:
+            print("\n" + "=" * 60)
+            print("🔨 Applying proposals")
+            print("=" * 60)
+            for row in apply_proposals(live, report):
+                print(f"   {row['before_ms']:8.2f} -> {row['after_ms']:8.2f}  {row['method']}")
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    finally:
+        if conn is not None:
+            conn.close()
+        live.close()
+
+
+if __name__ == "__main__":
+    main()
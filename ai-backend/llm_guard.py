@@ -0,0 +1,224 @@
+"""
+Latency guard for LLM calls
+Per-call latency budget, hedged second requests and a circuit breaker,
+so a slow or failing LLM cannot hold a chat request for long
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+from dotenv import load_dotenv
+
+from metrics import LLM_BREAKER_OPEN, LLM_CALLS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+LLM_BUDGET_SECONDS = float(os.getenv('LLM_BUDGET_SECONDS', 5))
+LLM_HEDGE = os.getenv('LLM_HEDGE', '1').lower() in ('1', 'true', 'yes')
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 0.5))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', 30))
+LLM_WORKERS = int(os.getenv('LLM_WORKERS', 16))
+
+# Latency samples needed before the p95 is trusted for the hedge delay
+MIN_LATENCY_SAMPLES = 20
+
+
+class LLMUnavailable(Exception):
+    """The LLM call was not made or did not finish within its budget"""
+
+
+class CircuitOpen(LLMUnavailable):
+    """The LLM call was not made because the circuit breaker is open"""
+
+
+class LatencyTracker:
+    """
+    Recent latencies of successful calls, for percentile estimates
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """
+        Latency at quantile q (0-1) of the recent samples
+
+        Returns:
+            Latency in seconds, or None until MIN_LATENCY_SAMPLES are recorded
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency after repeated failures
+
+    closed: calls go through; consecutive failures are counted.
+    open: calls are refused until the cooldown has passed.
+    half-open: one probe call is let through; success closes the
+    breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return "open"
+            return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"✅ {self.name} circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (
+                self._opened_at is None and self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                logger.warning(
+                    f"⚠️ {self.name} circuit open for {self.cooldown:.0f}s "
+                    f"after {self._failures} failures"
+                )
+
+
+LLM_LATENCY = LatencyTracker()
+LLM_BREAKER = CircuitBreaker("LLM", LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+LLM_BREAKER_OPEN.set_function(lambda: 0 if LLM_BREAKER.state == "closed" else 1)
+
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+
+def hedge_delay(budget: float) -> float:
+    """
+    How long to wait for the first request before sending a second one
+    The recent p95 latency, or half the budget until there are enough samples
+    """
+    p95 = LLM_LATENCY.percentile(0.95)
+    if p95 is None:
+        p95 = budget / 2
+    return min(max(LLM_HEDGE_MIN_DELAY, p95), budget / 2)
+
+
+def _submit(fn: Callable[[], Any], on_request: Optional[Callable]):
+    """Send one request on a worker thread, settling it with on_request when it ends"""
+    future = _llm_executor.submit(contextvars.copy_context().run, fn)
+    if on_request is not None:
+        settle = on_request()
+        future.add_done_callback(lambda f: settle(None if f.exception() else f.result()))
+    return future
+
+
+def call_llm(fn: Callable[[], Any], budget: float = None, hedge: bool = None,
+             on_request: Optional[Callable[[], Callable[[Any], None]]] = None) -> Any:
+    """
+    Call the LLM within a latency budget
+
+    The call runs on a worker thread. If it has not answered after the
+    hedge delay (the recent p95), an identical second request is sent and
+    whichever answers first wins. Requests still running when the budget
+    runs out are abandoned; they end at the client's own timeout.
+    on_request is told of every request sent, so usage can be accounted
+    for requests that lose the race or are abandoned too.
+
+    Args:
+        fn: Zero-argument function making one LLM request
+        budget: Seconds the caller is willing to wait (default LLM_BUDGET_SECONDS)
+        hedge: Send a hedged second request (default LLM_HEDGE)
+        on_request: Called as each request is sent; returns a function
+            called with the request's result (None if it failed) when it ends
+
+    Returns:
+        The result of the first request to succeed
+
+    Raises:
+        LLMUnavailable: Breaker open, all requests failed, or budget exhausted
+    """
+    budget = LLM_BUDGET_SECONDS if budget is None else budget
+    hedge = LLM_HEDGE if hedge is None else hedge
+
+    if not LLM_BREAKER.allow():
+        LLM_CALLS.labels("short_circuit").inc()
+        raise CircuitOpen("LLM circuit is open")
+
+    start = time.monotonic()
+    deadline = start + budget
+    pending = {_submit(fn, on_request)}
+    hedge_at = start + hedge_delay(budget) if hedge else None
+    last_error = None
+
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wake = deadline if hedge_at is None else min(deadline, hedge_at)
+        done, pending = wait(pending, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            elapsed = time.monotonic() - start
+            LLM_LATENCY.record(elapsed)
+            LLM_BREAKER.record_success()
+            LLM_CALLS.labels("ok").inc()
+            return result
+
+        if hedge_at is not None and time.monotonic() >= hedge_at:
+            hedge_at = None
+            if pending:
+                LLM_CALLS.labels("hedged").inc()
+                pending.add(_submit(fn, on_request))
+
+    LLM_BREAKER.record_failure()
+    if pending:
+        LLM_CALLS.labels("timeout").inc()
+        raise LLMUnavailable(f"LLM did not answer within {budget:.1f}s")
+    LLM_CALLS.labels("error").inc()
+    raise LLMUnavailable(f"LLM request failed: {last_error}")
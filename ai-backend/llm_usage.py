@@ -0,0 +1,221 @@
+"""
+Token and latency accounting for LLM calls
+Records every tool-selection call with its tokens, latency and the intent
+(tools) it planned, enforces daily request and token budgets, and reports
+which intents use the most LLM time (/debug/llm)
+
+Tokens are charged per request sent, hedged duplicates included: an
+estimate of the prompt when it is sent, replaced by the reported usage when
+the response arrives. A request that fails or is abandoned and never
+reports usage keeps its estimate.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from metrics import LLM_BUDGET_USED, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# 0 disables a budget. Budgets are per worker process and reset at local midnight.
+LLM_DAILY_TOKEN_BUDGET = int(os.getenv('LLM_DAILY_TOKEN_BUDGET', 0))
+LLM_DAILY_CALL_BUDGET = int(os.getenv('LLM_DAILY_CALL_BUDGET', 0))
+LLM_RECENT_CALLS = int(os.getenv('LLM_RECENT_CALLS', 100))
+
+# Rough characters per token, for prompt estimates
+CHARS_PER_TOKEN = 4
+
+
+def _usage_tokens(message) -> Dict[str, int]:
+    """Input and output token counts reported with an LLM message"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {
+        'input_tokens': int(usage.get('input_tokens') or 0),
+        'output_tokens': int(usage.get('output_tokens') or 0),
+    }
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of a prompt"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def intent_of(plan: dict) -> str:
+    """Intent label of a plan: its distinct tools, e.g. "product_location+product_stock" """
+    return "+".join(sorted({call['tool'] for call in plan['calls']}))
+
+
+class LLMCall:
+    """
+    The requests of one tool-selection call: the first and any hedges
+    """
+
+    def __init__(self, usage: "LLMUsage", prompt_tokens: int):
+        self._usage = usage
+        self.prompt_tokens = prompt_tokens
+        self.requests = 0
+        self.tokens = {'input_tokens': 0, 'output_tokens': 0}
+
+    def sent(self) -> Callable[[Any], None]:
+        """
+        Charge a request as it is sent
+
+        Returns:
+            Settles the request with its response message (None if it failed)
+        """
+        estimate = {'input_tokens': self.prompt_tokens, 'output_tokens': 0}
+        self._usage._charge(self, estimate, requests=1)
+
+        def settle(message):
+            actual = _usage_tokens(message)
+            if not any(actual.values()):
+                actual = estimate
+            else:
+                self._usage._charge(self, {kind: actual[kind] - estimate[kind] for kind in actual})
+            for kind, count in actual.items():
+                if count:
+                    LLM_TOKENS.labels(kind.replace("_tokens", "")).inc(count)
+        return settle
+
+
+class LLMUsage:
+    """
+    Ledger of LLM calls for the current day
+    """
+
+    def __init__(self, token_budget: int = LLM_DAILY_TOKEN_BUDGET,
+                 call_budget: int = LLM_DAILY_CALL_BUDGET, recent: int = LLM_RECENT_CALLS):
+        self.token_budget = token_budget
+        self.call_budget = call_budget
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=recent)
+        self._reset(date.today())
+
+    def _reset(self, day: date):
+        self._day = day
+        self._calls = 0
+        self._requests = 0
+        self._tokens = 0
+        self._seconds = 0.0
+        self._by_intent: Dict[str, Dict] = {}
+
+    def _roll(self):
+        today = date.today()
+        if today != self._day:
+            logger.info(f"📒 LLM usage for {self._day}: {self._calls} calls, {self._tokens} tokens")
+            self._reset(today)
+
+    def track(self, prompt: str) -> LLMCall:
+        """
+        Start accounting for one LLM call
+
+        Args:
+            prompt: Text sent with each request, for the token estimate
+        """
+        return LLMCall(self, estimate_tokens(prompt))
+
+    def _charge(self, call: LLMCall, tokens: Dict[str, int], requests: int = 0):
+        with self._lock:
+            self._roll()
+            self._requests += requests
+            self._tokens += sum(tokens.values())
+            call.requests += requests
+            for kind, count in tokens.items():
+                call.tokens[kind] += count
+
+    def record(self, call: LLMCall, seconds: float, intent: str, outcome: str = "ok"):
+        """
+        Account for one finished LLM call
+
+        Requests still running are included with their estimate so far.
+
+        Args:
+            call: The call's requests, from track()
+            seconds: Wall time of the call, including hedged requests
+            intent: Intent of the resulting plan, or why there is none
+            outcome: "ok", or how the call failed
+        """
+        with self._lock:
+            self._roll()
+            tokens = dict(call.tokens)
+            total = tokens['input_tokens'] + tokens['output_tokens']
+            self._calls += 1
+            self._seconds += seconds
+            entry = self._by_intent.setdefault(
+                intent, {'intent': intent, 'calls': 0, 'requests': 0, 'tokens': 0, 'seconds': 0.0}
+            )
+            entry['calls'] += 1
+            entry['requests'] += call.requests
+            entry['tokens'] += total
+            entry['seconds'] += seconds
+            self._recent.append({
+                'at': time.time(),
+                'intent': intent,
+                'outcome': outcome,
+                'ms': round(seconds * 1000, 1),
+                'requests': call.requests,
+                **tokens,
+            })
+
+    def exhausted(self) -> Optional[str]:
+        """Why today's budget is used up, or None while calls may still be made"""
+        with self._lock:
+            self._roll()
+            if self.call_budget and self._requests >= self.call_budget:
+                return f"LLM daily call budget ({self.call_budget} requests) used"
+            if self.token_budget and self._tokens >= self.token_budget:
+                return f"LLM daily token budget ({self.token_budget}) used"
+        return None
+
+    def used_fraction(self, kind: str) -> float:
+        """Share of today's "calls" or "tokens" budget used (0 when unlimited)"""
+        with self._lock:
+            self._roll()
+            budget, used = (
+                (self.call_budget, self._requests) if kind == "calls" else (self.token_budget, self._tokens)
+            )
+        return used / budget if budget else 0.0
+
+    def report(self, limit: int = 10) -> Dict:
+        """
+        Today's usage against the budgets, intents by LLM time and recent calls
+
+        Args:
+            limit: Number of intents and recent calls to include
+        """
+        with self._lock:
+            self._roll()
+            intents: List[Dict] = sorted(
+                (dict(entry) for entry in self._by_intent.values()),
+                key=lambda entry: entry['seconds'], reverse=True
+            )
+            recent = list(self._recent)[-limit:]
+            today = {
+                'day': self._day.isoformat(),
+                'calls': self._calls,
+                'requests': self._requests,
+                'tokens': self._tokens,
+                'seconds': round(self._seconds, 3),
+                'call_budget': self.call_budget or None,
+                'token_budget': self.token_budget or None,
+            }
+
+        for entry in intents:
+            entry['avg_ms'] = round(entry['seconds'] * 1000 / entry['calls'], 1)
+            entry['avg_tokens'] = round(entry['tokens'] / entry['calls'], 1)
+            entry['share_of_time'] = round(entry['seconds'] / today['seconds'], 3) if today['seconds'] else 0.0
+            entry['seconds'] = round(entry['seconds'], 3)
+        return {'today': today, 'by_intent': intents[:limit], 'recent': list(reversed(recent))}
+
+
+LLM_USAGE = LLMUsage()
+LLM_BUDGET_USED.labels("calls").set_function(lambda: LLM_USAGE.used_fraction("calls"))
+LLM_BUDGET_USED.labels("tokens").set_function(lambda: LLM_USAGE.used_fraction("tokens"))
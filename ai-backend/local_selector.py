@@ -0,0 +1,218 @@
+"""
+Deterministic keyword-based tool selection
+Used when no LLM is configured, so the DB-only tools keep working offline
+"""
+
+import re
+from typing import Optional
+
+# Words that carry the question's intent rather than the product name
+FILLER_WORDS = {
+    "a", "about", "all", "an", "any", "are", "be", "can", "currently", "do",
+    "does", "find", "for", "get", "have", "has", "hold", "holds", "how",
+    "i", "in", "inventory", "is", "it", "kept", "left", "level", "levels",
+    "located", "location", "locations", "many", "me", "much", "of", "on",
+    "hand", "our", "please", "quantity", "show", "stock", "store", "stored",
+    "tell", "the", "there", "units", "we", "what", "whats", "where",
+    "which", "warehouse", "warehouses", "you", "got", "available", "see",
+    "movement", "movements", "moves", "moved", "history", "recent", "recently",
+    "last", "past", "days", "week", "month", "activity", "and", "also", "then",
+    "compare", "between", "versus", "vs",
+    "will", "run", "runs", "out", "next", "coming", "within", "soon", "when",
+    "forecast", "forecasts", "projected", "demand", "stockout", "stockouts",
+    "stock-out", "stock-outs",
+    "rebalance", "rebalancing", "redistribute", "suggest", "should", "transfer", "transfers",
+    "balance", "imbalance", "imbalances", "fix", "to",
+    "day", "weeks", "months", "exact", "exactly", "precise", "else",
+}
+
+# Words that point back at something named earlier in the conversation
+REFERENCE_WORDS = {
+    "it", "its", "that", "this", "them", "they", "those", "these", "same",
+    "one", "item", "product",
+}
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9\-\.]*")
+
+_LOW_STOCK = re.compile(r"\b(low|running out|reorder\w*|below|shortage|short on)\b")
+_WAREHOUSE_SUMMARY = re.compile(
+    r"\bwarehouses?\b.*\b(summary|overview|breakdown|each|per|by|all)\b"
+    r"|\b(summary|overview|breakdown)\b.*\bwarehouses?\b"
+    r"|\b(each|per|every|by) warehouse\b"
+)
+_VALUE_BREAKDOWN = re.compile(
+    r"\bvalue\b.*\b(categor(y|ies)|breakdown)\b|\b(categor(y|ies)|breakdown)\b.*\bvalue\b"
+)
+_FORECAST = re.compile(
+    r"\b(forecasts?|stock-?outs?|projected)\b"
+    r"|\b(will|when)\b.*\brun(s)? out\b"
+    r"|\brun(s|ning)? out\b.*\b(next|within|soon|coming)\b"
+)
+_HORIZON = re.compile(r"\b(next|coming|within)( the)?( (\d+))? (days?|weeks?|months?)\b")
+_HORIZON_DAYS = {"day": 1, "week": 7, "month": 30}
+_REBALANCE = re.compile(
+    r"\b(rebalanc\w*|redistribut\w*|imbalances?)\b"
+    r"|\b(suggest|propose|recommend|plan)\w*\b.*\btransfers?\b"
+)
+_MOVEMENTS = re.compile(r"\b(movements?|moves|moved|history|activity|receipts|deliveries|transfers)\b")
+_TIME_WINDOW = re.compile(r"\b(in |over )?(the )?(last|past) \d+ (days?|weeks?|months?)\b", re.IGNORECASE)
+_STATISTICS = re.compile(r"\b(stat|stats|statistics|how many products|total inventory|overall)\b")
+_EXACT = re.compile(r"\b(exact|exactly|precise|full count)\b")
+_LIST_PRODUCTS = re.compile(r"\b(list|catalog|catalogue|all products|what products|which products)\b")
+_CLAUSE_SPLIT = re.compile(r"\band\b|\balso\b|\bvs\b\.?|\bversus\b|[;?]|,", re.IGNORECASE)
+_LOCATION = re.compile(r"\b(where|which warehouses?|locations?|stored|kept)\b")
+_THAT_WAREHOUSE = re.compile(r"\b(that|this|same) warehouse\b")
+
+
+def extract_product_name(user_query: str) -> Optional[str]:
+    """
+    Strip question words from a query to leave the product name
+
+    Args:
+        user_query: Natural language question
+
+    Returns:
+        Product name or None if nothing product-like remains
+    """
+    remaining = [
+        word for word in _words(user_query)
+        if word not in FILLER_WORDS and word not in REFERENCE_WORDS
+    ]
+    return " ".join(remaining) or None
+
+
+def _words(text: str) -> list:
+    words = (word.strip(".-") for word in _WORD.findall(text.lower().replace("'", "")))
+    return [word for word in words if word]
+
+
+def refers_back(user_query: str) -> bool:
+    """Whether the query points at something named earlier ("where is it?")"""
+    return not REFERENCE_WORDS.isdisjoint(_words(user_query))
+
+
+def select_tool_locally(user_query: str, default_product: str = None) -> dict:
+    """
+    Plan tool calls with keyword rules
+    Compound questions ("how much copper and where is it?") are split into
+    clauses; a clause without a product reuses the previous clause's product.
+    A list of products ("stock of copper, steel and brass") gives one call per product
+
+    Args:
+        user_query: Natural language question
+        default_product: Product the conversation was last about, used by
+            clauses that name none
+
+    Returns:
+        Plan in the same shape as the LLM selector: {"calls": [...], "reason": ...}
+    """
+    calls = []
+    previous_product = default_product
+    for clause in _CLAUSE_SPLIT.split(user_query):
+        if not clause.strip():
+            continue
+        call = _classify(clause, previous_product)
+        if call is None:
+            continue
+        previous_product = call["product_name"] or previous_product
+        if call not in calls:
+            calls.append(call)
+
+    if not calls:
+        return _plan([_call("general_stats", None)], "No keyword match, showing overview")
+    return _plan(calls, "Keyword match: " + ", ".join(call["tool"] for call in calls))
+
+
+def _classify(clause: str, previous_product: Optional[str]) -> Optional[dict]:
+    """Pick the tool for one clause of a query"""
+    text = clause.lower()
+
+    if _VALUE_BREAKDOWN.search(text):
+        return _call("value_breakdown", None)
+    if _REBALANCE.search(text):
+        product_name = extract_product_name(clause)
+        if not product_name and refers_back(clause):
+            product_name = previous_product
+        return _call("rebalance", product_name)
+    if _FORECAST.search(text):
+        product_name = extract_product_name(_HORIZON.sub(" ", text))
+        if not product_name and refers_back(clause):
+            product_name = previous_product
+        return _call("stockout_forecast", product_name, days=_horizon_days(text))
+    if _MOVEMENTS.search(text):
+        product_name = extract_product_name(_TIME_WINDOW.sub(" ", clause))
+        if not product_name and refers_back(clause):
+            product_name = previous_product
+        return _call("movement_history", product_name)
+    if _LOW_STOCK.search(text):
+        return _call("low_stock", None)
+    if _WAREHOUSE_SUMMARY.search(text):
+        return _call("warehouse_summary", None)
+    if _STATISTICS.search(text):
+        return _call("general_stats", None, exact=bool(_EXACT.search(text)))
+    if _LIST_PRODUCTS.search(text):
+        return _call("list_products", None)
+
+    product_name = extract_product_name(clause) or previous_product
+    if not product_name:
+        return None
+    if _LOCATION.search(text):
+        return _call("product_location", product_name)
+    return _call("product_stock", product_name)
+
+
+def _horizon_days(text: str) -> Optional[int]:
+    """Days in "next week", "within 10 days", ..., or None when no horizon is given"""
+    match = _HORIZON.search(text)
+    if not match:
+        return None
+    return int(match.group(4) or 1) * _HORIZON_DAYS[match.group(5).rstrip("s")]
+
+
+def plan_follow_up(user_query: str, product_name: str) -> Optional[dict]:
+    """
+    Plan a follow-up that names no product of its own ("and where is it
+    stored?") with the product the conversation was last about
+
+    Args:
+        user_query: Natural language question
+        product_name: Name of the product remembered by the session
+
+    Returns:
+        Plan, or None when the query names something new or needs no product
+    """
+    if extract_product_name(_TIME_WINDOW.sub(" ", user_query)):
+        return None
+    plan = select_tool_locally(user_query, default_product=product_name)
+    if not any(call["product_name"] == product_name for call in plan["calls"]):
+        return None
+    return plan
+
+
+def plan_warehouse_follow_up(user_query: str, warehouse_name: str) -> Optional[dict]:
+    """
+    Plan a follow-up about the warehouse the conversation was last about
+    ("what else is in that warehouse?") as a summary of that warehouse
+
+    Args:
+        user_query: Natural language question
+        warehouse_name: Name of the warehouse remembered by the session
+
+    Returns:
+        Plan, or None when the query doesn't point back at a warehouse
+    """
+    if not _THAT_WAREHOUSE.search(user_query.lower()):
+        return None
+    return _plan([_call("warehouse_summary", None, warehouse=warehouse_name)],
+                 f"Keyword match: warehouse_summary for {warehouse_name}")
+
+
+def _call(tool: str, product_name: Optional[str], **options) -> dict:
+    """A call with the options that are set (days, exact, warehouse)"""
+    call = {"tool": tool, "product_name": product_name}
+    call.update((name, value) for name, value in options.items() if value)
+    return call
+
+
+def _plan(calls: list, reason: str) -> dict:
+    return {"calls": calls, "reason": reason}
@@ -0,0 +1,478 @@
+"""
+In-process metrics for the AI agent
+Counters, gauges and histograms rendered in Prometheus text format
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond SQL up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+class _ShardedValues:
+    """
+    Fixed-size list of float slots, sharded per thread
+
+    Each thread writes only to its own shard, so recording never takes a
+    lock. Shards are summed when the metric is scraped.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._shards: List[List[float]] = []
+        self._shards_lock = threading.Lock()
+
+    def shard(self) -> List[float]:
+        """Return the calling thread's shard, creating it on first use"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = [0.0] * self._size
+            with self._shards_lock:
+                self._shards.append(values)
+            self._local.values = values
+            return values
+
+    def totals(self) -> List[float]:
+        """Sum all shards"""
+        totals = [0.0] * self._size
+        with self._shards_lock:
+            shards = list(self._shards)
+        for values in shards:
+            for i, value in enumerate(values):
+                totals[i] += value
+        return totals
+
+
+class _Metric:
+    """Base class for labelled metrics"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._children_lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        """Get the child metric for a set of label values"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects labels {self.labelnames}, got {key}"
+                )
+            with self._children_lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        if not self.labelnames:
+            self.labels()
+        with self._children_lock:
+            return list(self._children.items())
+
+    def _label_str(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.labelnames, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    def __init__(self):
+        self._values = _ShardedValues(1)
+
+    def inc(self, amount: float = 1.0):
+        self._values.shard()[0] += amount
+
+    def get(self) -> float:
+        return self._values.totals()[0]
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{self._label_str(key)} {_fmt(child.get())}"
+            for key, child in self._items()
+        ]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the gauge value at scrape time"""
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, optionally computed at scrape time"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for key, child in self._items():
+            try:
+                value = child.get()
+            except Exception:
+                continue
+            lines.append(f"{self.name}{self._label_str(key)} {_fmt(value)}")
+        return lines
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # One slot per bucket, one for +Inf, then sum and count
+        self._values = _ShardedValues(len(buckets) + 3)
+
+    def observe(self, value: float):
+        values = self._values.shard()
+        values[bisect_left(self._buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Tuple[List[float], float, float]:
+        totals = self._values.totals()
+        return totals[:-2], totals[-2], totals[-1]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for key, child in self._items():
+            counts, total, count = child.snapshot()
+            cumulative = 0.0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _fmt(bound)
+                label_str = self._label_str(key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{label_str} {_fmt(cumulative)}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {_fmt(count)}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics exposed on /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _fmt(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render_latest() -> str:
+    """Render all registered metrics in Prometheus text format"""
+    return REGISTRY.render()
+
+
+# ============================================================================
+# AGENT METRICS
+# ============================================================================
+
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds",
+    "Time spent in each stage of answering a query",
+    ("stage",),
+)
+
+TOOL_SECONDS = Histogram(
+    "agent_tool_seconds",
+    "Time spent executing each tool",
+    ("tool",),
+)
+
+TOOL_CALLS = Counter(
+    "agent_tool_calls_total",
+    "Tool executions by tool and outcome",
+    ("tool", "status"),
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "agent_db_method_seconds",
+    "Time spent in each InventoryDBConnector method",
+    ("method",),
+)
+
+DB_ERRORS = Counter(
+    "agent_db_errors_total",
+    "Failed SQL statements",
+)
+
+DB_CANCELLED = Counter(
+    "agent_db_cancelled_total",
+    "SQL statements stopped by their statement_timeout or by request cancellation",
+    ("reason",),
+)
+
+DB_ROUTED = Counter(
+    "agent_db_route_total",
+    "Statements by the server they ran on (primary or replica host:port)",
+    ("target",),
+)
+
+DB_REPLICA_LAG = Gauge(
+    "agent_db_replica_lag_seconds",
+    "Last measured replication lag per read replica (-1 if unknown)",
+    ("replica",),
+)
+
+LLM_TOKENS = Counter(
+    "agent_llm_tokens_total",
+    "Tokens consumed by LLM calls",
+    ("kind",),
+)
+
+LLM_CALLS = Counter(
+    "agent_llm_calls_total",
+    "Guarded LLM calls by outcome (ok, error, timeout, short_circuit, over_budget) and hedged requests sent",
+    ("outcome",),
+)
+
+LLM_BUDGET_USED = Gauge(
+    "agent_llm_budget_used_ratio",
+    "Share of today's LLM call or token budget used (0 when unlimited)",
+    ("kind",),
+)
+
+LLM_BREAKER_OPEN = Gauge(
+    "agent_llm_breaker_open",
+    "1 while the LLM circuit breaker is open or half-open",
+)
+
+CACHE_REQUESTS = Counter(
+    "agent_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss)",
+    ("cache", "result"),
+)
+
+COALESCED_CALLS = Counter(
+    "agent_coalesced_calls_total",
+    "Single-flight calls by group and role (executed or shared)",
+    ("group", "role"),
+)
+
+SESSIONS_ACTIVE = Gauge(
+    "agent_sessions_active",
+    "Conversation sessions held in memory",
+)
+
+SESSION_EVENTS = Counter(
+    "agent_session_events_total",
+    "Session lifecycle and reuse events (created, expired, evicted, follow_up, entity_reused)",
+    ("event",),
+)
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "agent_admission_wait_seconds",
+    "Time requests queued for an LLM or DB slot, by priority class",
+    ("resource", "priority"),
+)
+
+ADMISSION_REJECTED = Counter(
+    "agent_admission_rejected_total",
+    "Requests refused by admission control (queue_full, wait_budget, timeout, shed)",
+    ("resource", "priority", "reason"),
+)
+
+ADMISSION_ACTIVE = Gauge(
+    "agent_admission_active",
+    "Slots in use per admission-controlled resource",
+    ("resource",),
+)
+
+ADMISSION_QUEUED = Gauge(
+    "agent_admission_queued",
+    "Requests waiting for a slot per admission-controlled resource",
+    ("resource",),
+)
+
+CHANGE_FEED_CLIENTS = Gauge(
+    "agent_change_feed_clients",
+    "Subscribers of the stock change feed",
+)
+
+CHANGE_FEED_EVENTS = Counter(
+    "agent_change_feed_events_total",
+    "Change notifications received from Postgres, by table",
+    ("table",),
+)
+
+CHANGE_FEED_RESYNCS = Counter(
+    "agent_change_feed_resyncs_total",
+    "Subscriber buffers dropped and replaced by a resync event (overflow, reconnect)",
+    ("reason",),
+)
+
+SITE_SECONDS = Histogram(
+    "agent_site_query_seconds",
+    "Time for one site to answer a fanned-out query",
+    ("site",),
+)
+
+SITE_FAILURES = Counter(
+    "agent_site_failures_total",
+    "Sites left out of a fanned-out answer (timeout or error)",
+    ("site", "reason"),
+)
+
+PROFILES_CAPTURED = Counter(
+    "agent_profiles_total",
+    "Profiled /query requests by trigger, captured, or skipped because another was running (busy) or too recent (limited)",
+    ("trigger", "outcome"),
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "agent_db_pool_connections",
+    "Database connections by state",
+    ("state",),
+)
+
+
+def timed(histogram: Histogram, *label_values):
+    """
+    Decorator that records the call duration of a function
+
+    Args:
+        histogram: Histogram to observe into
+        label_values: Label values for the histogram child
+    """
+    def decorator(func):
+        child = histogram.labels(*label_values)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
@@ -0,0 +1,418 @@
+"""
+Per-request memory and CPU profiling
+Off unless PROFILE_ENABLED is set. A /query request then opts in with an
+X-Profile header or profile query parameter, and PROFILE_SAMPLE_RATE
+profiles a random share of the others.
+While a request is profiled, every tool selection (select_tool_with_llm),
+tool call (execute_tool) and SQL statement (execute_query) it runs records
+its time, the memory it allocated and still holds when it returns (tracemalloc
+snapshots, by allocation site), and a cProfile of the thread it ran in.
+Finished profiles are kept in a ring buffer for /debug/profiles.
+
+tracemalloc is process-wide, so only one request is profiled at a time and
+tracing is switched off again afterwards; requests that arrive meanwhile run
+unprofiled. Sampled profiles are at least PROFILE_MIN_INTERVAL seconds apart,
+requested ones PROFILE_REQUEST_MIN_INTERVAL.
+
+Snapshots cover the whole process, so a stage's allocations are only
+reported when no stage in another thread (a parallel tool call or site)
+ran at the same time; overlapping stages are timed and marked "overlapped".
+"""
+
+import cProfile
+import linecache
+import logging
+import os
+import pstats
+import random
+import sysconfig
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from metrics import PROFILES_CAPTURED
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '0') == '1'
+# When set, opting in needs X-Profile: <token> (or profile=<token>) instead of "1"
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MIN_INTERVAL = float(os.getenv('PROFILE_MIN_INTERVAL', 60))
+PROFILE_REQUEST_MIN_INTERVAL = float(os.getenv('PROFILE_REQUEST_MIN_INTERVAL', 10))
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', 20))
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', 10))
+# Frames kept per allocation; more show the callers, at a higher tracing cost
+PROFILE_TRACE_FRAMES = int(os.getenv('PROFILE_TRACE_FRAMES', 1))
+# Stages per request that get their own snapshots (later ones are only timed)
+PROFILE_MAX_STAGES = 50
+
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_STDLIB = sysconfig.get_paths()['stdlib']
+
+_active: ContextVar[Optional['Profile']] = ContextVar('profile', default=None)
+_cpu_thread = threading.local()
+
+
+def _where(path: str, line: int) -> str:
+    """file:line with the path shortened to the package or project"""
+    if 'site-packages' in path:
+        path = path.split('site-packages', 1)[1].lstrip('/\\')
+    elif path.startswith(_STDLIB):
+        path = os.path.relpath(path, _STDLIB)
+    elif path.startswith(os.getcwd()):
+        path = os.path.relpath(path)
+    return f"{path}:{line}"
+
+
+def allocation_sites(after: tracemalloc.Snapshot, before: tracemalloc.Snapshot,
+                     limit: int = PROFILE_TOP_N) -> List[Dict]:
+    """
+    Allocation sites that grew between two snapshots, largest first
+
+    Returns:
+        "site", "size_kb", "count" (and "stack", when more than one frame
+        is traced) per site
+    """
+    grown = [
+        diff for diff in after.compare_to(before, 'traceback')
+        if diff.size_diff > 0
+    ]
+    grown.sort(key=lambda diff: diff.size_diff, reverse=True)
+    sites = []
+    for diff in grown[:limit]:
+        site = {
+            'site': _where(diff.traceback[-1].filename, diff.traceback[-1].lineno),
+            'size_kb': round(diff.size_diff / 1024, 1),
+            'count': diff.count_diff,
+        }
+        if len(diff.traceback) > 1:
+            site['stack'] = [_where(frame.filename, frame.lineno) for frame in reversed(diff.traceback)]
+        sites.append(site)
+    return sites
+
+
+def _snapshot() -> Optional[tracemalloc.Snapshot]:
+    """Current traces, or None once tracing has stopped"""
+    try:
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    except RuntimeError:
+        return None
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """Peak resident set size of the process so far (ru_maxrss, KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+
+
+class Profile:
+    """
+    Stages, allocations and CPU profiles recorded for one request
+    """
+
+    def __init__(self, query: str, trigger: str):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.trigger = trigger
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: List[Dict] = []
+        self._cpu: Dict[str, List[cProfile.Profile]] = {}
+        self._running: List['_Stage'] = []
+        self.closed = False
+
+    def stage(self, name: str, label: str = None):
+        """Context manager recording one stage (see profiled)"""
+        return _Stage(self, name, label)
+
+    def started(self, stage: '_Stage'):
+        """Mark stage, and stages running in other threads, as overlapping each other"""
+        with self._lock:
+            for other in self._running:
+                if other.thread is not stage.thread:
+                    other.overlapped = stage.overlapped = True
+            self._running.append(stage)
+
+    def finished(self, stage: '_Stage'):
+        with self._lock:
+            self._running.remove(stage)
+
+    def add_stage(self, entry: Dict, cpu: Optional[cProfile.Profile]):
+        with self._lock:
+            if self.closed:
+                return  # a timed-out tool finishing after the request
+            self.stages.append(entry)
+            if cpu is not None:
+                self._cpu.setdefault(entry['stage'], []).append(cpu)
+
+    def snapshots_left(self) -> bool:
+        with self._lock:
+            return not self.closed and len(self.stages) < PROFILE_MAX_STAGES
+
+    def close(self) -> Dict[str, List[Dict]]:
+        """
+        Stop recording stages
+
+        Returns:
+            Functions with the most cumulative time, per stage
+        """
+        with self._lock:
+            self.closed = True
+            cpu = dict(self._cpu)
+        top = {}
+        for stage, profiles in cpu.items():
+            stats = pstats.Stats(*profiles).stats
+            ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+            top[stage] = [{
+                'function': f"{_where(filename, line)}({function})" if line else function,
+                'calls': calls,
+                'self_ms': round(self_time * 1000, 2),
+                'cumulative_ms': round(cumulative * 1000, 2),
+            } for (filename, line, function), (_, calls, self_time, cumulative, _) in ranked[:PROFILE_TOP_N]]
+        return top
+
+
+class _Stage:
+    def __init__(self, profile: Profile, name: str, label: str = None):
+        self.profile = profile
+        self.name = name
+        self.label = label
+        self.before = None
+        self.cpu = None
+        self.thread = threading.current_thread()
+        self.overlapped = False
+
+    def __enter__(self):
+        self.profile.started(self)
+        if self.profile.snapshots_left():
+            self.before = _snapshot()
+        # One cProfile per thread at a time: nested stages show up inside the outer one
+        if not getattr(_cpu_thread, 'busy', False):
+            cpu = cProfile.Profile()
+            try:
+                cpu.enable()
+                self.cpu, _cpu_thread.busy = cpu, True
+            except ValueError:
+                pass  # another profiler owns this interpreter (Python 3.12+)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.profile.finished(self)
+        if self.cpu is not None:
+            self.cpu.disable()
+            _cpu_thread.busy = False
+        entry = {
+            'stage': self.name,
+            'label': self.label,
+            'thread': threading.current_thread().name,
+            'ms': round(elapsed * 1000, 2),
+            'offset_ms': round((self.start - self.profile._start) * 1000, 2),
+        }
+        if self.overlapped:
+            # Other threads allocated meanwhile; the diff would not be this stage's
+            entry['overlapped'] = True
+        after = _snapshot() if self.before is not None and not self.overlapped else None
+        if after is not None:
+            # Measured before the caller drops the result, so rows it returns count
+            sites = allocation_sites(after, self.before)
+            entry['allocated_kb'] = round(sum(site['size_kb'] for site in sites), 1)
+            entry['top_allocations'] = sites[:3]
+        self.profile.add_stage(entry, self.cpu)
+        return False
+
+
+class Profiles:
+    """
+    Ring buffer of finished profiles and the single profiling slot
+    """
+
+    def __init__(self, size: int = PROFILE_BUFFER_SIZE):
+        self._buffer = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._slot = threading.Lock()
+        self._last_sampled = 0.0
+        self._last_requested = 0.0
+
+    def trigger(self, requested: Optional[str]) -> Optional[str]:
+        """
+        Whether to profile a request
+
+        Args:
+            requested: Value of the X-Profile header or profile parameter
+
+        Returns:
+            "requested", "sampled", or None to run unprofiled
+        """
+        if not PROFILE_ENABLED:
+            return None
+        if requested:
+            if requested == (PROFILE_TOKEN or "1") or (not PROFILE_TOKEN and requested.lower() == "true"):
+                if self._due("_last_requested", PROFILE_REQUEST_MIN_INTERVAL):
+                    return "requested"
+                PROFILES_CAPTURED.labels("requested", "limited").inc()
+                logger.warning("⚠️ Profiling requested too soon after the last one - running unprofiled")
+                return None
+            logger.warning("⚠️ Ignoring profiling request with the wrong token")
+        if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        return "sampled" if self._due("_last_sampled", PROFILE_MIN_INTERVAL) else None
+
+    def _due(self, last: str, interval: float) -> bool:
+        """Whether interval seconds have passed since the time in attribute last (and reset it)"""
+        with self._lock:
+            now = time.monotonic()
+            if now - getattr(self, last) < interval:
+                return False
+            setattr(self, last, now)
+        return True
+
+    @contextmanager
+    def capture(self, query: str, trigger: Optional[str]):
+        """
+        Profile the block (and what it runs in other threads from its context)
+
+        Yields:
+            The Profile, or None when trigger is None or another request is
+            being profiled
+        """
+        if trigger is None:
+            yield None
+            return
+        if not self._slot.acquire(blocking=False):
+            PROFILES_CAPTURED.labels(trigger, "busy").inc()
+            yield None
+            return
+
+        profile = Profile(query, trigger)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        rss_before = _peak_rss_kb()
+        before = _snapshot()
+        token = _active.set(profile)
+        try:
+            yield profile
+        finally:
+            _active.reset(token)
+            try:
+                self._finish(profile, before, rss_before)
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+                self._slot.release()
+
+    def _finish(self, profile: Profile, before: tracemalloc.Snapshot, rss_before: Optional[int]):
+        _, traced_peak = tracemalloc.get_traced_memory()
+        sites = allocation_sites(_snapshot(), before)
+        cpu = profile.close()
+        rss_after = _peak_rss_kb()
+        record = {
+            'profile_id': profile.profile_id,
+            'query': profile.query,
+            'trigger': profile.trigger,
+            'started_at': profile.started_at,
+            'total_ms': round((time.perf_counter() - profile._start) * 1000, 1),
+            'traced_peak_kb': round(traced_peak / 1024, 1),
+            'peak_rss_kb': rss_after,
+            'peak_rss_growth_kb': rss_after - rss_before if rss_after is not None else None,
+            'top_allocations': sites,
+            'stages': profile.stages,
+            'cpu': cpu,
+        }
+        with self._lock:
+            self._buffer.append(record)
+        PROFILES_CAPTURED.labels(profile.trigger, "captured").inc()
+        logger.info(
+            f"🔬 Profiled query in {record['total_ms']} ms, traced peak {record['traced_peak_kb']} KiB "
+            f"({profile.profile_id})"
+        )
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return next((p for p in self._buffer if p['profile_id'] == profile_id), None)
+
+    def report(self, limit: int = 10) -> Dict:
+        """
+        Recent profiles (newest first, without stage details) and the
+        allocation sites that grew most across all buffered profiles
+
+        Args:
+            limit: Number of profiles and allocation sites to include
+        """
+        with self._lock:
+            profiles = list(self._buffer)
+
+        by_site: Dict[str, Dict] = {}
+        for profile in profiles:
+            for site in profile['top_allocations']:
+                entry = by_site.setdefault(site['site'], {'site': site['site'], 'size_kb': 0.0,
+                                                          'count': 0, 'profiles': 0})
+                entry['size_kb'] = round(entry['size_kb'] + site['size_kb'], 1)
+                entry['count'] += site['count']
+                entry['profiles'] += 1
+        top_sites = sorted(by_site.values(), key=lambda entry: entry['size_kb'], reverse=True)
+
+        recent = [{
+            'profile_id': p['profile_id'],
+            'query': p['query'],
+            'trigger': p['trigger'],
+            'started_at': p['started_at'],
+            'total_ms': p['total_ms'],
+            'traced_peak_kb': p['traced_peak_kb'],
+            'peak_rss_growth_kb': p['peak_rss_growth_kb'],
+            'stages': len(p['stages']),
+            'top_allocations': p['top_allocations'][:3],
+        } for p in reversed(profiles[-limit:])]
+        return {'profiles': recent, 'top_allocations': top_sites[:limit]}
+
+
+PROFILES = Profiles()
+
+
+def profiled(stage: str, label_func: Callable = None):
+    """
+    Record calls of the decorated function as a stage of the profiled request
+
+    Costs one context variable lookup when the request is not profiled.
+
+    Args:
+        stage: Stage name in the profile
+        label_func: Optional function of the call's arguments naming the
+            call (e.g. the tool or statement fingerprint)
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _active.get()
+            if profile is None:
+                return func(*args, **kwargs)
+            with profile.stage(stage, label_func(*args, **kwargs) if label_func else None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
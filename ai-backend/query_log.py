@@ -0,0 +1,208 @@
+"""
+SQL statement statistics and slow-query log
+Tracks per-statement timings by fingerprint and captures sampled
+EXPLAIN (ANALYZE, BUFFERS) plans for statements over budget
+
+Run as a script to dump the top statements from a running agent:
+    python query_log.py --top 10
+"""
+
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', 0.1))
+EXPLAIN_MIN_INTERVAL = float(os.getenv('EXPLAIN_MIN_INTERVAL', 60))
+MAX_EXPLAIN_CAPTURES = 50
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace and replace literals so equal statements match"""
+    normalized = _STRING_LITERAL.sub("?", query)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+def fingerprint(query: str) -> str:
+    """Short stable id for a SQL statement"""
+    return hashlib.md5(normalize_sql(query).encode()).hexdigest()[:16]
+
+
+def is_explainable(query: str) -> bool:
+    """Only read-only statements are safe to re-run under EXPLAIN ANALYZE"""
+    head = query.lstrip().split(None, 1)
+    return bool(head) and head[0].upper() in ("SELECT", "WITH")
+
+
+class QueryStats:
+    """
+    Aggregated timings per statement fingerprint
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._explains = deque(maxlen=MAX_EXPLAIN_CAPTURES)
+        self._last_explain: Dict[str, float] = {}
+
+    def record(self, query: str, duration: float, rows: int = 0,
+               error: bool = False) -> Dict:
+        """
+        Record one execution of a statement
+
+        Args:
+            query: SQL text as sent to the database
+            duration: Execution time in seconds
+            rows: Number of rows returned
+            error: Whether the statement failed
+
+        Returns:
+            The updated stats entry for the statement
+        """
+        key = fingerprint(query)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = {
+                    'fingerprint': key,
+                    'query': normalize_sql(query),
+                    'calls': 0,
+                    'errors': 0,
+                    'rows': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'slow_calls': 0,
+                }
+                self._stats[key] = entry
+            duration_ms = duration * 1000
+            entry['calls'] += 1
+            entry['rows'] += rows
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            if error:
+                entry['errors'] += 1
+            if duration_ms >= SLOW_QUERY_MS:
+                entry['slow_calls'] += 1
+        return entry
+
+    def should_explain(self, query: str) -> bool:
+        """Sample slow statements for plan capture, at most once per interval"""
+        if EXPLAIN_SAMPLE_RATE <= 0 or not is_explainable(query):
+            return False
+        if random.random() >= EXPLAIN_SAMPLE_RATE:
+            return False
+        key = fingerprint(query)
+        now = time.time()
+        with self._lock:
+            if now - self._last_explain.get(key, 0) < EXPLAIN_MIN_INTERVAL:
+                return False
+            self._last_explain[key] = now
+        return True
+
+    def add_explain(self, query: str, duration: float, plan: str):
+        """Keep a captured plan in the bounded capture buffer"""
+        self._explains.append({
+            'fingerprint': fingerprint(query),
+            'query': normalize_sql(query),
+            'duration_ms': round(duration * 1000, 2),
+            'captured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'plan': plan,
+        })
+
+    def top(self, limit: int = 10, order_by: str = 'total_ms') -> List[Dict]:
+        """
+        Get the most expensive statements
+
+        Args:
+            limit: Number of statements to return
+            order_by: Stats field to sort by (total_ms, max_ms, calls)
+
+        Returns:
+            List of stats entries with mean time added
+        """
+        with self._lock:
+            entries = [dict(entry) for entry in self._stats.values()]
+        for entry in entries:
+            entry['mean_ms'] = entry['total_ms'] / entry['calls']
+        entries.sort(key=lambda e: e.get(order_by, 0), reverse=True)
+        return entries[:limit]
+
+    def explains(self, limit: int = 10) -> List[Dict]:
+        """Most recent captured plans, newest first"""
+        return list(self._explains)[::-1][:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._last_explain.clear()
+        self._explains.clear()
+
+
+QUERY_STATS = QueryStats()
+
+
+def log_slow_query(query: str, duration: float, rows: int):
+    """Write a slow-query log line"""
+    logger.warning(
+        f"🐢 Slow query {fingerprint(query)} took {duration * 1000:.1f} ms "
+        f"({rows} rows): {normalize_sql(query)[:200]}"
+    )
+
+
+def format_report(data: Dict) -> str:
+    """Render the /debug/queries payload for the terminal"""
+    lines = [
+        f"{'total ms':>10} {'calls':>7} {'mean ms':>9} {'max ms':>9} "
+        f"{'slow':>5}  fingerprint       query"
+    ]
+    for entry in data.get('top', []):
+        lines.append(
+            f"{entry['total_ms']:>10.1f} {entry['calls']:>7} "
+            f"{entry['mean_ms']:>9.2f} {entry['max_ms']:>9.2f} "
+            f"{entry['slow_calls']:>5}  {entry['fingerprint']}  "
+            f"{entry['query'][:80]}"
+        )
+    for capture in data.get('explains', []):
+        lines.append("")
+        lines.append(
+            f"EXPLAIN {capture['fingerprint']} "
+            f"({capture['duration_ms']} ms at {capture['captured_at']})"
+        )
+        lines.append(capture['plan'])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import requests
+
+    parser = argparse.ArgumentParser(description="Dump top SQL statements from a running agent")
+    parser.add_argument("--top", type=int, default=10, help="number of statements")
+    parser.add_argument("--order-by", default="total_ms", choices=["total_ms", "max_ms", "mean_ms", "calls"])
+    parser.add_argument("--explains", action="store_true", help="include captured plans")
+    parser.add_argument("--url", default=f"http://localhost:{os.getenv('AI_PORT', 8000)}")
+    args = parser.parse_args()
+
+    response = requests.get(
+        f"{args.url}/debug/queries",
+        params={"limit": args.top, "order_by": args.order_by},
+        timeout=10,
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not args.explains:
+        data['explains'] = []
+    print(format_report(data))
@@ -0,0 +1,297 @@
+"""
+Stock rebalancing between locations
+Proposes internal transfers that bring every location back up to its
+min_stock_level with stock that other locations hold above theirs. The
+product x location matrix is matched with a vectorized greedy rule
+(north-west corner over each product's donors and recipients): first
+between locations of the same warehouse, then across warehouses, so cheap
+moves are used before long-haul ones. Donors are drained from the most
+overstocked (furthest above max_stock_level) first and never below their
+own minimum; the largest shortages are served first.
+
+Draft and confirmed internal transfers count as already moved, so the
+proposals do not repeat transfers that are in progress.
+
+Run as a script to time a plan on synthetic data:
+    python rebalancing.py --benchmark 5000 2000
+"""
+
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from db_connector import get_connector
+from metrics import STAGE_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+REBALANCE_MAX_LINES = int(os.getenv('REBALANCE_MAX_LINES', 50))
+
+# Quantities are numeric(12,4): matching runs on whole 1/10000 units, so the
+# cumulative sums are exact
+UNIT_SCALE = 10000
+
+
+# ============================================================================
+# MATCHING
+# ============================================================================
+
+def _sorted_unique(values: np.ndarray) -> np.ndarray:
+    # np.unique, by sorting (much faster than the hash-based path on large int arrays)
+    values = np.sort(values)
+    return values[np.concatenate([[True], values[1:] != values[:-1]])] if len(values) else values
+
+
+def match(donor_groups: np.ndarray, supply: np.ndarray,
+          recipient_groups: np.ndarray, demand: np.ndarray):
+    """
+    North-west corner matching of donors to recipients within each group
+
+    Donors and recipients are each laid end to end on one axis, group after
+    group, and every stretch of the axis covered by both a donor and a
+    recipient becomes one transfer. Within a group, earlier entries are
+    served first, so callers sort by priority.
+
+    Args:
+        donor_groups: Group of each donor, sorted
+        supply: Units each donor can give (integers > 0)
+        recipient_groups: Group of each recipient, sorted
+        demand: Units each recipient needs (integers > 0)
+
+    Returns:
+        (donor index, recipient index, units) of each transfer
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if len(supply) == 0 or len(demand) == 0:
+        return empty, empty, empty
+
+    groups = _sorted_unique(np.concatenate([donor_groups, recipient_groups]))
+    donor_codes = np.searchsorted(groups, donor_groups)
+    recipient_codes = np.searchsorted(groups, recipient_groups)
+    group_supply = np.bincount(donor_codes, weights=supply, minlength=len(groups)).astype(np.int64)
+    group_demand = np.bincount(recipient_codes, weights=demand, minlength=len(groups)).astype(np.int64)
+    span = np.maximum(group_supply, group_demand)
+    group_start = np.concatenate([[0], np.cumsum(span)[:-1]])
+
+    def ends(group_codes, amounts, group_totals):
+        # Position where each entry ends: its group's start plus the running
+        # total of the entries before it in the same group
+        running = np.cumsum(amounts)
+        before_group = np.concatenate([[0], np.cumsum(group_totals)[:-1]])
+        return group_start[group_codes] + running - before_group[group_codes]
+
+    donor_end = ends(donor_codes, supply, group_supply)
+    recipient_end = ends(recipient_codes, demand, group_demand)
+    points = _sorted_unique(np.concatenate([donor_end - supply, donor_end, recipient_end - demand, recipient_end]))
+    left, units = points[:-1], np.diff(points)
+
+    donor = np.searchsorted(donor_end, left, side='right')
+    recipient = np.searchsorted(recipient_end, left, side='right')
+    covered = (donor < len(supply)) & (recipient < len(demand))
+    donor, recipient, left, units = donor[covered], recipient[covered], left[covered], units[covered]
+    covered = (donor_end[donor] - supply[donor] <= left) & (recipient_end[recipient] - demand[recipient] <= left)
+    return donor[covered], recipient[covered], units[covered]
+
+
+def _total_at(index: np.ndarray, units: np.ndarray, size: int) -> np.ndarray:
+    """Units summed per row index"""
+    return np.bincount(index, weights=units, minlength=size).astype(np.int64)
+
+
+@timed(STAGE_SECONDS, "rebalance")
+def plan_transfers(product_ids: np.ndarray, location_ids: np.ndarray, warehouse_ids: np.ndarray,
+                   quantity: np.ndarray, min_level: np.ndarray, max_level: np.ndarray) -> Dict:
+    """
+    Transfers that cover shortages below min_stock_level from other locations
+
+    Args:
+        product_ids, location_ids, warehouse_ids: One entry per stock row
+        quantity: Units on hand (after pending transfers)
+        min_level: min_stock_level of the row
+        max_level: max_stock_level of the row (NaN when unset)
+
+    Returns:
+        Transfer arrays (product, from, to, quantity, same_warehouse) and the
+        shortage no location could cover, per stock row
+    """
+    scaled = np.round(quantity * UNIT_SCALE).astype(np.int64)
+    floor = np.round(min_level * UNIT_SCALE).astype(np.int64)
+    over_max = np.where(np.isnan(max_level), 0, quantity - max_level)
+
+    supply = np.maximum(scaled - floor, 0)
+    demand = np.maximum(floor - scaled, 0)
+    donors = np.flatnonzero(supply > 0)
+    recipients = np.flatnonzero(demand > 0)
+    # Within a product (and warehouse): most overstocked donors and largest shortages first
+    donors = donors[np.lexsort((-supply[donors], -over_max[donors], product_ids[donors]))]
+    recipients = recipients[np.lexsort((-demand[recipients], product_ids[recipients]))]
+
+    # Pass 1 matches inside each warehouse, pass 2 matches what is left across warehouses
+    def warehouse_key(rows):
+        return (product_ids[rows].astype(np.int64) << 32) | warehouse_ids[rows].astype(np.int64)
+
+    donor_key, recipient_key = warehouse_key(donors), warehouse_key(recipients)
+    donor_order, recipient_order = np.argsort(donor_key, kind='stable'), np.argsort(recipient_key, kind='stable')
+    d, r, units = match(donor_key[donor_order], supply[donors][donor_order],
+                        recipient_key[recipient_order], demand[recipients][recipient_order])
+    local_from, local_to = donors[donor_order][d], recipients[recipient_order][r]
+
+    supply = supply - _total_at(local_from, units, len(supply))
+    demand = demand - _total_at(local_to, units, len(demand))
+    donors, recipients = donors[supply[donors] > 0], recipients[demand[recipients] > 0]
+    d, r, remote_units = match(product_ids[donors], supply[donors], product_ids[recipients], demand[recipients])
+    remote_from, remote_to = donors[d], recipients[r]
+    demand -= _total_at(remote_to, remote_units, len(demand))
+
+    source = np.concatenate([local_from, remote_from])
+    target = np.concatenate([local_to, remote_to])
+    unmet = np.flatnonzero(demand > 0)
+    return {
+        'product_id': product_ids[source],
+        'from_location_id': location_ids[source],
+        'to_location_id': location_ids[target],
+        'quantity': np.concatenate([units, remote_units]) / UNIT_SCALE,
+        'same_warehouse': np.concatenate([np.ones(len(units), bool), np.zeros(len(remote_units), bool)]),
+        'unmet_product_id': product_ids[unmet],
+        'unmet_quantity': demand[unmet] / UNIT_SCALE,
+    }
+
+
+# ============================================================================
+# PROPOSALS
+# ============================================================================
+
+def _matrix(rows: List[Dict]) -> Dict[str, np.ndarray]:
+    return {
+        'product_ids': np.array([r['product_id'] for r in rows], dtype=np.int64),
+        'location_ids': np.array([r['location_id'] for r in rows], dtype=np.int64),
+        'warehouse_ids': np.array([r['warehouse_id'] for r in rows], dtype=np.int64),
+        'quantity': np.array([r['quantity'] or 0 for r in rows], dtype=np.float64),
+        'min_level': np.array([r['min_level'] or 0 for r in rows], dtype=np.float64),
+        'max_level': np.array(
+            [np.nan if r['max_level'] is None else r['max_level'] for r in rows], dtype=np.float64
+        ),
+    }
+
+
+def propose_transfers(product_id: int = None, limit: int = REBALANCE_MAX_LINES) -> Dict:
+    """
+    Candidate internal transfers from the current stock levels
+
+    Args:
+        product_id: Limit to one product, or None for all products
+        limit: Number of transfer lines to describe (largest first)
+
+    Returns:
+        Transfer lines with location names, totals, and the shortage per
+        product that needs purchasing instead
+    """
+    connector = get_connector()
+    start = time.perf_counter()
+    rows = connector.get_rebalance_matrix(product_id)
+    plan = plan_transfers(**_matrix(rows))
+
+    order = np.argsort(-plan['quantity'], kind='stable')[:limit]
+    locations = connector.get_location_names(
+        {int(plan['from_location_id'][i]) for i in order} | {int(plan['to_location_id'][i]) for i in order}
+    )
+
+    products = {p['product_id']: p for p in connector.get_all_products()}
+
+    def item(product_id: int) -> Dict:
+        product = products.get(product_id, {})
+        return {
+            'product_id': product_id,
+            'name': product.get('name', f"#{product_id}"),
+            'sku_code': product.get('sku_code', ""),
+            'unit_of_measure': product.get('unit_of_measure', ""),
+        }
+
+    def place(location_id: int) -> Dict:
+        location = locations.get(location_id, {})
+        return {
+            'location_id': location_id,
+            'location_name': location.get('location_name', f"#{location_id}"),
+            'warehouse_name': location.get('warehouse_name', ""),
+        }
+
+    lines = [{
+        **item(int(plan['product_id'][i])),
+        'from': place(int(plan['from_location_id'][i])),
+        'to': place(int(plan['to_location_id'][i])),
+        'quantity': float(plan['quantity'][i]),
+        'same_warehouse': bool(plan['same_warehouse'][i]),
+    } for i in order]
+    shortfall: Dict[int, float] = {}
+    for product_id, quantity in zip(plan['unmet_product_id'].tolist(), plan['unmet_quantity'].tolist()):
+        shortfall[product_id] = shortfall.get(product_id, 0.0) + quantity
+    unmet = sorted(
+        ({**item(product_id), 'quantity': quantity} for product_id, quantity in shortfall.items()),
+        key=lambda entry: entry['quantity'], reverse=True
+    )[:limit]
+    logger.info(
+        f"🔀 Rebalancing: {len(plan['quantity'])} transfers over {len(rows)} stock rows "
+        f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+    )
+    return {
+        'lines': lines,
+        'total_lines': len(plan['quantity']),
+        'total_units': float(plan['quantity'].sum()),
+        'cross_warehouse_lines': int((~plan['same_warehouse']).sum()),
+        'unmet': unmet,
+        'stock_rows': len(rows),
+    }
+
+
+def benchmark(products: int, locations: int, warehouses: int = 20, seed: int = 0) -> Dict:
+    """Time a plan over a dense synthetic products x locations matrix"""
+    rng = np.random.default_rng(seed)
+    size = products * locations
+    min_level = rng.integers(5, 50, size=size).astype(np.float64)
+    matrix = {
+        'product_ids': np.repeat(np.arange(products), locations),
+        'location_ids': np.tile(np.arange(locations), products),
+        'warehouse_ids': np.tile(np.arange(locations) % warehouses, products),
+        'quantity': rng.poisson(min_level * 1.2).astype(np.float64),
+        'min_level': min_level,
+        'max_level': min_level * 3,
+    }
+    start = time.perf_counter()
+    plan = plan_transfers(**matrix)
+    elapsed = time.perf_counter() - start
+    return {
+        'products': products,
+        'locations': locations,
+        'stock_rows': size,
+        'seconds': round(elapsed, 3),
+        'transfers': len(plan['quantity']),
+        'unmet_rows': len(plan['unmet_quantity']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose internal transfers that fix stock imbalances")
+    parser.add_argument("--benchmark", type=int, nargs=2, metavar=("PRODUCTS", "LOCATIONS"),
+                        help="Time a plan on synthetic data of this size")
+    parser.add_argument("--product-id", type=int, help="Only rebalance this product")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(benchmark(*args.benchmark))
+        return
+    proposal = propose_transfers(args.product_id)
+    for line in proposal['lines']:
+        print(f"{line['name']}: {line['quantity']} from {line['from']['location_name']} "
+              f"to {line['to']['location_name']}")
+    for entry in proposal['unmet']:
+        print(f"{entry['name']}: {entry['quantity']} short after transfers")
+
+
+if __name__ == "__main__":
+    main()
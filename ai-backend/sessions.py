@@ -0,0 +1,195 @@
+"""
+Conversation sessions for follow-up questions
+Keeps the entities a conversation has resolved (product, warehouse) for a
+while, so "and where is it stored?" reuses the product from the previous
+question instead of planning and resolving it again
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from metrics import SESSION_EVENTS, SESSIONS_ACTIVE
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+SESSION_MAX = int(os.getenv('SESSION_MAX', 10000))
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', 1800))
+# A remembered entity is only reused this long after it was last mentioned
+SESSION_ENTITY_TTL_SECONDS = float(os.getenv('SESSION_ENTITY_TTL_SECONDS', 600))
+
+
+class Session:
+    """
+    Entities resolved in one conversation, each with when it was last seen
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.entities: Dict[str, tuple] = {}
+        self.last_seen = time.monotonic()
+
+    def remember(self, kind: str, value: dict):
+        self.entities[kind] = (value, time.monotonic())
+
+    def recall(self, kind: str) -> Optional[dict]:
+        """The entity of this kind, unless it is older than SESSION_ENTITY_TTL_SECONDS"""
+        entry = self.entities.get(kind)
+        if entry is None:
+            return None
+        value, seen = entry
+        if time.monotonic() - seen > SESSION_ENTITY_TTL_SECONDS:
+            self.entities.pop(kind, None)
+            return None
+        return value
+
+    def summary(self) -> dict:
+        """Current entities, for the /query response"""
+        entities = {}
+        for kind in list(self.entities):
+            value = self.recall(kind)
+            if value is not None:
+                entities[kind] = value
+        return entities
+
+
+class SessionStore:
+    """
+    Bounded in-memory session store
+
+    Sessions expire SESSION_TTL_SECONDS after their last use (checked on
+    each access). When the store is full the least recently used session is
+    evicted. Sessions live in the worker process, so with several workers a
+    client needs sticky routing to keep its session.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id: str = None) -> Session:
+        """
+        The live session with this id, or a new one
+
+        Args:
+            session_id: Id returned by an earlier /query, or None to start a session
+
+        Returns:
+            The session, marked as most recently used
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+                SESSION_EVENTS.labels("created").inc()
+                self._evict()
+            else:
+                self._sessions.move_to_end(session.session_id)
+            session.last_seen = now
+            return session
+
+    def _expire(self, now: float):
+        """Drop sessions idle for longer than the TTL (least recently used come first)"""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen <= self.ttl:
+                break
+            del self._sessions[session_id]
+            SESSION_EVENTS.labels("expired").inc()
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            SESSION_EVENTS.labels("evicted").inc()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+# ============================================================================
+# ENTITIES FROM TOOL RESULTS
+# ============================================================================
+
+PRODUCT_TOOLS = ("product_stock", "product_location", "movement_history", "stockout_forecast", "rebalance")
+# Tools for which no product means all products, so an empty name stays empty
+OPTIONAL_PRODUCT_TOOLS = ("movement_history", "stockout_forecast", "rebalance")
+MAX_ALIASES = 5
+
+
+def _name_key(name: str) -> str:
+    return " ".join(str(name).lower().split())
+
+
+def attach_entities(plan: dict, session: Session) -> dict:
+    """
+    Hand the session's resolved product to the calls that are about it
+
+    A product call is about it when it names the product the way the
+    conversation did before, or (stock and location only) names none.
+    Those calls get the product itself and skip the product search.
+
+    Args:
+        plan: Plan from a selector
+        session: Session of the query
+
+    Returns:
+        The same plan
+    """
+    product = session.recall("product")
+    if product is None:
+        return plan
+    known = {_name_key(product["name"]), *product.get("aliases", ())}
+    for call in plan["calls"]:
+        if call["tool"] not in PRODUCT_TOOLS:
+            continue
+        name = call.get("product_name")
+        if (name and _name_key(name) in known) or (not name and call["tool"] not in OPTIONAL_PRODUCT_TOOLS):
+            call["product_name"] = product["name"]
+            call["product"] = product
+            SESSION_EVENTS.labels("entity_reused").inc()
+    return plan
+
+
+def remember_results(session: Session, calls: list, results: list):
+    """
+    Remember the product (and single warehouse) the answer was about
+
+    Args:
+        session: Session of the query
+        calls: Calls of the plan that ran
+        results: Structured results, in plan order
+    """
+    for call, result in zip(calls, results):
+        product = result.get("product") if result["status"] == "ok" else None
+        if not product:
+            continue
+        previous = session.recall("product")
+        aliases = list(previous.get("aliases", ())) \
+            if previous and previous["product_id"] == product["product_id"] else []
+        if call.get("product_name") and _name_key(call["product_name"]) not in aliases:
+            aliases = (aliases + [_name_key(call["product_name"])])[-MAX_ALIASES:]
+        session.remember("product", {**product, "aliases": aliases})
+
+        # Only location rows say where the product is (forecast and rebalance rows don't)
+        if result["tool"] != "product_location":
+            continue
+        warehouses = {row["warehouse_name"] for row in result.get("rows", ())}
+        if len(warehouses) == 1:
+            session.remember("warehouse", {"name": warehouses.pop()})
+
+
+SESSIONS = SessionStore()
+SESSIONS_ACTIVE.set_function(lambda: len(SESSIONS))
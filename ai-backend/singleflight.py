@@ -0,0 +1,167 @@
+"""
+Single-flight coalescing of identical in-flight calls
+Concurrent callers with the same key share one execution and its result,
+so a burst of identical questions costs one database round trip
+"""
+
+import logging
+import os
+import threading
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable
+
+from dotenv import load_dotenv
+
+from db_connector import CancelScope, cancel_scope, current_scope
+from metrics import COALESCED_CALLS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Longest a follower waits for the shared execution before giving up
+SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv('SINGLEFLIGHT_WAIT_SECONDS', 30))
+
+
+class _Call:
+    """One in-flight execution that followers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.followers = 0
+        # The execution runs in its own scope, cancelled only when every
+        # caller waiting for it has been cancelled
+        self.scope = CancelScope()
+        self.interested = 0
+
+
+class _Interest(CancelScope):
+    """Child of a caller's scope that withdraws the caller from a call when cancelled"""
+
+    def __init__(self, parent: CancelScope, withdraw: Callable[[], None]):
+        self._withdraw = withdraw
+        super().__init__(parent)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+        self._withdraw()
+
+
+class SingleFlight:
+    """
+    Group of keyed calls where only one call per key runs at a time
+
+    The first caller for a key (the leader) runs the function. Callers that
+    arrive while it is running (followers) block until it finishes and get
+    the same result, or the same exception. Nothing is cached afterwards:
+    the next call after completion runs again.
+
+    The function runs in a cancel scope of its own, not the leader's: a
+    leader whose request is cancelled or times out does not cancel it for
+    the followers. Its statements are cancelled once no caller is left.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, or wait for the in-flight run with the same key
+
+        Args:
+            key: Identifies calls that may share a result
+            fn: Zero-argument function to run
+
+        Returns:
+            The result of fn from whichever caller ran it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            call.interested += 1
+        interest = _Interest(current_scope(), lambda: self._withdraw(key, call))
+
+        if not leader:
+            COALESCED_CALLS.labels(self.name, "shared").inc()
+            if not call.done.wait(SINGLEFLIGHT_WAIT_SECONDS):
+                interest.cancel()
+                raise TimeoutError(f"{self.name} did not finish within {SINGLEFLIGHT_WAIT_SECONDS:g}s")
+            if call.scope.cancelled and not _cancelled():
+                # Cancelled just as this caller joined: run it again
+                return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        COALESCED_CALLS.labels(self.name, "executed").inc()
+        try:
+            with cancel_scope(call.scope):
+                call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+            if call.followers:
+                logger.debug(f"🔗 {self.name}: {call.followers} calls shared {key!r}")
+
+    def _withdraw(self, key: Hashable, call: _Call):
+        """A caller was cancelled; cancel the execution if nobody else waits for it"""
+        with self._lock:
+            call.interested -= 1
+            if call.interested > 0:
+                return
+            # Later callers start a fresh execution instead of joining this one
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.scope.cancel()
+
+    def in_flight(self) -> int:
+        """Number of keys currently executing"""
+        with self._lock:
+            return len(self._calls)
+
+
+def _cancelled() -> bool:
+    scope = current_scope()
+    return scope is not None and scope.cancelled
+
+
+def coalesced(group: SingleFlight, key_func: Callable[..., Hashable] = None):
+    """
+    Decorator that coalesces concurrent calls with equal arguments
+
+    Args:
+        group: SingleFlight group to run the calls in
+        key_func: Builds the key from the call arguments (default: the arguments)
+
+    Results are shared between callers, so they must be treated as read-only.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if key_func is not None:
+                key = key_func(*args, **kwargs)
+            else:
+                key = (args, tuple(sorted(kwargs.items())))
+            return group.do(key, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
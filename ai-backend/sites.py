@@ -0,0 +1,190 @@
+"""
+Multi-site fan-out across regional inventory databases
+With INVENTORY_SITES set, location, warehouse and low-stock questions are
+asked of every site at once: this worker's own database (LOCAL_SITE_NAME)
+and each named remote database. Each site has its own timeout; a site that
+fails or runs out of time is reported next to the merged rows of the
+others, so the answer takes as long as the slowest site, not the sum.
+
+Product ids are local to each database, so a product is found at another
+site by its SKU (or, failing that, its exact name).
+"""
+
+import contextvars
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from db_connector import CancelScope, InventoryDBConnector, cancel_scope, current_scope
+from metrics import SITE_FAILURES, SITE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Comma-separated name=DSN pairs, e.g. "emea=postgresql://.../stockmaster,apac=postgresql://..."
+INVENTORY_SITES = os.getenv('INVENTORY_SITES', '')
+LOCAL_SITE_NAME = os.getenv('LOCAL_SITE_NAME', 'local')
+SITE_TIMEOUT_SECONDS = float(os.getenv('SITE_TIMEOUT_SECONDS', 5))
+SITE_POOL_MAX = int(os.getenv('SITE_POOL_MAX', 2))
+
+
+def parse_sites(spec: str) -> List[Tuple[str, str]]:
+    """
+    Parse INVENTORY_SITES
+
+    Returns:
+        (name, dsn) per remote site, in the configured order
+    """
+    sites = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        name, separator, dsn = entry.partition('=')
+        if not separator or not name.strip() or not dsn.strip():
+            raise ValueError(f"INVENTORY_SITES entry must be name=dsn, got {entry.strip()!r}")
+        sites.append((name.strip(), dsn.strip()))
+    return sites
+
+
+def site_timeout(name: str) -> float:
+    """Time limit for one site, overridable as SITE_TIMEOUT_<NAME>_SECONDS"""
+    return float(os.getenv(f'SITE_TIMEOUT_{name.upper()}_SECONDS', SITE_TIMEOUT_SECONDS))
+
+
+class Sites:
+    """
+    This worker's own stock source plus the remote site connectors
+    """
+
+    def __init__(self, local_source: Callable, remotes: List[Tuple[str, str]]):
+        """
+        Args:
+            local_source: Returns the local stock source (snapshot or connector)
+            remotes: (name, dsn) of each remote site
+        """
+        self.local_source = local_source
+        self.connectors: Dict[str, InventoryDBConnector] = {
+            name: InventoryDBConnector(
+                dsn, pool_max=SITE_POOL_MAX, raise_errors=True,
+                connect_timeout=max(1, math.ceil(site_timeout(name))),
+            )
+            for name, dsn in remotes
+        }
+        self.names = [LOCAL_SITE_NAME] + list(self.connectors)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(4, 2 * len(self.names)), thread_name_prefix="site"
+        )
+
+    def _source(self, name: str):
+        return self.local_source() if name == LOCAL_SITE_NAME else self.connectors[name]
+
+    def fan_out(self, call: Callable[[str, object], list]) -> Dict:
+        """
+        Run call(site_name, source) for every site in parallel
+
+        Each site runs in its own cancel scope; when its timeout passes, its
+        SQL is cancelled and the site is reported as failed.
+
+        Args:
+            call: Returns the rows of one site
+
+        Returns:
+            "rows" of the sites that answered, each tagged with its "site",
+            in site order; "sites" with each site's status and time
+        """
+        scopes = {name: CancelScope(current_scope()) for name in self.names}
+        start = time.monotonic()
+        futures = {
+            name: self._executor.submit(
+                contextvars.copy_context().run, self._run_site, scopes[name], name, call
+            )
+            for name in self.names
+        }
+
+        rows, report = [], []
+        for name, future in futures.items():
+            remaining = start + site_timeout(name) - time.monotonic()
+            try:
+                site_rows, seconds = future.result(timeout=max(0.0, remaining))
+                rows.extend({**row, 'site': name} for row in site_rows)
+                report.append({'site': name, 'status': 'ok', 'ms': round(seconds * 1000, 1)})
+            except FutureTimeout:
+                scopes[name].cancel()
+                SITE_FAILURES.labels(name, "timeout").inc()
+                logger.error(f"⏱️ Site {name} timed out after {site_timeout(name)}s")
+                report.append({'site': name, 'status': 'timeout',
+                               'error': f"no answer within {site_timeout(name):g}s"})
+            except Exception as e:
+                SITE_FAILURES.labels(name, "error").inc()
+                logger.error(f"❌ Site {name} failed: {e}")
+                report.append({'site': name, 'status': 'error', 'error': str(e)})
+        return {'rows': rows, 'sites': report}
+
+    def _run_site(self, scope: CancelScope, name: str, call: Callable):
+        start = time.perf_counter()
+        with cancel_scope(scope):
+            rows = call(name, self._source(name))
+        seconds = time.perf_counter() - start
+        SITE_SECONDS.labels(name).observe(seconds)
+        return rows, seconds
+
+    # ------------------------------------------------------------------------
+    # Fanned-out reads (same rows as the connector methods, plus "site")
+    # ------------------------------------------------------------------------
+
+    def get_product_stock_by_warehouse(self, product: Dict) -> Dict:
+        """Stock of a product per warehouse and location at every site"""
+        def call(name, source):
+            if name == LOCAL_SITE_NAME:
+                return source.get_product_stock_by_warehouse(product['product_id'])
+            match = find_same_product(source, product)
+            return source.get_product_stock_by_warehouse(match['product_id']) if match else []
+        return self.fan_out(call)
+
+    def get_warehouse_inventory_summary(self) -> Dict:
+        """Inventory totals per warehouse at every site"""
+        return self.fan_out(lambda name, source: source.get_warehouse_inventory_summary())
+
+    def get_low_stock_products(self, threshold: int = 50) -> Dict:
+        """Products below the threshold at each site, lowest stock first"""
+        merged = self.fan_out(lambda name, source: source.get_low_stock_products(threshold))
+        merged['rows'].sort(key=lambda row: row['current_stock'])
+        return merged
+
+
+def find_same_product(connector, product: Dict) -> Optional[Dict]:
+    """
+    The product at another site: same SKU, else same name (case-insensitive)
+    One batched search for both
+    """
+    sku, name = product['sku_code'], product['name']
+    found = connector.search_products_many([sku, name])
+    for candidate in found.get(sku, []):
+        if candidate['sku_code'].lower() == sku.lower():
+            return candidate
+    for candidate in found.get(name, []):
+        if candidate['name'].lower() == name.lower():
+            return candidate
+    return None
+
+
+_sites: Optional[Sites] = None
+
+
+def get_sites(local_source: Callable) -> Optional[Sites]:
+    """
+    The configured sites, or None when INVENTORY_SITES is unset
+
+    Args:
+        local_source: Returns this worker's stock source
+    """
+    global _sites
+    if _sites is None and INVENTORY_SITES:
+        _sites = Sites(local_source, parse_sites(INVENTORY_SITES))
+        logger.info(f"🌐 Multi-site queries across {', '.join(_sites.names)}")
+    return _sites
@@ -0,0 +1,507 @@
+"""
+Shared inventory snapshot for multi-worker deployments
+One refresher builds the product catalog and stock matrix into a
+memory-mapped file; every worker maps it read-only and shares the pages
+
+File layout (native byte order):
+    header   64 bytes  magic, version, generation, built_at, counts
+    qty      float64[nnz]           stock quantity per (product, location)
+    indptr   int32[n_products + 1]  row offsets into qty / loc_idx
+    loc_idx  int32[nnz]             location index per stock entry
+    ids      int32[n_products]      product_id per row, ascending
+    catalog  utf-8 JSON             product, location and warehouse details
+
+Refreshes write a new file and os.replace() it over the old one, so
+readers either see the old or the new snapshot, never a partial one.
+
+Run the refresher standalone with:
+    python snapshot.py --interval 30
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from db_connector import raising_errors
+from metrics import DB_QUERY_SECONDS, record_cache, timed
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH')
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv('SNAPSHOT_REFRESH_SECONDS', 30))
+SNAPSHOT_CHECK_SECONDS = float(os.getenv('SNAPSHOT_CHECK_SECONDS', 1))
+# Older snapshots are not served (tools fall back to SQL), e.g. when the refresher died
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', 3 * SNAPSHOT_REFRESH_SECONDS))
+# The full stock_levels scan runs in the background and may take longer than a chat query
+SNAPSHOT_BUILD_TIMEOUT_MS = int(os.getenv('SNAPSHOT_BUILD_TIMEOUT_MS', 60000))
+
+MAGIC = b"INVSNAP1"
+VERSION = 1
+# magic, version, generation, built_at, n_products, n_locations, nnz, catalog_len
+HEADER = struct.Struct("=8sIQdIIII")
+HEADER_SIZE = 64
+
+
+# ============================================================================
+# BUILDING
+# ============================================================================
+
+def _load(connector):
+    """Products, locations, warehouses and stock rows for a snapshot"""
+    products = connector.execute_query("""
+        SELECT
+            p.product_id,
+            p.name,
+            p.sku_code,
+            p.unit_of_measure,
+            p.per_unit_cost,
+            pc.name as category_name
+        FROM products p
+        LEFT JOIN product_categories pc ON p.category_id = pc.category_id
+        ORDER BY p.product_id
+    """)
+    locations = connector.execute_query("""
+        SELECT
+            l.location_id,
+            l.name as location_name,
+            w.name as warehouse_name
+        FROM locations l
+        JOIN warehouses w ON l.warehouse_id = w.warehouse_id
+        ORDER BY l.location_id
+    """)
+    warehouses = connector.execute_query("SELECT name FROM warehouses ORDER BY name")
+    stock = connector.execute_query("""
+        SELECT product_id, location_id, quantity_on_hand
+        FROM stock_levels
+        ORDER BY product_id, location_id
+    """, timeout_ms=SNAPSHOT_BUILD_TIMEOUT_MS)
+    return products, locations, warehouses, stock
+
+
+def build_snapshot(connector, path: str, generation: int) -> Dict:
+    """
+    Load the catalog and stock matrix from the database and write a snapshot
+
+    Args:
+        connector: InventoryDBConnector to read from
+        path: Snapshot file path
+        generation: Monotonic snapshot number
+
+    Returns:
+        Counts of what was written
+    """
+    # A failed read must abort the build, not publish an empty table
+    with raising_errors():
+        products, locations, warehouses, stock = _load(connector)
+    if not products:
+        raise RuntimeError("No products loaded, not replacing snapshot")
+    if stock and not locations:
+        raise RuntimeError("Stock rows but no locations loaded, not replacing snapshot")
+
+    product_ids = [p['product_id'] for p in products]
+    location_index = {loc['location_id']: i for i, loc in enumerate(locations)}
+
+    row_of = {product_id: i for i, product_id in enumerate(product_ids)}
+    counts = [0] * len(product_ids)
+    entries = []
+    for entry in stock:
+        row = row_of.get(entry['product_id'])
+        col = location_index.get(entry['location_id'])
+        if row is None or col is None:
+            continue
+        counts[row] += 1
+        entries.append((col, float(entry['quantity_on_hand'] or 0)))
+    if stock and not entries:
+        raise RuntimeError("No stock rows matched the catalog, not replacing snapshot")
+
+    indptr = [0]
+    for count in counts:
+        indptr.append(indptr[-1] + count)
+
+    catalog = json.dumps({
+        'products': [
+            [p['product_id'], p['name'], p['sku_code'], p['unit_of_measure'],
+             float(p['per_unit_cost'] or 0), p['category_name']]
+            for p in products
+        ],
+        'locations': [
+            [loc['location_id'], loc['location_name'], loc['warehouse_name']]
+            for loc in locations
+        ],
+        'warehouses': [w['name'] for w in warehouses],
+    }, separators=(",", ":")).encode()
+
+    nnz = len(entries)
+    header = HEADER.pack(
+        MAGIC, VERSION, generation, time.time(),
+        len(product_ids), len(locations), nnz, len(catalog),
+    ).ljust(HEADER_SIZE, b"\0")
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(array("d", (qty for _, qty in entries)).tobytes())
+        f.write(array("i", indptr).tobytes())
+        f.write(array("i", (col for col, _ in entries)).tobytes())
+        f.write(array("i", product_ids).tobytes())
+        f.write(catalog)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    return {'products': len(product_ids), 'locations': len(locations), 'stock_entries': nnz}
+
+
+# ============================================================================
+# READING
+# ============================================================================
+
+class InventorySnapshot:
+    """
+    Read-only view over a mapped snapshot file
+    Offers the same read methods as InventoryDBConnector
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+
+        (magic, version, self.generation, self.built_at, n_products,
+         n_locations, nnz, catalog_len) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} inventory snapshot")
+
+        view = memoryview(self._mmap)
+        offset = HEADER_SIZE
+        self._qty = view[offset:offset + 8 * nnz].cast("d")
+        offset += 8 * nnz
+        self._indptr = view[offset:offset + 4 * (n_products + 1)].cast("i")
+        offset += 4 * (n_products + 1)
+        self._loc_idx = view[offset:offset + 4 * nnz].cast("i")
+        offset += 4 * nnz
+        self._ids = view[offset:offset + 4 * n_products].cast("i")
+        offset += 4 * n_products
+        self._catalog_bytes = view[offset:offset + catalog_len]
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+
+    def _load_catalog(self) -> Dict:
+        """Decode catalog details once per snapshot generation"""
+        if self._catalog is None:
+            with self._catalog_lock:
+                if self._catalog is None:
+                    raw = json.loads(bytes(self._catalog_bytes))
+                    products = [
+                        {
+                            'product_id': p[0],
+                            'name': p[1],
+                            'sku_code': p[2],
+                            'unit_of_measure': p[3],
+                            'per_unit_cost': p[4],
+                            'category_name': p[5],
+                        }
+                        for p in raw['products']
+                    ]
+                    self._catalog = {
+                        'products': products,
+                        'by_name': sorted(products, key=lambda p: p['name']),
+                        'locations': raw['locations'],
+                        'warehouses': raw['warehouses'],
+                    }
+        return self._catalog
+
+    def _row(self, product_id: int) -> Optional[int]:
+        row = bisect_left(self._ids, product_id)
+        if row < len(self._ids) and self._ids[row] == product_id:
+            return row
+        return None
+
+    def _row_total(self, row: int) -> float:
+        return sum(self._qty[self._indptr[row]:self._indptr[row + 1]])
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_all_products")
+    def get_all_products(self) -> List[Dict]:
+        return list(self._load_catalog()['by_name'])
+
+    @timed(DB_QUERY_SECONDS, "snapshot.search_products")
+    def search_products(self, search_term: str) -> List[Dict]:
+        term = search_term.lower()
+        matches = []
+        for product in self._load_catalog()['by_name']:
+            if term in product['name'].lower() or term in product['sku_code'].lower():
+                matches.append(product)
+                if len(matches) == 10:
+                    break
+        return matches
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_product_stock_level")
+    def get_product_stock_level(self, product_id: int) -> Optional[Dict]:
+        row = self._row(product_id)
+        if row is None:
+            return None
+        product = self._load_catalog()['products'][row]
+        total = self._row_total(row)
+        return {
+            'product_id': product_id,
+            'name': product['name'],
+            'sku_code': product['sku_code'],
+            'unit_of_measure': product['unit_of_measure'],
+            'total_stock': total,
+            'total_value': total * product['per_unit_cost'],
+        }
+
+    @timed(DB_QUERY_SECONDS, "snapshot.search_products_many")
+    def search_products_many(self, search_terms: List[str]) -> Dict[str, List[Dict]]:
+        return {term: self.search_products(term) for term in search_terms}
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_product_stock_levels")
+    def get_product_stock_levels(self, product_ids: List[int]) -> Dict[int, Dict]:
+        levels = {}
+        for product_id in product_ids:
+            stock = self.get_product_stock_level(product_id)
+            if stock is not None:
+                levels[product_id] = stock
+        return levels
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_product_stock_by_warehouse")
+    def get_product_stock_by_warehouse(self, product_id: int) -> List[Dict]:
+        row = self._row(product_id)
+        if row is None:
+            return []
+        catalog = self._load_catalog()
+        unit = catalog['products'][row]['unit_of_measure']
+        results = []
+        for i in range(self._indptr[row], self._indptr[row + 1]):
+            _, location_name, warehouse_name = catalog['locations'][self._loc_idx[i]]
+            results.append({
+                'warehouse_name': warehouse_name,
+                'location_name': location_name,
+                'quantity': self._qty[i],
+                'unit_of_measure': unit,
+            })
+        results.sort(key=lambda r: (r['warehouse_name'], r['location_name']))
+        return results
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_low_stock_products")
+    def get_low_stock_products(self, threshold: int = 50) -> List[Dict]:
+        results = []
+        for row, product in enumerate(self._load_catalog()['products']):
+            total = self._row_total(row)
+            if total < threshold:
+                results.append({
+                    'product_id': product['product_id'],
+                    'name': product['name'],
+                    'sku_code': product['sku_code'],
+                    'current_stock': total,
+                    'threshold': threshold,
+                })
+        results.sort(key=lambda r: r['current_stock'])
+        return results
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_warehouse_inventory_summary")
+    def get_warehouse_inventory_summary(self) -> List[Dict]:
+        catalog = self._load_catalog()
+        summary = {
+            name: {'warehouse_name': name, 'products': set(), 'total_units': 0.0, 'total_value': 0.0}
+            for name in catalog['warehouses']
+        }
+        for row, product in enumerate(catalog['products']):
+            for i in range(self._indptr[row], self._indptr[row + 1]):
+                entry = summary[catalog['locations'][self._loc_idx[i]][2]]
+                entry['products'].add(product['product_id'])
+                entry['total_units'] += self._qty[i]
+                entry['total_value'] += self._qty[i] * product['per_unit_cost']
+        results = []
+        for name in sorted(summary):
+            entry = summary[name]
+            entry['total_products'] = len(entry.pop('products'))
+            results.append(entry)
+        return results
+
+    @timed(DB_QUERY_SECONDS, "snapshot.get_statistics")
+    def get_statistics(self, exact: bool = False) -> Dict:
+        # Counted in memory, so always exact
+        catalog = self._load_catalog()
+        return {
+            'total_products': len(catalog['products']),
+            'total_stock_units': sum(self._qty),
+            'total_warehouses': len(catalog['warehouses']),
+            'approximate': False,
+            'margins': {},
+        }
+
+
+# ============================================================================
+# SHARING BETWEEN WORKERS
+# ============================================================================
+
+_snapshot: Optional[InventorySnapshot] = None
+_last_check = 0.0
+_swap_lock = threading.Lock()
+# Connector of a worker that lost the refresher election, to take over with
+_standby_connector = None
+
+
+def get_snapshot() -> Optional[InventorySnapshot]:
+    """
+    Get the current shared snapshot, remapping it if the refresher swapped in a new file
+
+    Each check also retries the refresher lock, so another worker takes over
+    when the refresher dies.
+
+    Returns:
+        InventorySnapshot, or None if SNAPSHOT_PATH is unset, no snapshot
+        exists yet, or it is older than SNAPSHOT_MAX_AGE_SECONDS
+    """
+    global _snapshot, _last_check
+    if not SNAPSHOT_PATH:
+        return None
+
+    now = time.monotonic()
+    if now - _last_check >= SNAPSHOT_CHECK_SECONDS:
+        with _swap_lock:
+            if now - _last_check >= SNAPSHOT_CHECK_SECONDS:
+                _last_check = now
+                _snapshot = _remap_if_changed(_snapshot)
+                if _standby_connector is not None:
+                    start_refresher_if_elected(_standby_connector)
+
+    snapshot = _snapshot
+    if snapshot is not None and time.time() - snapshot.built_at > SNAPSHOT_MAX_AGE_SECONDS:
+        snapshot = None
+    record_cache("snapshot", snapshot is not None)
+    return snapshot
+
+
+def _remap_if_changed(current: Optional[InventorySnapshot]) -> Optional[InventorySnapshot]:
+    try:
+        stat = os.stat(SNAPSHOT_PATH)
+    except FileNotFoundError:
+        return current
+    if current is not None and current.file_id == (stat.st_ino, stat.st_mtime_ns):
+        return current
+    try:
+        snapshot = InventorySnapshot(SNAPSHOT_PATH)
+        logger.info(f"🗺️ Mapped inventory snapshot generation {snapshot.generation}")
+        return snapshot
+    except (OSError, ValueError, struct.error) as e:
+        logger.error(f"❌ Could not map inventory snapshot: {e}")
+        return current
+
+
+def refresh_loop(connector, path: str, interval: float, stop: threading.Event = None):
+    """
+    Rebuild the snapshot every interval seconds until stopped
+
+    Args:
+        connector: InventoryDBConnector to read from
+        path: Snapshot file path
+        interval: Seconds between refreshes
+        stop: Event that ends the loop when set
+    """
+    stop = stop or threading.Event()
+    generation = int(time.time())
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            counts = build_snapshot(connector, path, generation)
+            logger.info(
+                f"🗺️ Snapshot generation {generation} written in "
+                f"{(time.perf_counter() - start) * 1000:.0f} ms: {counts}"
+            )
+            generation += 1
+        except Exception as e:
+            logger.error(f"❌ Snapshot refresh failed: {e}")
+        stop.wait(interval)
+
+
+_refresher_lock_file = None
+
+
+def acquire_refresher_lock() -> bool:
+    """
+    Take the exclusive refresher lock on SNAPSHOT_PATH + '.lock'
+
+    The lock is held for the life of the process, so exactly one worker
+    (or the standalone refresher) rebuilds the snapshot.
+
+    Returns:
+        True if this process now holds the lock
+    """
+    global _refresher_lock_file
+    if _refresher_lock_file is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        logger.warning("⚠️ No fcntl on this platform, run 'python snapshot.py' as the refresher")
+        return False
+
+    lock_file = open(f"{SNAPSHOT_PATH}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _refresher_lock_file = lock_file
+    return True
+
+
+def start_refresher_if_elected(connector) -> bool:
+    """
+    Start the refresher thread if this process wins the refresher lock
+
+    Args:
+        connector: InventoryDBConnector to read from
+
+    Returns:
+        True if this process became the refresher
+    """
+    global _standby_connector
+    if not SNAPSHOT_PATH:
+        return False
+    if not acquire_refresher_lock():
+        _standby_connector = connector
+        return False
+    _standby_connector = None
+
+    threading.Thread(
+        target=refresh_loop,
+        args=(connector, SNAPSHOT_PATH, SNAPSHOT_REFRESH_SECONDS),
+        name="snapshot-refresher",
+        daemon=True,
+    ).start()
+    logger.info(f"🗺️ This worker (pid {os.getpid()}) refreshes the inventory snapshot")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_connector import get_connector
+
+    parser = argparse.ArgumentParser(description="Refresh the shared inventory snapshot")
+    parser.add_argument("--interval", type=float, default=SNAPSHOT_REFRESH_SECONDS)
+    parser.add_argument("--once", action="store_true", help="build one snapshot and exit")
+    args = parser.parse_args()
+    if not SNAPSHOT_PATH:
+        parser.error("set SNAPSHOT_PATH")
+    args.path = SNAPSHOT_PATH
+
+    if args.once:
+        print(build_snapshot(get_connector(), args.path, int(time.time())))
+    elif acquire_refresher_lock():
+        refresh_loop(get_connector(), args.path, args.interval)
+    else:
+        parser.exit(1, "Another process already refreshes this snapshot\n")
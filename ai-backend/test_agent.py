@@ -36,6 +36,23 @@ TEST_QUERIES = [
     # Product discovery
     "What products do we have?",
     "List all products in inventory",
+    
+    # Forecasts
+    "What will we run out of next week?",
+    "When will blue pens run out?",
+    "Rebalance blue pens between locations",
+    
+    # Compound questions (several tools in one query)
+    "How much aluminum do we have and where is it stored?",
+    "Show me low stock items and the warehouse summary",
+]
+
+# Follow-up questions sent in one session (the later ones name no product)
+TEST_CONVERSATION = [
+    "How much aluminum do we have?",
+    "And where is it stored?",
+    "Show me its movements in the last 30 days",
+    "What else is in that warehouse?",
 ]
 
 
@@ -89,6 +106,33 @@ def test_query(query: str):
         return False
 
 
+def test_conversation(queries: list):
+    """Send queries as one conversation, passing back the session_id"""
+    print("\n" + "="*60)
+    print("💬 Testing Follow-up Conversation")
+    print("="*60)
+    
+    session_id = None
+    for query in queries:
+        print(f"\n📝 Query: {query}")
+        try:
+            params = {"query": query}
+            if session_id:
+                params["session_id"] = session_id
+            response = requests.post(QUERY_URL, params=params, timeout=30)
+            if response.status_code != 200:
+                print(f"❌ Error: {response.status_code}")
+                return False
+            data = response.json()
+            session_id = data.get("session_id")
+            print(f"🔧 Tools: {', '.join(data.get('tools_used', []))}")
+            print(f"\n{data.get('response', 'No response')}\n")
+        except Exception as e:
+            print(f"❌ Error: {str(e)}")
+            return False
+    return True
+
+
 def main():
     """Run all tests"""
     print("\n" + "="*60)
@@ -119,6 +163,8 @@ def main():
         # Small delay between requests
         sleep(0.5)
     
+    conversation_ok = test_conversation(TEST_CONVERSATION)
+    
     # Print summary
     print("\n" + "="*60)
     print("📊 Test Summary")
@@ -126,6 +172,7 @@ def main():
     print(f"✅ Passed: {passed}")
     print(f"❌ Failed: {failed}")
     print(f"📈 Total: {len(TEST_QUERIES)}")
+    print(f"💬 Conversation: {'✅ passed' if conversation_ok else '❌ failed'}")
     
     # Print additional info
     print("\n" + "="*60)
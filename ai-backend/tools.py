@@ -3,10 +3,19 @@ Tool functions for the LangChain AI agent
 These functions use fuzzy matching to handle product name variations
 """
 
+from columnar import get_columnar
 from db_connector import get_connector
+from forecasting import FORECAST_HORIZON_DAYS, get_forecast
+from metrics import STAGE_SECONDS, timed
+from rebalancing import propose_transfers
+from singleflight import SingleFlight, coalesced
+from sites import get_sites
+from snapshot import get_snapshot
 from typing import Optional
+from datetime import datetime, timedelta
 from difflib import SequenceMatcher
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +32,7 @@ class FuzzyMatcher:
         return SequenceMatcher(None, a.lower(), b.lower()).ratio()
     
     @staticmethod
+    @timed(STAGE_SECONDS, "fuzzy_match")
     def find_best_match(search_term: str, candidates: list, 
                        threshold: float = 0.6) -> Optional[dict]:
         """
@@ -51,198 +61,933 @@ class FuzzyMatcher:
         return best_match
 
 
-# Tool Functions for LangChain
+def get_stock_source():
+    """
+    Where tools read catalog and stock data from
+    The shared snapshot when one is mapped (SNAPSHOT_PATH), otherwise the database
+    """
+    snapshot = get_snapshot()
+    return snapshot if snapshot is not None else get_connector()
 
-def query_product_stock(product_name: str) -> str:
+
+def _site_fields(merged: dict) -> dict:
+    """Per-site report of a fanned-out query, for the result"""
+    return {
+        'sites': merged['sites'],
+        'failed_sites': [site for site in merged['sites'] if site['status'] != 'ok'],
+    }
+
+
+def _partial_note(failed_sites: list) -> str:
+    """Line naming the sites missing from a fanned-out answer, or "" if none"""
+    if not failed_sites:
+        return ""
+    missing = ", ".join(f"{site['site']} ({site['error']})" for site in failed_sites)
+    return f"⚠️ Partial results, no answer from: {missing}"
+
+
+def _product_key(product_name: str) -> str:
+    """Coalescing key for product lookups: names differing only in case or spacing match"""
+    return " ".join(str(product_name).lower().split())
+
+
+def _lookup_key(product_name: str, product: dict = None):
+    """Coalescing key for tools that take a name or an already resolved product"""
+    return ("id", product['product_id']) if product else _product_key(product_name)
+
+
+# ============================================================================
+# STRUCTURED TOOL RESULTS
+# ============================================================================
+
+# Concurrent identical tool calls share one execution (see singleflight.py).
+# Results are shared between callers and must not be mutated.
+
+def tool_result(tool: str, status: str = "ok", message: str = None, **data) -> dict:
     """
-    Query the total stock level of a product
-    Handles fuzzy matching for product names
+    Build a structured tool result
     
-    Example queries:
-    - "How much Aluminium do we have?"
-    - "What's the stock of aluminum?"
-    - "Show me alumminum inventory"
+    Args:
+        tool: Tool name the result belongs to
+        status: "ok", or why there are no rows ("not_found", "empty", "invalid", "error")
+        message: Ready-to-show text for non-ok results
+        data: Rows and other fields of the result
+        
+    Returns:
+        Result dict, rendered to text only when needed
+    """
+    result = {"tool": tool, "status": status}
+    if message is not None:
+        result["message"] = message
+    result.update(data)
+    return result
+
+
+def resolve_product(connector, product_name: str) -> Optional[dict]:
+    """
+    Find the product that best matches a name
     
     Args:
+        connector: Stock source to search
         product_name: Product name (case-insensitive, handles typos)
         
     Returns:
-        Formatted string with stock information
+        Best matching product or None if nothing matches
     """
-    try:
-        connector = get_connector()
-        
-        # Search for products matching the name
-        search_results = connector.search_products(product_name)
+    # Search for products matching the name
+    search_results = connector.search_products(product_name)
+    
+    if not search_results:
+        return None
+    
+    # Use fuzzy matcher to find best match, or the first result if none is close
+    return FuzzyMatcher.find_best_match(
+        product_name, 
+        search_results,
+        threshold=0.4
+    ) or search_results[0]
+
+
+def resolve_products(connector, product_names: list) -> dict:
+    """
+    Find the best matching product for several names with one batched search
+    
+    Args:
+        connector: Stock source to search
+        product_names: Product names (case-insensitive, handles typos)
         
-        if not search_results:
-            return f"❌ Product '{product_name}' not found in inventory. Please check the spelling and try again."
+    Returns:
+        Best matching product (or None) for each name
+    """
+    search_results = connector.search_products_many(product_names)
+    return {
+        name: (FuzzyMatcher.find_best_match(name, matches, threshold=0.4) or matches[0])
+        if matches else None
+        for name, matches in search_results.items()
+    }
+
+
+@coalesced(SingleFlight("product_stock"), _lookup_key)
+def product_stock_data(product_name: str, product: dict = None) -> dict:
+    """
+    Total stock level of a product, as a structured result
+    
+    Args:
+        product_name: Product name (case-insensitive, handles typos)
+        product: Product already resolved earlier in the session (skips the search)
         
-        # Use fuzzy matcher to find best match
-        best_product = FuzzyMatcher.find_best_match(
-            product_name, 
-            search_results,
-            threshold=0.4
-        )
+    Returns:
+        Result with the matched product and its stock totals
+    """
+    tool = "product_stock"
+    try:
+        connector = get_stock_source()
         
+        best_product = product or resolve_product(connector, product_name)
         if not best_product:
-            # If no fuzzy match but results exist, use first result
-            best_product = search_results[0]
+            return tool_result(tool, "not_found", f"❌ Product '{product_name}' not found in inventory. Please check the spelling and try again.")
         
         # Get detailed stock information
         stock_info = connector.get_product_stock_level(best_product['product_id'])
         
         if not stock_info:
-            return f"⚠️ Product '{best_product['name']}' has no stock information recorded."
-        
-        return f"""
-📦 Stock Information for: {best_product['name']}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-SKU Code: {best_product['sku_code']}
-Total Stock: {stock_info['total_stock']} {best_product['unit_of_measure']}
-Total Value: ${stock_info['total_value']:,.2f}
-        """
+            return tool_result(tool, "empty", f"⚠️ Product '{best_product['name']}' has no stock information recorded.")
+        
+        return tool_result(
+            tool,
+            product=_product_fields(best_product),
+            total_stock=stock_info['total_stock'],
+            total_value=stock_info['total_value'],
+        )
     
     except Exception as e:
         logger.error(f"Error querying product stock: {e}")
-        return f"❌ Error retrieving stock information: {str(e)}"
+        return tool_result(tool, "error", f"❌ Error retrieving stock information: {str(e)}")
 
 
-def query_product_by_warehouse(product_name: str) -> str:
+# Upper bound on the products one multi_product_stock call looks up
+MAX_BATCH_PRODUCTS = 20
+
+
+@coalesced(
+    SingleFlight("multi_product_stock"),
+    lambda product_names: tuple(_product_key(name) for name in product_names)
+)
+def multi_product_stock_data(product_names: list) -> dict:
     """
-    Query stock levels of a product broken down by warehouse and location
-    Useful for logistics and fulfillment questions
+    Total stock of several products, as one table-shaped result
+    Names are resolved and their stock summed in two batched lookups,
+    however many products are asked about
     
-    Example queries:
-    - "Where is the aluminium stored?"
-    - "Show me alumminum in all warehouses"
-    - "Which warehouse has aluminum?"
+    Args:
+        product_names: Product names (case-insensitive, handles typos)
+        
+    Returns:
+        Result with one row per matched product, the names not found and
+        the names skipped beyond MAX_BATCH_PRODUCTS
+    """
+    tool = "multi_product_stock"
+    try:
+        connector = get_stock_source()
+        
+        names = []
+        for name in product_names:
+            if name and _product_key(name) not in map(_product_key, names):
+                names.append(name)
+        names, skipped = names[:MAX_BATCH_PRODUCTS], names[MAX_BATCH_PRODUCTS:]
+        if skipped:
+            logger.warning(f"⚠️ Stock asked for {len(names) + len(skipped)} products, skipping {len(skipped)} beyond {MAX_BATCH_PRODUCTS}")
+        
+        matches = resolve_products(connector, names)
+        product_ids = list(dict.fromkeys(
+            product['product_id'] for product in matches.values() if product
+        ))
+        levels = connector.get_product_stock_levels(product_ids)
+        
+        rows, seen, not_found = [], set(), []
+        for name in names:
+            product = matches.get(name)
+            stock = levels.get(product['product_id']) if product else None
+            if stock is None:
+                not_found.append(name)
+                continue
+            if product['product_id'] in seen:
+                continue
+            seen.add(product['product_id'])
+            rows.append({
+                **_product_fields(product),
+                'query': name,
+                'total_stock': stock['total_stock'],
+                'total_value': stock['total_value'],
+            })
+        
+        if not rows:
+            message = f"❌ None of these products were found in inventory: {', '.join(names)}."
+            if skipped:
+                message += f"\n{_skipped_note(skipped)}"
+            return tool_result(tool, "not_found", message, skipped=skipped)
+        
+        return tool_result(
+            tool,
+            rows=rows,
+            not_found=not_found,
+            skipped=skipped,
+            total_value=sum(row['total_value'] for row in rows),
+        )
+    
+    except Exception as e:
+        logger.error(f"Error querying stock of several products: {e}")
+        return tool_result(tool, "error", f"❌ Error retrieving stock information: {str(e)}")
+
+
+@coalesced(SingleFlight("product_location"), _lookup_key)
+def product_by_warehouse_data(product_name: str, product: dict = None) -> dict:
+    """
+    Stock of a product per warehouse and location, as a structured result
     
     Args:
         product_name: Product name (fuzzy matched)
+        product: Product already resolved earlier in the session (skips the search)
         
     Returns:
-        Formatted string with warehouse breakdown
+        Result with the matched product and one row per location
     """
+    tool = "product_location"
     try:
-        connector = get_connector()
-        
-        # Find the product
-        search_results = connector.search_products(product_name)
-        if not search_results:
-            return f"❌ Product '{product_name}' not found in inventory."
-        
-        best_product = FuzzyMatcher.find_best_match(
-            product_name,
-            search_results,
-            threshold=0.4
-        ) or search_results[0]
-        
-        # Get warehouse breakdown
-        warehouse_stock = connector.get_product_stock_by_warehouse(
-            best_product['product_id']
-        )
+        connector = get_stock_source()
         
-        if not warehouse_stock:
-            return f"⚠️ Product '{best_product['name']}' has no warehouse stock information."
+        best_product = product or resolve_product(connector, product_name)
+        if not best_product:
+            return tool_result(tool, "not_found", f"❌ Product '{product_name}' not found in inventory.")
         
-        result = f"🏭 {best_product['name']} - Warehouse Locations\n"
-        result += "━" * 60 + "\n"
+        # Get warehouse breakdown (from every site when several are configured)
+        sites, site_fields = get_sites(get_stock_source), {}
+        if sites:
+            merged = sites.get_product_stock_by_warehouse(best_product)
+            warehouse_stock, site_fields = merged['rows'], _site_fields(merged)
+        else:
+            warehouse_stock = connector.get_product_stock_by_warehouse(
+                best_product['product_id']
+            )
         
-        for stock in warehouse_stock:
-            result += f"📍 {stock['warehouse_name']} → {stock['location_name']}\n"
-            result += f"   Quantity: {stock['quantity']} {stock['unit_of_measure']}\n"
+        if not warehouse_stock:
+            message = f"⚠️ Product '{best_product['name']}' has no warehouse stock information."
+            note = _partial_note(site_fields.get('failed_sites'))
+            return tool_result(tool, "empty", f"{message}\n{note}" if note else message, **site_fields)
         
-        return result
+        return tool_result(tool, product=_product_fields(best_product), rows=warehouse_stock, **site_fields)
     
     except Exception as e:
         logger.error(f"Error querying warehouse stock: {e}")
-        return f"❌ Error retrieving warehouse information: {str(e)}"
+        return tool_result(tool, "error", f"❌ Error retrieving warehouse information: {str(e)}")
 
 
-def query_low_stock_products(threshold: int = 50) -> str:
+@coalesced(SingleFlight("low_stock"), lambda threshold=50: threshold)
+def low_stock_products_data(threshold: int = 50) -> dict:
     """
-    Query products that have stock below a certain threshold
-    Useful for inventory management and reordering
-    
-    Example queries:
-    - "What products are running low on stock?"
-    - "Show me products with less than 50 units"
-    - "Which items need reordering?"
+    Products with stock below a threshold, as a structured result
     
     Args:
         threshold: Stock level threshold (default: 50 units)
         
     Returns:
-        Formatted string with low stock products
+        Result with one row per low stock product
     """
+    tool = "low_stock"
     try:
-        connector = get_connector()
+        connector = get_stock_source()
         
-        low_stock = connector.get_low_stock_products(threshold)
+        sites, site_fields = get_sites(get_stock_source), {}
+        if sites:
+            merged = sites.get_low_stock_products(threshold)
+            low_stock, site_fields = merged['rows'], _site_fields(merged)
+        else:
+            low_stock = connector.get_low_stock_products(threshold)
         
         if not low_stock:
-            return f"✅ All products have stock above {threshold} units threshold."
+            message = f"✅ All products have stock above {threshold} units threshold."
+            note = _partial_note(site_fields.get('failed_sites'))
+            return tool_result(tool, "empty", f"{message}\n{note}" if note else message, threshold=threshold, rows=[], **site_fields)
         
-        result = f"⚠️ Low Stock Alert - Products Below {threshold} Units\n"
-        result += "━" * 60 + "\n"
+        return tool_result(tool, threshold=threshold, rows=low_stock, **site_fields)
+    
+    except Exception as e:
+        logger.error(f"Error querying low stock products: {e}")
+        return tool_result(tool, "error", f"❌ Error retrieving low stock information: {str(e)}")
+
+
+@coalesced(SingleFlight("warehouse_summary"))
+def warehouse_summary_data() -> dict:
+    """
+    Inventory totals per warehouse, as a structured result
+    
+    Returns:
+        Result with one row per warehouse plus grand totals
+    """
+    tool = "warehouse_summary"
+    try:
+        connector = get_stock_source()
         
-        for product in low_stock:
-            result += f"🔴 {product['name']} (SKU: {product['sku_code']})\n"
-            result += f"   Current Stock: {product['current_stock']} units\n"
-            result += f"   Status: CRITICAL - Reorder needed!\n\n"
+        sites, site_fields = get_sites(get_stock_source), {}
+        if sites:
+            merged = sites.get_warehouse_inventory_summary()
+            warehouses, site_fields = merged['rows'], _site_fields(merged)
+        else:
+            warehouses = connector.get_warehouse_inventory_summary()
         
+        if not warehouses:
+            message = "⚠️ No warehouse information available."
+            note = _partial_note(site_fields.get('failed_sites'))
+            return tool_result(tool, "empty", f"{message}\n{note}" if note else message, rows=[], **site_fields)
+        
+        return tool_result(
+            tool,
+            rows=warehouses,
+            total_units=sum(w['total_units'] for w in warehouses),
+            total_value=sum(w['total_value'] for w in warehouses),
+            **site_fields,
+        )
+    
+    except Exception as e:
+        logger.error(f"Error querying warehouse summary: {e}")
+        return tool_result(tool, "error", f"❌ Error retrieving warehouse summary: {str(e)}")
+
+
+def single_warehouse_data(warehouse_name: str) -> dict:
+    """
+    Inventory totals of one warehouse, as a warehouse_summary result
+    Filters the shared summary, so it rides on the same coalesced query
+
+    Args:
+        warehouse_name: Name of the warehouse (case-insensitive)
+
+    Returns:
+        Result with the warehouse's row(s) and their totals
+    """
+    result = warehouse_summary_data()
+    if result["status"] != "ok":
         return result
+
+    rows = [w for w in result['rows'] if w['warehouse_name'].lower() == warehouse_name.lower()]
+    if not rows:
+        return tool_result(result["tool"], "not_found", f"❌ Warehouse '{warehouse_name}' not found.", rows=[])
+    return {
+        **result,
+        "rows": rows,
+        "total_units": sum(w['total_units'] for w in rows),
+        "total_value": sum(w['total_value'] for w in rows),
+    }
+
+
+@coalesced(SingleFlight("general_stats"), lambda exact=False: exact)
+def general_statistics_data(exact: bool = False) -> dict:
+    """
+    General inventory statistics, as a structured result
+    
+    Args:
+        exact: Count over the full tables instead of estimating large ones
+        
+    Returns:
+        Result with product, stock unit and warehouse totals, and the error
+        margins of estimated totals
+    """
+    tool = "general_stats"
+    try:
+        connector = get_stock_source()
+        
+        if exact:
+            return tool_result(tool, **connector.get_statistics(exact=True))
+        return tool_result(tool, **connector.get_statistics())
     
     except Exception as e:
-        logger.error(f"Error querying low stock products: {e}")
-        return f"❌ Error retrieving low stock information: {str(e)}"
+        logger.error(f"Error querying statistics: {e}")
+        return tool_result(tool, "error", f"❌ Error retrieving statistics: {str(e)}")
 
 
-def query_warehouse_summary() -> str:
+@coalesced(SingleFlight("list_products"))
+def all_products_data() -> dict:
     """
-    Query inventory summary across all warehouses
-    Provides overview of inventory distribution
+    All products in the inventory, as a structured result
     
-    Example queries:
-    - "Show me warehouse inventory summary"
-    - "How much inventory do we have in each warehouse?"
-    - "Total inventory overview"
+    Returns:
+        Result with one row per product
+    """
+    tool = "list_products"
+    try:
+        connector = get_stock_source()
+        
+        products = connector.get_all_products()
+        
+        if not products:
+            return tool_result(tool, "empty", "⚠️ No products found in inventory.", rows=[])
+        
+        return tool_result(tool, rows=products)
+    
+    except Exception as e:
+        logger.error(f"Error listing products: {e}")
+        return tool_result(tool, "error", f"❌ Error retrieving products: {str(e)}")
+
+
+# Analytical tools read the embedded columnar store (columnar.py), not Postgres
+
+COLUMNAR_LOADING = "⏳ The analytics store is still loading. Please try again in a minute."
+
+
+@coalesced(SingleFlight("value_breakdown"))
+def value_breakdown_data() -> dict:
+    """
+    Inventory value per product category and warehouse, as a structured result
     
     Returns:
-        Formatted string with warehouse summaries
+        Result with one row per (category, warehouse), largest value first
     """
+    tool = "value_breakdown"
     try:
-        connector = get_connector()
+        store = get_columnar()
+        if store is None:
+            return tool_result(tool, "unavailable", COLUMNAR_LOADING)
         
-        warehouses = connector.get_warehouse_inventory_summary()
+        rows = store.value_by_category_warehouse()
         
-        if not warehouses:
-            return "⚠️ No warehouse information available."
+        if not rows:
+            return tool_result(tool, "empty", "⚠️ No stock recorded in any warehouse.", rows=[])
         
-        result = "🏢 Warehouse Inventory Summary\n"
-        result += "━" * 60 + "\n"
+        return tool_result(
+            tool,
+            rows=rows,
+            total_units=sum(r['total_units'] for r in rows),
+            total_value=sum(r['total_value'] for r in rows),
+            as_of=store.built_at,
+        )
+    
+    except Exception as e:
+        logger.error(f"Error computing value breakdown: {e}")
+        return tool_result(tool, "error", f"❌ Error computing inventory value: {str(e)}")
+
+
+@coalesced(SingleFlight("movement_history"), lambda product_name=None, days=30, product=None: (
+    _lookup_key(product_name, product) if product_name or product else None, days
+))
+def movement_history_data(product_name: str = None, days: int = 30, product: dict = None) -> dict:
+    """
+    Stock movements over recent days, overall or for one product, as a structured result
+    
+    Args:
+        product_name: Limit to this product (fuzzy matched), or None for all products
+        days: Length of the window in days
+        product: Product already resolved earlier in the session (skips the search)
         
-        total_units = 0
-        total_value = 0
+    Returns:
+        Result with totals per move type and the most moved products
+    """
+    tool = "movement_history"
+    try:
+        if product is None and product_name:
+            product = resolve_product(get_stock_source(), product_name)
+            if not product:
+                return tool_result(tool, "not_found", f"❌ Product '{product_name}' not found in inventory.")
+        product_id = product['product_id'] if product else None
         
-        for warehouse in warehouses:
-            result += f"📦 {warehouse['warehouse_name']}\n"
-            result += f"   Total Products: {warehouse['total_products']}\n"
-            result += f"   Total Units: {warehouse['total_units']}\n"
-            result += f"   Total Value: ${warehouse['total_value']:,.2f}\n\n"
-            
-            total_units += warehouse['total_units']
-            total_value += warehouse['total_value']
+        end = datetime.now()
+        start = end - timedelta(days=days)
+        store = get_columnar()
+        if store is not None:
+            # The store still holds moves of partitions archived since they were
+            # copied; leave them out, as Postgres does
+            archived = get_connector().get_archived_ranges(start, end)
+            summary = store.movement_summary(days, product_id, exclude=[
+                (int(row['range_start'].timestamp()), int(row['range_end'].timestamp()))
+                for row in archived
+            ])
+            summary['archived'] = archived
+            as_of = store.built_at
+        else:
+            # Until the analytics store is loaded, ask Postgres; the time bounds
+            # keep the scan to the partitions of the last few months
+            summary = get_connector().get_movement_summary(start, end, product_id)
+            summary['days'] = days
+            as_of = time.time()
+        summary['archived'] = [
+            {'month': row['range_start'].strftime("%Y-%m"), 'moves': row['row_count']}
+            for row in summary['archived']
+        ]
         
-        result += "━" * 60 + "\n"
-        result += f"📊 TOTAL: {total_units} units | ${total_value:,.2f} value\n"
+        if not summary['total_moves']:
+            subject = f" for {product['name']}" if product else ""
+            message = f"ℹ️ No stock movements{subject} in the last {days} days."
+            if summary['archived']:
+                message += "\n" + _archived_note(summary['archived'])
+            return tool_result(tool, "empty", message, **summary)
         
-        return result
+        return tool_result(
+            tool,
+            product=_product_fields(product) if product else None,
+            as_of=as_of,
+            **summary,
+        )
     
     except Exception as e:
-        logger.error(f"Error querying warehouse summary: {e}")
-        return f"❌ Error retrieving warehouse summary: {str(e)}"
+        logger.error(f"Error querying movement history: {e}")
+        return tool_result(tool, "error", f"❌ Error retrieving movement history: {str(e)}")
+
+
+@coalesced(SingleFlight("stockout_forecast"), lambda product_name=None, days=None, product=None: (
+    _lookup_key(product_name, product) if product_name or product else None, days
+))
+def stockout_forecast_data(product_name: str = None, days: int = None, product: dict = None) -> dict:
+    """
+    Projected stock-outs from forecast daily demand, as a structured result
+    
+    Args:
+        product_name: Forecast for this product (fuzzy matched), or None for
+            every product running out within the horizon
+        days: Horizon in days (default FORECAST_HORIZON_DAYS)
+        product: Product already resolved earlier in the session (skips the search)
+        
+    Returns:
+        Result with one row per product: stock, daily demand and stock-out date
+    """
+    tool = "stockout_forecast"
+    days = days or FORECAST_HORIZON_DAYS
+    try:
+        if product is None and product_name:
+            product = resolve_product(get_stock_source(), product_name)
+            if not product:
+                return tool_result(tool, "not_found", f"❌ Product '{product_name}' not found in inventory.")
+        
+        forecast = get_forecast()
+        if product:
+            row = forecast.for_product(product['product_id'])
+            if row is None:
+                return tool_result(tool, "empty", f"⚠️ No forecast for '{product['name']}' yet.")
+            rows = [row]
+        else:
+            rows = forecast.stockouts(days)
+            if not rows:
+                return tool_result(tool, "empty", f"✅ No products are projected to run out in the next {days} days.")
+        
+        return tool_result(
+            tool,
+            product=_product_fields(product) if product else None,
+            days=days,
+            rows=rows,
+            source=forecast.source,
+            as_of=forecast.built_at.timestamp(),
+        )
+    
+    except Exception as e:
+        logger.error(f"Error forecasting stock-outs: {e}")
+        return tool_result(tool, "error", f"❌ Error forecasting stock-outs: {str(e)}")
+
+
+@coalesced(SingleFlight("rebalance"), lambda product_name=None, product=None: (
+    _lookup_key(product_name, product) if product_name or product else None
+))
+def rebalance_transfers_data(product_name: str = None, product: dict = None) -> dict:
+    """
+    Internal transfers that would bring short locations back to their minimum
+    with stock other locations hold above theirs, as a structured result
+    
+    Args:
+        product_name: Rebalance this product only (fuzzy matched), or None for all
+        product: Product already resolved earlier in the session (skips the search)
+        
+    Returns:
+        Result with one row per proposed transfer line, largest first
+    """
+    tool = "rebalance"
+    try:
+        if product is None and product_name:
+            product = resolve_product(get_stock_source(), product_name)
+            if not product:
+                return tool_result(tool, "not_found", f"❌ Product '{product_name}' not found in inventory.")
+        
+        proposal = propose_transfers(product['product_id'] if product else None)
+        if not proposal['lines'] and not proposal['unmet']:
+            subject = f"{product['name']} is" if product else "All locations are"
+            return tool_result(tool, "empty", f"✅ {subject} at or above minimum stock, no transfers needed.")
+        
+        return tool_result(
+            tool,
+            product=_product_fields(product) if product else None,
+            rows=proposal['lines'],
+            unmet=proposal['unmet'],
+            total_lines=proposal['total_lines'],
+            total_units=proposal['total_units'],
+            cross_warehouse_lines=proposal['cross_warehouse_lines'],
+        )
+    
+    except Exception as e:
+        logger.error(f"Error planning stock rebalancing: {e}")
+        return tool_result(tool, "error", f"❌ Error planning stock rebalancing: {str(e)}")
+
+
+def _product_fields(product: dict) -> dict:
+    return {
+        'product_id': product['product_id'],
+        'name': product['name'],
+        'sku_code': product['sku_code'],
+        'unit_of_measure': product['unit_of_measure'],
+    }
+
+
+# ============================================================================
+# TEXT RENDERING
+# ============================================================================
+
+RULE = "━" * 60
+
+
+def _render_product_stock(result: dict) -> str:
+    product = result['product']
+    return "\n".join((
+        "",
+        f"📦 Stock Information for: {product['name']}",
+        "━" * 33,
+        f"SKU Code: {product['sku_code']}",
+        f"Total Stock: {result['total_stock']} {product['unit_of_measure']}",
+        f"Total Value: ${result['total_value']:,.2f}",
+        "        ",
+    ))
+
+
+def _render_multi_product_stock(result: dict) -> str:
+    rows = result['rows']
+    width = max(len("Product"), *(len(row['name']) for row in rows))
+    lines = [
+        f"📦 Stock Information for {len(rows)} Products",
+        RULE,
+        f"{'Product':<{width}}  {'SKU':<12}  {'Stock':>16}  {'Value':>14}",
+    ]
+    for row in rows:
+        stock = f"{row['total_stock']} {row['unit_of_measure']}"
+        value = f"${row['total_value']:,.2f}"
+        lines.append(f"{row['name']:<{width}}  {row['sku_code']:<12}  {stock:>16}  {value:>14}")
+    lines.append(RULE)
+    lines.append(f"📊 TOTAL VALUE: ${result['total_value']:,.2f}")
+    if result['not_found']:
+        lines.append(f"❓ Not found: {', '.join(result['not_found'])}")
+    if result.get('skipped'):
+        lines.append(_skipped_note(result['skipped']))
+    return "\n".join(lines) + "\n"
+
+
+def _skipped_note(skipped: list) -> str:
+    return f"⚠️ Only the first {MAX_BATCH_PRODUCTS} products are looked up at once; skipped: {', '.join(skipped)}"
+
+
+def _site_prefix(row: dict) -> str:
+    return f"[{row['site']}] " if 'site' in row else ""
+
+
+def _with_partial_note(lines: list, result: dict) -> str:
+    note = _partial_note(result.get('failed_sites'))
+    return "\n".join(lines + [note] if note else lines) + "\n"
+
+
+def _render_product_location(result: dict) -> str:
+    lines = [f"🏭 {result['product']['name']} - Warehouse Locations", RULE]
+    for stock in result['rows']:
+        lines.append(f"📍 {_site_prefix(stock)}{stock['warehouse_name']} → {stock['location_name']}")
+        lines.append(f"   Quantity: {stock['quantity']} {stock['unit_of_measure']}")
+    return _with_partial_note(lines, result)
+
+
+def _render_low_stock(result: dict) -> str:
+    lines = [f"⚠️ Low Stock Alert - Products Below {result['threshold']} Units", RULE]
+    for product in result['rows']:
+        lines.append(f"🔴 {_site_prefix(product)}{product['name']} (SKU: {product['sku_code']})")
+        lines.append(f"   Current Stock: {product['current_stock']} units")
+        lines.append("   Status: CRITICAL - Reorder needed!")
+        lines.append("")
+    return _with_partial_note(lines, result)
+
+
+def _render_warehouse_summary(result: dict) -> str:
+    lines = ["🏢 Warehouse Inventory Summary", RULE]
+    for warehouse in result['rows']:
+        lines.append(f"📦 {_site_prefix(warehouse)}{warehouse['warehouse_name']}")
+        lines.append(f"   Total Products: {warehouse['total_products']}")
+        lines.append(f"   Total Units: {warehouse['total_units']}")
+        lines.append(f"   Total Value: ${warehouse['total_value']:,.2f}")
+        lines.append("")
+    lines.append(RULE)
+    lines.append(f"📊 TOTAL: {result['total_units']} units | ${result['total_value']:,.2f} value")
+    return _with_partial_note(lines, result)
+
+
+def _render_general_stats(result: dict) -> str:
+    margins = result.get('margins', {})
+    
+    def figure(field: str) -> str:
+        if field not in margins:
+            return f"{result[field]}"
+        return f"~{result[field]:,} (± {margins[field]:,})"
+    
+    lines = [
+        "📊 Inventory System Statistics",
+        RULE,
+        f"📦 Total Products: {figure('total_products')}",
+        f"📍 Total Units in Stock: {figure('total_stock_units')}",
+        f"🏢 Total Warehouses: {figure('total_warehouses')}",
+    ]
+    if result.get('approximate'):
+        lines.append("ℹ️ Estimated from table statistics and a sample (95% bounds). Ask for exact statistics for a full count.")
+    return "\n".join(lines) + "\n"
+
+
+def _render_product_list(result: dict) -> str:
+    lines = ["📋 All Products in Inventory", RULE]
+    for i, product in enumerate(result['rows'], 1):
+        lines.append(f"{i}. {product['name']}")
+        lines.append(f"   SKU: {product['sku_code']}")
+        lines.append(f"   Unit: {product['unit_of_measure']}")
+        if product['category_name']:
+            lines.append(f"   Category: {product['category_name']}")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def _render_value_breakdown(result: dict) -> str:
+    lines = ["💰 Inventory Value by Category and Warehouse", RULE]
+    for row in result['rows']:
+        lines.append(f"🏷️ {row['category_name']} @ {row['warehouse_name']}")
+        lines.append(f"   Units: {row['total_units']} | Value: ${row['total_value']:,.2f}")
+        lines.append("")
+    lines.append(RULE)
+    lines.append(f"📊 TOTAL: {result['total_units']} units | ${result['total_value']:,.2f} value")
+    return "\n".join(lines) + "\n"
+
+
+MOVE_ICONS = {"receipt": "📥", "delivery": "📤", "transfer": "🔀", "adjustment": "🛠️"}
+
+
+def _render_movement_history(result: dict) -> str:
+    subject = f" for {result['product']['name']}" if result['product'] else ""
+    lines = [f"🔄 Stock Movements{subject} - Last {result['days']} Days", RULE]
+    for row in result['by_type']:
+        icon = MOVE_ICONS.get(row['type'], "•")
+        lines.append(f"{icon} {row['type'].title()}: {row['moves']} moves, {row['units']} units")
+    if not result['product'] and result['top_products']:
+        lines.append("")
+        lines.append("🔝 Most Moved Products")
+        for i, product in enumerate(result['top_products'], 1):
+            lines.append(
+                f"   {i}. {product['name']} (SKU: {product['sku_code']}): "
+                f"{product['moves']} moves, net {product['net_change']:+} {product['unit_of_measure']}"
+            )
+    lines.append(RULE)
+    lines.append(f"📊 TOTAL: {result['total_moves']} moves")
+    if result.get('archived'):
+        lines.append(_archived_note(result['archived']))
+    return "\n".join(lines) + "\n"
+
+
+def _archived_note(archived: list) -> str:
+    months = ", ".join(row['month'] for row in archived)
+    return f"🗄️ Not included: {sum(row['moves'] for row in archived)} archived moves ({months})"
+
+
+def _render_stockout_forecast(result: dict) -> str:
+    if result['product']:
+        lines = [f"📈 Demand Forecast for {result['product']['name']}", RULE]
+    else:
+        lines = [f"📉 Projected Stock-outs - Next {result['days']} Days", RULE]
+    for row in result['rows']:
+        lines.append(f"{'🔴' if row['days_left'] is not None and row['days_left'] <= result['days'] else '🟢'} "
+                     f"{row['name']} (SKU: {row['sku_code']})")
+        lines.append(f"   Stock: {row['stock']} {row['unit_of_measure']} | Demand: {row['daily_demand']}/day")
+        if row['stockout_date']:
+            lines.append(f"   Runs out in {row['days_left']} days ({row['stockout_date']})")
+        else:
+            lines.append("   No recent deliveries - not projected to run out")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def _render_rebalance(result: dict) -> str:
+    subject = f" for {result['product']['name']}" if result['product'] else ""
+    lines = [f"🔀 Suggested Internal Transfers{subject}", RULE]
+    for line in result['rows']:
+        source, target = line['from'], line['to']
+        lines.append(f"📦 {line['name']} (SKU: {line['sku_code']}): {line['quantity']} {line['unit_of_measure']}")
+        lines.append(f"   From: {source['warehouse_name']} / {source['location_name']}")
+        lines.append(f"   To:   {target['warehouse_name']} / {target['location_name']}"
+                     + ("" if line['same_warehouse'] else "  (other warehouse)"))
+        lines.append("")
+    if result['total_lines'] > len(result['rows']):
+        lines.append(f"... and {result['total_lines'] - len(result['rows'])} smaller transfers")
+    if result['unmet']:
+        lines.append("⚠️ Still short after transfers (reorder needed):")
+        for entry in result['unmet']:
+            lines.append(f"   🔴 {entry['name']}: {entry['quantity']} {entry['unit_of_measure']}")
+    lines.append(RULE)
+    lines.append(f"📊 TOTAL: {result['total_lines']} transfers | {result['total_units']} units "
+                 f"| {result['cross_warehouse_lines']} between warehouses")
+    return "\n".join(lines) + "\n"
+
+
+RENDERERS = {
+    "product_stock": _render_product_stock,
+    "multi_product_stock": _render_multi_product_stock,
+    "product_location": _render_product_location,
+    "low_stock": _render_low_stock,
+    "warehouse_summary": _render_warehouse_summary,
+    "general_stats": _render_general_stats,
+    "list_products": _render_product_list,
+    "value_breakdown": _render_value_breakdown,
+    "movement_history": _render_movement_history,
+    "stockout_forecast": _render_stockout_forecast,
+    "rebalance": _render_rebalance,
+}
+
+
+@timed(STAGE_SECONDS, "format")
+def render_text(result: dict) -> str:
+    """
+    Render a structured tool result as chat text
+    
+    Args:
+        result: Result from one of the *_data functions
+        
+    Returns:
+        Human-readable response
+    """
+    if result["status"] != "ok":
+        return result["message"]
+    return RENDERERS[result["tool"]](result)
+
+
+# Tool Functions for LangChain
+
+def query_product_stock(product_name: str) -> str:
+    """
+    Query the total stock level of a product
+    Handles fuzzy matching for product names
+    
+    Example queries:
+    - "How much Aluminium do we have?"
+    - "What's the stock of aluminum?"
+    - "Show me alumminum inventory"
+    
+    Args:
+        product_name: Product name (case-insensitive, handles typos)
+        
+    Returns:
+        Formatted string with stock information
+    """
+    return render_text(product_stock_data(product_name))
+
+
+def query_multi_product_stock(product_names: list) -> str:
+    """
+    Query the total stock of several products in one table
+    
+    Example queries:
+    - "Stock of aluminium, copper, steel and brass"
+    - "How much copper and steel do we have?"
+    
+    Args:
+        product_names: Product names (fuzzy matched)
+        
+    Returns:
+        Formatted table with one line per product
+    """
+    return render_text(multi_product_stock_data(product_names))
+
+
+def query_product_by_warehouse(product_name: str) -> str:
+    """
+    Query stock levels of a product broken down by warehouse and location
+    Useful for logistics and fulfillment questions
+    
+    Example queries:
+    - "Where is the aluminium stored?"
+    - "Show me alumminum in all warehouses"
+    - "Which warehouse has aluminum?"
+    
+    Args:
+        product_name: Product name (fuzzy matched)
+        
+    Returns:
+        Formatted string with warehouse breakdown
+    """
+    return render_text(product_by_warehouse_data(product_name))
+
+
+def query_low_stock_products(threshold: int = 50) -> str:
+    """
+    Query products that have stock below a certain threshold
+    Useful for inventory management and reordering
+    
+    Example queries:
+    - "What products are running low on stock?"
+    - "Show me products with less than 50 units"
+    - "Which items need reordering?"
+    
+    Args:
+        threshold: Stock level threshold (default: 50 units)
+        
+    Returns:
+        Formatted string with low stock products
+    """
+    return render_text(low_stock_products_data(threshold))
+
+
+def query_warehouse_summary() -> str:
+    """
+    Query inventory summary across all warehouses
+    Provides overview of inventory distribution
+    
+    Example queries:
+    - "Show me warehouse inventory summary"
+    - "How much inventory do we have in each warehouse?"
+    - "Total inventory overview"
+    
+    Returns:
+        Formatted string with warehouse summaries
+    """
+    return render_text(warehouse_summary_data())
 
 
 def query_general_statistics() -> str:
@@ -258,22 +1003,7 @@ def query_general_statistics() -> str:
     Returns:
         Formatted string with statistics
     """
-    try:
-        connector = get_connector()
-        
-        stats = connector.get_statistics()
-        
-        result = "📊 Inventory System Statistics\n"
-        result += "━" * 60 + "\n"
-        result += f"📦 Total Products: {stats['total_products']}\n"
-        result += f"📍 Total Units in Stock: {stats['total_stock_units']}\n"
-        result += f"🏢 Total Warehouses: {stats['total_warehouses']}\n"
-        
-        return result
-    
-    except Exception as e:
-        logger.error(f"Error querying statistics: {e}")
-        return f"❌ Error retrieving statistics: {str(e)}"
+    return render_text(general_statistics_data())
 
 
 def list_all_products() -> str:
@@ -289,30 +1019,76 @@ def list_all_products() -> str:
     Returns:
         Formatted string with all products
     """
-    try:
-        connector = get_connector()
-        
-        products = connector.get_all_products()
-        
-        if not products:
-            return "⚠️ No products found in inventory."
-        
-        result = "📋 All Products in Inventory\n"
-        result += "━" * 60 + "\n"
+    return render_text(all_products_data())
+
+
+def query_value_breakdown() -> str:
+    """
+    Query inventory value by product category and warehouse
+    Runs on the embedded columnar store, not on Postgres
+    
+    Example queries:
+    - "What is our inventory value by category?"
+    - "Break down stock value per warehouse and category"
+    
+    Returns:
+        Formatted string with value per category and warehouse
+    """
+    return render_text(value_breakdown_data())
+
+
+def query_movement_history(product_name: str = None, days: int = 30) -> str:
+    """
+    Query recent stock movements (receipts, deliveries, transfers, adjustments)
+    Runs on the embedded columnar store, not on Postgres
+    
+    Example queries:
+    - "What moved in the last 30 days?"
+    - "Show me the movement history of laptops"
+    
+    Args:
+        product_name: Limit to one product (fuzzy matched), optional
+        days: Number of days to look back (default: 30)
         
-        for i, product in enumerate(products, 1):
-            result += f"{i}. {product['name']}\n"
-            result += f"   SKU: {product['sku_code']}\n"
-            result += f"   Unit: {product['unit_of_measure']}\n"
-            if product['category_name']:
-                result += f"   Category: {product['category_name']}\n"
-            result += "\n"
+    Returns:
+        Formatted string with movement totals
+    """
+    return render_text(movement_history_data(product_name, days))
+
+
+def query_stockout_forecast(product_name: str = None, days: int = None) -> str:
+    """
+    Query which products will run out soon at their forecast daily demand
+    
+    Example queries:
+    - "What will we run out of next week?"
+    - "When will copper run out?"
+    
+    Args:
+        product_name: Forecast for one product (fuzzy matched), optional
+        days: Horizon in days (default: FORECAST_HORIZON_DAYS)
         
-        return result
+    Returns:
+        Formatted string with projected stock-out dates
+    """
+    return render_text(stockout_forecast_data(product_name, days))
+
+
+def query_rebalance_transfers(product_name: str = None) -> str:
+    """
+    Suggest internal transfers that fix stock imbalances between locations
     
-    except Exception as e:
-        logger.error(f"Error listing products: {e}")
-        return f"❌ Error retrieving products: {str(e)}"
+    Example queries:
+    - "Suggest transfers to rebalance stock"
+    - "How should we rebalance the laptops?"
+    
+    Args:
+        product_name: Rebalance one product (fuzzy matched), optional
+        
+    Returns:
+        Formatted string with the proposed transfer lines
+    """
+    return render_text(rebalance_transfers_data(product_name))
 
 
 # Tool definitions for LangChain
@@ -332,6 +1108,22 @@ TOOLS = [
             "required": ["product_name"]
         }
     },
+    {
+        "name": "query_multi_product_stock",
+        "description": "Query the total stock of several products at once, as one table. Use this when user asks about the stock of two or more products.",
+        "func": query_multi_product_stock,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "product_names": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "The names of the products to query"
+                }
+            },
+            "required": ["product_names"]
+        }
+    },
     {
         "name": "query_product_by_warehouse",
         "description": "Query stock levels of a product broken down by warehouse and location. Use this when user asks where a product is located or stored.",
@@ -388,5 +1180,67 @@ TOOLS = [
             "type": "object",
             "properties": {}
         }
+    },
+    {
+        "name": "query_value_breakdown",
+        "description": "Query inventory value by product category and warehouse. Use this for value or category breakdown questions.",
+        "func": query_value_breakdown,
+        "input_schema": {
+            "type": "object",
+            "properties": {}
+        }
+    },
+    {
+        "name": "query_movement_history",
+        "description": "Query recent stock movements (receipts, deliveries, transfers, adjustments), overall or for one product.",
+        "func": query_movement_history,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "product_name": {
+                    "type": "string",
+                    "description": "The name of the product to query (optional)"
+                },
+                "days": {
+                    "type": "integer",
+                    "description": "Number of days to look back (default: 30)"
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "query_stockout_forecast",
+        "description": "Forecast daily demand and list the products projected to run out within a number of days, or when one product will run out.",
+        "func": query_stockout_forecast,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "product_name": {
+                    "type": "string",
+                    "description": "The name of the product to forecast (optional)"
+                },
+                "days": {
+                    "type": "integer",
+                    "description": "Horizon in days (default: 7)"
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "query_rebalance_transfers",
+        "description": "Propose internal transfers that move stock from locations above their minimum to locations below it, same warehouse first.",
+        "func": query_rebalance_transfers,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "product_name": {
+                    "type": "string",
+                    "description": "The name of the product to rebalance (optional)"
+                }
+            },
+            "required": []
+        }
     }
 ]
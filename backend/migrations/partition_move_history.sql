@@ -0,0 +1,158 @@
+-- ==============================================
+-- MOVE HISTORY PARTITIONING
+-- Converts move_history into a table range-partitioned by month on
+-- move_timestamp. Queries bounded by move_timestamp only scan the matching
+-- months, and old months can be detached and archived whole
+-- (see ai-backend/history_archive.py).
+--
+-- Run once after complete_database.sql:
+--   psql -h localhost -U postgres -d stockmaster -f migrations/partition_move_history.sql
+-- Safe to re-run: the conversion is skipped when move_history is already partitioned.
+-- ==============================================
+
+BEGIN;
+
+-- ==============================================
+-- PARTITION HELPERS
+-- ==============================================
+
+-- Creates the partition holding one calendar month, e.g. move_history_y2025m03.
+-- Each partition inherits the parent's indexes, including the BRIN index.
+CREATE OR REPLACE FUNCTION create_move_history_partition(month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    range_start DATE := date_trunc('month', month)::DATE;
+    range_end DATE := (date_trunc('month', month) + INTERVAL '1 month')::DATE;
+    partition_name TEXT := 'move_history_' || to_char(range_start, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF move_history FOR VALUES FROM (%L) TO (%L)',
+            partition_name, range_start, range_end
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Creates partitions from the current month up to months_ahead months ahead,
+-- so inserts never land in the default partition
+CREATE OR REPLACE FUNCTION ensure_move_history_partitions(months_ahead INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+    month DATE;
+    created INTEGER := 0;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', CURRENT_DATE),
+            date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead),
+            INTERVAL '1 month'
+        )::DATE
+    LOOP
+        IF to_regclass('move_history_' || to_char(month, '"y"YYYY"m"MM')) IS NULL THEN
+            PERFORM create_move_history_partition(month);
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==============================================
+-- CONVERSION
+-- ==============================================
+
+DO $$
+DECLARE
+    first_month DATE;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('move_history')
+    ) THEN
+        RAISE NOTICE 'move_history is already partitioned';
+        RETURN;
+    END IF;
+
+    -- Keep writers out while rows are copied
+    LOCK TABLE move_history IN ACCESS EXCLUSIVE MODE;
+
+    ALTER TABLE move_history RENAME TO move_history_unpartitioned;
+    ALTER INDEX IF EXISTS move_history_pkey RENAME TO move_history_unpartitioned_pkey;
+    DROP INDEX IF EXISTS idx_move_history_product;
+    DROP INDEX IF EXISTS idx_move_history_transaction_ref;
+    DROP INDEX IF EXISTS idx_move_history_timestamp;
+
+    -- The partition key must be part of the primary key, and NOT NULL
+    CREATE TABLE move_history (
+        move_id INTEGER NOT NULL DEFAULT nextval('move_history_move_id_seq'),
+        transaction_ref VARCHAR(100) NOT NULL,
+        transaction_type VARCHAR(50) NOT NULL CHECK (transaction_type IN ('receipt', 'delivery', 'transfer', 'adjustment')),
+        product_id INTEGER NOT NULL REFERENCES products(product_id) ON DELETE RESTRICT,
+        from_location_id INTEGER REFERENCES locations(location_id) ON DELETE RESTRICT,
+        to_location_id INTEGER REFERENCES locations(location_id) ON DELETE RESTRICT,
+        quantity_change DECIMAL(12,4) NOT NULL,
+        unit_of_measure VARCHAR(50) NOT NULL,
+        move_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        responsible_user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE RESTRICT,
+        description TEXT,
+        PRIMARY KEY (move_id, move_timestamp)
+    ) PARTITION BY RANGE (move_timestamp);
+
+    ALTER SEQUENCE move_history_move_id_seq OWNED BY move_history.move_id;
+
+    -- Rows outside every monthly partition land here instead of failing
+    CREATE TABLE move_history_default PARTITION OF move_history DEFAULT;
+
+    SELECT date_trunc('month', COALESCE(MIN(move_timestamp), CURRENT_TIMESTAMP))::DATE
+    INTO first_month
+    FROM move_history_unpartitioned;
+
+    PERFORM create_move_history_partition(month::DATE)
+    FROM generate_series(first_month, date_trunc('month', CURRENT_DATE), INTERVAL '1 month') AS month;
+    PERFORM ensure_move_history_partitions(3);
+
+    INSERT INTO move_history
+    SELECT
+        move_id, transaction_ref, transaction_type, product_id,
+        from_location_id, to_location_id, quantity_change, unit_of_measure,
+        COALESCE(move_timestamp, CURRENT_TIMESTAMP), responsible_user_id, description
+    FROM move_history_unpartitioned;
+
+    DROP TABLE move_history_unpartitioned;
+END;
+$$;
+
+-- ==============================================
+-- INDEXES
+-- ==============================================
+
+-- move_timestamp grows with insertion order, so a BRIN index stays a few
+-- pages per partition where a B-tree grows with every row
+CREATE INDEX IF NOT EXISTS idx_move_history_timestamp_brin
+    ON move_history USING BRIN (move_timestamp);
+CREATE INDEX IF NOT EXISTS idx_move_history_product
+    ON move_history (product_id, move_timestamp);
+CREATE INDEX IF NOT EXISTS idx_move_history_transaction_ref
+    ON move_history (transaction_ref);
+
+-- ==============================================
+-- ARCHIVE INDEX
+-- One row per partition moved out of the database by the retention job
+-- ==============================================
+
+CREATE TABLE IF NOT EXISTS move_history_archive (
+    partition_name VARCHAR(63) PRIMARY KEY,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    row_count BIGINT NOT NULL,
+    file_path TEXT NOT NULL,
+    checksum VARCHAR(64) NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_move_history_archive_range
+    ON move_history_archive (range_start, range_end);
+
+COMMIT;
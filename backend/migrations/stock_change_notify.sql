@@ -0,0 +1,67 @@
+-- ==============================================
+-- STOCK CHANGE NOTIFICATIONS
+-- Publishes a compact JSON payload on the stock_changes channel whenever a
+-- stock level changes or a move is recorded, so listeners (see
+-- ai-backend/change_feed.py) are told about changes instead of polling.
+-- Notifications are delivered when the transaction commits, never for
+-- rolled-back changes.
+--
+-- Run after complete_database.sql (and after partition_move_history.sql, if
+-- used, since that migration recreates move_history):
+--   psql -h localhost -U postgres -d stockmaster -f migrations/stock_change_notify.sql
+-- Safe to re-run.
+-- ==============================================
+
+BEGIN;
+
+-- One notification per changed stock_levels row. Updates that leave
+-- quantity_on_hand unchanged (e.g. only touching min/max levels) are skipped.
+CREATE OR REPLACE FUNCTION notify_stock_level_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('stock_changes', json_build_object(
+            'table', 'stock_levels', 'op', 'D',
+            'product_id', OLD.product_id, 'location_id', OLD.location_id
+        )::text);
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW.quantity_on_hand IS NOT DISTINCT FROM OLD.quantity_on_hand THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('stock_changes', json_build_object(
+        'table', 'stock_levels', 'op', left(TG_OP, 1),
+        'product_id', NEW.product_id, 'location_id', NEW.location_id,
+        'quantity', NEW.quantity_on_hand
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One notification per recorded move
+CREATE OR REPLACE FUNCTION notify_move_recorded()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('stock_changes', json_build_object(
+        'table', 'move_history', 'op', 'I',
+        'move_id', NEW.move_id, 'product_id', NEW.product_id,
+        'type', NEW.transaction_type, 'quantity', NEW.quantity_change,
+        'from_location_id', NEW.from_location_id, 'to_location_id', NEW.to_location_id
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_stock_levels_change ON stock_levels;
+CREATE TRIGGER notify_stock_levels_change
+    AFTER INSERT OR UPDATE OR DELETE ON stock_levels
+    FOR EACH ROW EXECUTE FUNCTION notify_stock_level_change();
+
+-- On a partitioned move_history the trigger is cloned to every partition,
+-- including ones created later
+DROP TRIGGER IF EXISTS notify_move_history_insert ON move_history;
+CREATE TRIGGER notify_move_history_insert
+    AFTER INSERT ON move_history
+    FOR EACH ROW EXECUTE FUNCTION notify_move_recorded();
+
+COMMIT;